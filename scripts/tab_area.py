@@ -1,12 +1,21 @@
 __author__ = 'Andy'
 
-import arcpy
 import os
+import sys
 import tempfile
 import shutil
 
-# Check out the ArcGIS Spatial Analyst extension license
-arcpy.CheckOutExtension("Spatial")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tbx"))
+import io_backend
+import zonal_engine
+
+try:
+	import arcpy
+
+	# Check out the ArcGIS Spatial Analyst extension license
+	arcpy.CheckOutExtension("Spatial")
+except ImportError:
+	arcpy = None  # only the numpy engine functions can run
 
 
 def tabulate_area_w_overlaps(data, idfield, raster, raster_value, out_tables, cell_size):
@@ -35,7 +44,22 @@ def tabulate_area_w_overlaps(data, idfield, raster, raster_value, out_tables, ce
 			arcpy.Delete_management("featlayer")
 
 		except Exception as e:
-			print e.message
+			print(e)
+
+
+def tabulate_area_numpy(data, idfield, raster, out_table, supersample=4, backend=None, block_size=2048):
+	"""tabulate raster area with overlapping polygons using the numpy zonal engine. Runs with the arcpy or the gdal
+	io_backend (default: arcpy when it can be imported), so it also works outside of ArcGIS. Circular buffers get the
+	exact area of the circle in each cell"""
+	io = io_backend.get_backend(backend)
+	reader, grid, nodata = io.read_raster(raster)
+	ids, polygons = io.read_polygons(data, idfield, io.spatial_reference(raster))
+
+	print("Rasterizing {0} polygons".format(len(ids)))
+	coverage = zonal_engine.rasterize_buffers(grid, ids, polygons, supersample)
+	table = zonal_engine.tabulate_area(coverage, reader, nodata, idfield, block_size=block_size)
+	io.write_table(table, out_table)
+	return table
 
 
 def polys2rasters(input_polgyons, idfield, output_folder, cell_size):
@@ -60,7 +84,7 @@ def polys2rasters(input_polgyons, idfield, output_folder, cell_size):
 
 		except Exception as e:
 			errorLog = r'C:\Users\Andy\Documents\gnlm-rfm\log.txt'
-			print e.message
+			print(e)
 			try:
 				with open(errorLog,'a') as errorMsg:
 					errorMsg.write("%s,%s\n" % (fid, e.message))
@@ -96,17 +120,17 @@ def get_list_of_rasters(folder):
 def rasters_tab_area(rasterlist, rasterlist_zone_field, in_class_data, class_field, final_out_table, processing_cell_size):
 
 	scratch = tempwork()
-	print scratch
+	print(scratch)
 
 	for raster in rasterlist:
 		base = os.path.basename(raster)
-		print base
+		print(base)
 		tmp_table = os.path.join(scratch, base)
 		try:
 			arcpy.sa.TabulateArea(raster, rasterlist_zone_field, in_class_data, class_field, tmp_table, processing_cell_size)
 		except Exception as e:
 			errorLog = r'C:\Users\Andy\Documents\gnlm-rfm\log.txt'
-			print e.message
+			print(e)
 			try:
 				with open(errorLog,'a') as errorMsg:
 					errorMsg.write("%s,%s\n" % (raster, e.message))
@@ -119,7 +143,7 @@ def rasters_tab_area(rasterlist, rasterlist_zone_field, in_class_data, class_fie
 
 def tempwork():
 	arcpy.env.scratchWorkspace = tempfile.mkdtemp()
-	print "Scratch workspace: %s" % arcpy.env.scratchWorkspace
+	print("Scratch workspace: %s" % arcpy.env.scratchWorkspace)
 	scratch = arcpy.env.scratchGDB
 	return scratch
 
@@ -0,0 +1,58 @@
+"""Overlap graph of equal radius buffers straight from the buffer centers.
+
+Two circles of radius r overlap when their centers are less than 2r apart,
+so the overlapping pairs are found with a grid hash of the centers (cells
+2r wide) instead of a polygon overlay with PolygonNeighbors.
+"""
+import numpy
+
+
+def _expand_ranges(starts, stops):
+    """Concatenation of numpy.arange(start, stop) for every pair."""
+    lengths = stops - starts
+    total = lengths.sum()
+    if total == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    offsets = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths)
+    return offsets + numpy.arange(total, dtype=numpy.int64)
+
+
+def pairs_within(x, y, distance):
+    """Index pairs (i, j), i < j, of the points less than distance apart."""
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    n = x.size
+    if n < 2:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+
+    # hash the points into square cells one distance wide
+    cx = numpy.floor((x - x.min()) / distance).astype(numpy.int64)
+    cy = numpy.floor((y - y.min()) / distance).astype(numpy.int64)
+    ncx = cx.max() + 3  # room for the neighbouring cell offsets
+    key = (cy + 1) * ncx + (cx + 1)
+    order = numpy.argsort(key, kind="mergesort")
+    sorted_key = key[order]
+
+    first, second = [], []
+    # every pair is within the same or one of the 8 neighbouring cells
+    for dx, dy in [(-1, -1), (0, -1), (1, -1), (-1, 0), (0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]:
+        target = key + dy * ncx + dx
+        lo = numpy.searchsorted(sorted_key, target, side="left")
+        hi = numpy.searchsorted(sorted_key, target, side="right")
+        i = numpy.repeat(numpy.arange(n), hi - lo)
+        j = order[_expand_ranges(lo, hi)]
+        keep = i < j
+        i, j = i[keep], j[keep]
+        keep = (x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2 < distance * distance
+        first.append(i[keep])
+        second.append(j[keep])
+    return numpy.concatenate(first), numpy.concatenate(second)
+
+
+def circle_overlaps(fids, x, y, radius):
+    """Source and neighbour ids of every overlapping pair of buffers, in
+    both directions like PolygonNeighbors with BOTH_SIDES."""
+    fids = numpy.asarray(fids)
+    # a hair under 2r so buffers that only touch are not neighbours
+    i, j = pairs_within(x, y, 2.0 * radius * (1 - 1e-9))
+    return numpy.concatenate((fids[i], fids[j])), numpy.concatenate((fids[j], fids[i]))
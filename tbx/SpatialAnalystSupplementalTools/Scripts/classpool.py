@@ -0,0 +1,104 @@
+"""Runs the color classes of the zonal tools on a pool of processes.
+
+The features of a color class do not overlap, so every class, and every
+spatial tile of a class, is an independent run of the Spatial Analyst tool.
+Each run gets its own scratch workspace and writes its own zone_<n>.dbf to
+the temporary folder of the tool, which merges the tables at the end.
+"""
+import multiprocessing
+import os
+import sys
+import numpy
+
+
+def split_classes(classes, fids, x, y, pieces):
+    """Split the color classes into about pieces lists of ids.
+
+    Classes larger than their share of the pieces are cut into tiles of
+    neighbouring features (strips in x, then runs in y) so each run only
+    reads a compact part of the raster. Returns a list of id lists.
+    """
+    fids = numpy.asarray(fids)
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    position = dict((fid, i) for i, fid in enumerate(fids.tolist()))
+    size = max(int(numpy.ceil(fids.size / float(max(pieces, 1)))), 1)
+
+    result = []
+    for cl in sorted(classes):
+        ix = numpy.array(sorted(position[fid] for fid in classes[cl]), dtype=numpy.int64)
+        n_tiles = int(numpy.ceil(ix.size / float(size)))
+        if n_tiles <= 1:
+            result.append(fids[ix].tolist())
+            continue
+        strips = int(numpy.ceil(numpy.sqrt(n_tiles)))
+        ix = ix[numpy.argsort(x[ix], kind="mergesort")]
+        for strip in numpy.array_split(ix, strips):
+            strip = strip[numpy.argsort(y[strip], kind="mergesort")]
+            for tile in numpy.array_split(strip, int(numpy.ceil(strip.size / float(size)))):
+                result.append(fids[tile].tolist())
+    return result
+
+
+def where_clause(oid_field, ids):
+    """Selection of the ids, same form as the single process loop."""
+    cl_separator = ' OR \"%s\" = ' % oid_field
+    return '\"%s\" = %s' % (oid_field, cl_separator.join(map(str, ids)))
+
+
+def run_piece(job):
+    """Worker: runs arcpy.sa.<tool> on one piece in its own scratch
+    workspace. Returns (output table or None, messages)."""
+    tool, features, where, args, scratch = job
+    import arcpy
+    arcpy.CheckOutExtension("Spatial")
+    if not os.path.exists(scratch):
+        os.mkdir(scratch)
+    arcpy.env.scratchWorkspace = scratch
+    arcpy.env.workspace = scratch
+    arcpy.env.overwriteOutput = True
+
+    temp_lyr = "temp_layer_%s" % os.path.basename(scratch)
+    arcpy.MakeFeatureLayer_management(features, temp_lyr, where)
+    try:
+        getattr(arcpy.sa, tool)(temp_lyr, *args)
+        return _output(tool, args), arcpy.GetMessages(0)
+    except Exception as e:
+        return None, "%s\n%s" % (e, arcpy.GetMessages(0))
+    finally:
+        arcpy.Delete_management(temp_lyr)
+
+
+def _output(tool, args):
+    """Output table argument of the tool."""
+    return args[3] if tool == "TabulateArea" else args[2]
+
+
+def worker_executable():
+    """Python of the worker processes, None for the default. On Windows
+    inside ArcMap/ArcGIS Pro sys.executable is the application, so the
+    workers run the pythonw.exe (or python.exe) of its Python install."""
+    if os.name != "nt" or \
+            os.path.basename(sys.executable).lower().startswith("python"):
+        return None
+    for name in ("pythonw.exe", "python.exe"):
+        executable = os.path.join(sys.exec_prefix, name)
+        if os.path.exists(executable):
+            return executable
+    return None
+
+
+def run(jobs, workers, worker=run_piece):
+    """Runs the jobs (tool, features, where clause, tool arguments after
+    the zone layer, scratch folder) on a pool of workers processes, each
+    job with the worker function. Returns the list of (output table or
+    None, messages) in the order of the jobs."""
+    executable = worker_executable()
+    if executable:
+        multiprocessing.set_executable(executable)
+    pool = multiprocessing.Pool(min(workers, len(jobs)))
+    try:
+        return pool.map(worker, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
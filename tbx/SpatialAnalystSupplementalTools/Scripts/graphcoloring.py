@@ -0,0 +1,155 @@
+"""Deterministic coloring of the overlap graph of zone features.
+
+Each color is a class of features that do not overlap, so the zonal tools
+run one pass per color. Colors are assigned with DSATUR, or with a lattice
+coloring when the zones are equal radius buffers around points on a
+regular grid (used directly when it is optimal, otherwise only when it
+needs no more colors than DSATUR). The same input always gives the same
+classes.
+"""
+import heapq
+import numpy
+
+
+def adjacency(nodes, src, nbr):
+    """CSR (indptr, indices) adjacency lists of the symmetric overlap graph
+    on the sorted node ids. Degrees come from one bincount."""
+    nodes = numpy.asarray(nodes)
+    n = nodes.size
+    src_ix = numpy.searchsorted(nodes, src).astype(numpy.int64)
+    nbr_ix = numpy.searchsorted(nodes, nbr).astype(numpy.int64)
+    # both directions of every edge without duplicates or self loops
+    pairs = numpy.unique(numpy.concatenate((src_ix * n + nbr_ix, nbr_ix * n + src_ix)))
+    first, second = pairs // n, pairs % n
+    keep = first != second
+    first, second = first[keep], second[keep]
+    degree = numpy.bincount(first, minlength=n)
+    indptr = numpy.concatenate(([0], numpy.cumsum(degree)))
+    return indptr, second
+
+
+def dsatur(n, indptr, indices):
+    """DSATUR coloring of a graph with n nodes in CSR form.
+
+    The uncolored node with the most distinctly colored neighbors is colored
+    next (ties go to the higher degree, then the lower index) with the
+    smallest color not used by its neighbors. Returns colors starting at 1.
+    """
+    degree = numpy.diff(indptr)
+    colors = numpy.zeros(n, dtype=numpy.int64)
+    nbr_colors = [set() for i in range(n)]
+    heap = [(0, -int(degree[i]), i) for i in range(n)]
+    heapq.heapify(heap)
+    while heap:
+        sat, deg, node = heapq.heappop(heap)
+        if colors[node] or -sat != len(nbr_colors[node]):
+            continue  # already colored or stale saturation
+        used = nbr_colors[node]
+        color = 1
+        while color in used:
+            color += 1
+        colors[node] = color
+        for nbr in indices[indptr[node]:indptr[node + 1]]:
+            if not colors[nbr] and color not in nbr_colors[nbr]:
+                nbr_colors[nbr].add(color)
+                heapq.heappush(heap, (-len(nbr_colors[nbr]), -int(degree[nbr]), int(nbr)))
+    return colors
+
+
+def equal_radius(width, height, area, tolerance=0.01):
+    """Radius when every zone is a circle of the same size, else None."""
+    width = numpy.asarray(width, dtype=float)
+    height = numpy.asarray(height, dtype=float)
+    area = numpy.asarray(area, dtype=float)
+    if width.size == 0:
+        return None
+    r = width / 2.0
+    circles = (numpy.abs(height / width - 1) < tolerance) & \
+        (numpy.abs(area / (numpy.pi * r * r) - 1) < tolerance)
+    if not circles.all() or numpy.ptp(r) > tolerance * r.mean():
+        return None
+    return float(r.mean())
+
+
+def lattice_indices(x, y, tolerance=0.01, noise=1e-6):
+    """Column and row index of each point when the points are on a regular
+    square grid, with the grid spacing. Returns None otherwise.
+
+    Centroids of buffer polygons are a little off the grid (float noise of
+    the densified circles), so steps between sorted coordinates under noise
+    times the extent of the points are taken as the same column or row. The
+    spacing is the smallest remaining step and the indices are snapped to
+    within tolerance of a spacing."""
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    if x.size < 2:
+        return None
+    extent = max(numpy.ptp(x), numpy.ptp(y))
+    steps = numpy.concatenate((numpy.diff(numpy.sort(x)), numpy.diff(numpy.sort(y))))
+    steps = steps[steps > noise * extent]
+    if steps.size == 0:
+        return None
+    spacing = steps.min()
+    col = (x - x.min()) / spacing
+    row = (y - y.min()) / spacing
+    if numpy.abs(col - numpy.round(col)).max() > tolerance or \
+            numpy.abs(row - numpy.round(row)).max() > tolerance:
+        return None
+    return numpy.round(col).astype(numpy.int64), numpy.round(row).astype(numpy.int64), spacing
+
+
+def lattice_size(spacing, radius):
+    """Side k of the tile of the lattice coloring and whether k * k colors
+    is optimal (every k x k block of buffers overlaps each other)."""
+    k = max(int(numpy.ceil(2.0 * radius / spacing - 1e-9)), 1)
+    return k, (k - 1) * numpy.sqrt(2.0) * spacing < 2.0 * radius
+
+
+def lattice_colors(col, row, spacing, radius):
+    """Colors for equal radius buffers on a regular grid.
+
+    Buffers only overlap when their centers are less than 2 * radius apart,
+    so points k = ceil(2 * radius / spacing) columns or rows apart never
+    overlap and the color of a point is its position in a k x k tile.
+    Returns colors starting at 1.
+    """
+    k = lattice_size(spacing, radius)[0]
+    return (row % k) * k + (col % k) + 1
+
+
+def color_classes(fids, src, nbr, lattice=None):
+    """Split the features into classes of non overlapping features.
+
+    fids -- every feature id
+    src, nbr -- ids of each pair of overlapping features
+    lattice -- optional (col, row, spacing, radius) when the features are
+               equal radius buffers on a regular grid
+
+    Returns a dict of color -> set of ids and the name of the method used.
+    """
+    fids = numpy.asarray(fids)
+    order = numpy.argsort(fids, kind="mergesort")
+    nodes = fids[order]
+    indptr, indices = adjacency(nodes, src, nbr)
+    colors = None
+
+    if lattice is not None:
+        col, row, spacing, radius = lattice
+        grid_colors = numpy.asarray(lattice_colors(col, row, spacing, radius))[order]
+        # only use the lattice when it is a valid coloring of the overlap graph
+        src_ix = numpy.repeat(numpy.arange(nodes.size), numpy.diff(indptr))
+        if not numpy.any(grid_colors[src_ix] == grid_colors[indices]):
+            if lattice_size(spacing, radius)[1]:
+                colors, method = grid_colors, "lattice"
+            else:
+                colors, method = dsatur(nodes.size, indptr, indices), "DSATUR"
+                if numpy.unique(grid_colors).size <= numpy.unique(colors).size:
+                    colors, method = grid_colors, "lattice"
+
+    if colors is None:
+        colors, method = dsatur(nodes.size, indptr, indices), "DSATUR"
+
+    classes = {}
+    for color in numpy.unique(colors):
+        classes[int(color)] = set(nodes[colors == color].tolist())
+    return classes, method
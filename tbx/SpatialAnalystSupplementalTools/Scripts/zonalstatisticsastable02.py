@@ -1,9 +1,10 @@
 import arcpy
-import collections
+import bufferoverlaps
+import classpool
+import graphcoloring
 import numpy
 import os
 import sys
-import random
 import tempfile
 
 class ZonalStatisticsAsTable02(object):
@@ -75,6 +76,15 @@ class ZonalStatisticsAsTable02(object):
         parameters[-1].filter.list = ['DATA', 'NODATA']
         parameters[-1].value = "DATA"
 
+        parameters.append(arcpy.Parameter(
+            displayName="Number of parallel workers",
+            name="workers",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input"))
+
+        parameters[-1].value = 1
+
         return parameters
 
     def isLicensed(self):
@@ -161,6 +171,7 @@ class ZonalStatisticsAsTable02(object):
         ignore_value = ignore_nodata.valueAsText
         statistic = statistics_type.valueAsText
         output_table = out_table.valueAsText
+        workers = parameters[6].value or 1
 
         # Create temporary directory
         temp_dir = os.path.join(tempfile.gettempdir(), 'zonal')
@@ -205,103 +216,77 @@ class ZonalStatisticsAsTable02(object):
 ##        polygon_table = os.path.join(temp_dir, "polygon_table.dbf")
         polygon_table = os.path.join(arcpy.env.scratchGDB, "polygon_table") #[RDB]
         try:
-            result = arcpy.PolygonNeighbors_analysis(temp_features, polygon_table, \
-            oid_field, "AREA_OVERLAP", "BOTH_SIDES")
-
-            # Retrieve as array with columns src_FID and nbr_FID
-            arr = arcpy.da.TableToNumPyArray(polygon_table, \
-                ['src_%s' % oid_field, 'nbr_%s' % oid_field])
-            arr = numpy.array(arr.tolist())
-
-            # Retrieves the colors of the neighboring nodes
-            def get_colors(nodes, neighbors):
-                colors = set()
-                for neighbor in neighbors:
-                    colors.add(nodes[neighbor][0])
-                colors.difference([0])
-                return colors
-
-            # Create a new color
-            def get_new_color(colors):
-                return max(colors)+1 if len(colors) > 0 else 1
-
-            # Chooses from existing colors randomly
-            def choose_color(colors):
-                return random.choice(list(colors))
-
-            # Sort source FIDs in descending order by number of neighbors
-            arr_uniq = numpy.unique(arr[:,0])
-            arr_count = numpy.zeros_like(arr_uniq)
-            for index in range(arr_uniq.size):
-                arr_count[index] = numpy.count_nonzero(arr[:, 0] == arr_uniq[index])
-            arr_ind = numpy.argsort(arr_count)[::-1]
-
-            # Initialize node dictionary --
-            #   where key := FID of feature (integer)
-            #   where value[0] := color of feature (integer)
-            #   where value[1] := FIDs of neighboring features (set)
-            nodes = collections.OrderedDict()
-            for item in arr_uniq[arr_ind]:
-                nodes[item] = [0, set()]
-            # Populate neighbors
-            for index in range(arr.shape[0]):
-                nodes[arr[index, 0]][1].add(arr[index, 1])
-
-            # Color nodes --
-            colors = set()
-            for node in nodes:
-                # Get colors of neighboring nodes
-                nbr_colors = get_colors(nodes, nodes[node][1])
-                # Search for a color not among those colors
-                choices = colors.difference(nbr_colors)
-                # Assign the node that color or create it when necessary
-                if len(choices) == 0:
-                    new_color = get_new_color(colors)
-                    colors.add(new_color)
-                    nodes[node][0] = new_color
-                else:
-                    nodes[node][0] = choose_color(choices)
-
-            # Classify nodes by colors --
-            classes = {}
-            for node in nodes:
-                color = nodes[node][0]
-                if color in classes:
-                    classes[color].add(node)
-                else:
-                    classes[color] = set([node])
-
-            # Get set of all FIDs
-            all_fids = set()
-            with arcpy.da.SearchCursor(temp_features, oid_field) as cursor:
+            # Get set of all FIDs with the shape of each zone
+            fids, cx, cy, width, height, area = [], [], [], [], [], []
+            with arcpy.da.SearchCursor(temp_features, [oid_field, "SHAPE@"]) as cursor:
                 for row in cursor:
-                    all_fids.add(row[0])
+                    fids.append(row[0])
+                    cx.append(row[1].centroid.X)
+                    cy.append(row[1].centroid.Y)
+                    width.append(row[1].extent.width)
+                    height.append(row[1].extent.height)
+                    area.append(row[1].area)
+
+            lattice = None
+            radius = graphcoloring.equal_radius(width, height, area)
+            if radius is not None:
+                # Equal radius buffers overlap when the centers are < 2r apart
+                src, nbr = bufferoverlaps.circle_overlaps(fids, cx, cy, radius)
+                # ... and on a regular grid can use the lattice coloring
+                indices = graphcoloring.lattice_indices(cx, cy)
+                if indices is not None:
+                    lattice = indices + (radius,)
+            else:
+                result = arcpy.PolygonNeighbors_analysis(temp_features, \
+                    polygon_table, oid_field, "AREA_OVERLAP", "BOTH_SIDES")
 
-            # Add disjoint FIDs to new class if necessary
-            disjoint_fids = all_fids.difference(set(nodes.keys()))
-            if len(disjoint_fids) > 0:
-                new_color = get_new_color(colors)
-                classes[new_color] = disjoint_fids
+                # Retrieve as array with columns src_FID and nbr_FID
+                arr = arcpy.da.TableToNumPyArray(polygon_table, \
+                    ['src_%s' % oid_field, 'nbr_%s' % oid_field])
+                src = arr['src_%s' % oid_field]
+                nbr = arr['nbr_%s' % oid_field]
+
+            # Color the overlap graph, disjoint FIDs share the first class
+            classes, method = graphcoloring.color_classes(fids, src, nbr, lattice)
+            arcpy.AddMessage("Colored %d zones with %d classes (%s)" % \
+                (len(fids), len(classes), method))
 
             # Calculate number of classes
             num_classes = len(classes)
 
-            # Perform zonal statistics for each class
-            temp_lyr = "temp_layer"
-            cl_separator = ' OR \"%s\" = ' % oid_field
-            for index, cl in enumerate(classes):
-                arcpy.SetProgressorLabel(
-                    "Processing layer %d of %d..." % (index+1, num_classes))
-                where_clause = '\"%s\" = %s' % (oid_field, \
-                    cl_separator.join(map(str, classes[cl])))
-                temp_table = os.path.join(temp_dir, "zone_%d.dbf" % index)
-                arcpy.MakeFeatureLayer_management(temp_features, temp_lyr, \
-                    where_clause)
-                try:
-                    arcpy.sa.ZonalStatisticsAsTable(temp_lyr, feature_field, \
-                    value_file, temp_table, ignore_value, statistic)
-                except:
-                    arcpy.GetMessages(0)
+            if workers > 1:
+                # Classes (or tiles of a class) on a pool of processes,
+                # each with its own scratch workspace
+                pieces = classpool.split_classes(classes, fids, cx, cy, workers)
+                arcpy.AddMessage("Processing %d pieces with %d workers" % \
+                    (len(pieces), workers))
+                jobs = []
+                for index, ids in enumerate(pieces):
+                    temp_table = os.path.join(temp_dir, "zone_%d.dbf" % index)
+                    jobs.append(("ZonalStatisticsAsTable", temp_features, \
+                        classpool.where_clause(oid_field, ids), \
+                        (feature_field, value_file, temp_table, ignore_value, statistic), \
+                        os.path.join(temp_dir, "scratch_%d" % index)))
+                for table, msg in classpool.run(jobs, workers):
+                    if table is None:
+                        arcpy.AddWarning(msg)
+            else:
+                # Perform zonal statistics for each class
+                temp_lyr = "temp_layer"
+                cl_separator = ' OR \"%s\" = ' % oid_field
+                for index, cl in enumerate(classes):
+                    arcpy.SetProgressorLabel(
+                        "Processing layer %d of %d..." % (index+1, num_classes))
+                    where_clause = '\"%s\" = %s' % (oid_field, \
+                        cl_separator.join(map(str, classes[cl])))
+                    temp_table = os.path.join(temp_dir, "zone_%d.dbf" % index)
+                    arcpy.MakeFeatureLayer_management(temp_features, temp_lyr, \
+                        where_clause)
+                    try:
+                        arcpy.sa.ZonalStatisticsAsTable(temp_lyr, feature_field, \
+                        value_file, temp_table, ignore_value, statistic)
+                    except:
+                        arcpy.GetMessages(0)
             # Merge tables
             arcpy.env.workspace = temp_dir
             table_list = arcpy.ListTables("zone*")
@@ -5,24 +5,32 @@
 # Created: 7/1/2015
 # ---------------------------------------------------------------------------------------------------
 
-import arcpy
 import os
 import csv
+import sys
+import numpy
 from collections import defaultdict
 
+import io_backend
+
+try:
+	import arcpy  # only needed for the field calculation functions
+except ImportError:
+	arcpy = None
+
 
 # get groups from csv file in format of group1 = ['1', ['class1', 'class2,etc]
 def reclass_groups(reclass_csv_file):
 	"""reclass file should be csv file with headers and in the format of to, from"""
 	data = defaultdict(list)
-	with open(reclass_csv_file, 'rb') as f:
+	with open(reclass_csv_file, 'rb' if sys.version_info[0] < 3 else 'r') as f:
 		reader = csv.reader(f)
 		next(reader)
 		for row in reader:
 			data[row[1]].append(row[0])
 	groups = []
 	for key in data:
-		print key, 'reclass values', data[key]
+		print("%s reclass values %s" % (key, data[key]))
 		group = (key), data[key]
 		groups.append(group)
 	return groups
@@ -58,7 +66,7 @@ def replace_all_null_w_zeros(table):
 
 def calc_group(table, group):
 	fieldname = "GROUP_" + str(group[0])
-	print fieldname
+	print(fieldname)
 	arcpy.AddField_management(table, fieldname, "DOUBLE")
 	try:
 		arcpy.CalculateField_management(table, fieldname, expression(group[1], table), "PYTHON_9.3")
@@ -78,7 +86,7 @@ def total_area(table, wildcard, areafield):
 	for field in fieldlist: # iterate over classes or groups
 		expr = expr + '!' + field.name + '!' + '+'
 	expr = expr[:-1] # removes last plus mark
-	print expr
+	print(expr)
 
 	arcpy.AddField_management(table, areafield, "DOUBLE")
 	try:
@@ -92,12 +100,95 @@ def delete_matching_fields(table, wildcard):
 	fieldnames = []
 	for field in fieldlist:
 		fieldnames.append(field.name)
-	print fieldnames
+	print(fieldnames)
 	arcpy.DeleteField_management(table, fieldnames)
 	return
 
 
-def main(area_table, reclass_csv, output_path, output_name):
+def aggregation_matrix(groups, class_fields):
+	"""class x group matrix with a 1 where the VALUE_<class> field is in the group. Classes without a field in the
+	table are skipped (same as the calc_group expression)"""
+	columns = dict((name, i) for i, name in enumerate(class_fields))
+	matrix = numpy.zeros((len(class_fields), len(groups)))
+	for j, group in enumerate(groups):
+		for item in group[1]:
+			fieldname = "VALUE_" + str(item)
+			if fieldname in columns:
+				matrix[columns[fieldname], j] = 1
+	return matrix
+
+
+def reclass_arrays(area, schemes):
+	"""Reclass of a tabulated area structured array (nulls as nan or zero) in memory for several reclass schemes (list
+	of groups from reclass_groups). The class x group matrices of all schemes are stacked so every GROUP_<group>
+	field of every scheme comes from one matrix product. Returns a table per scheme with the non VALUE_* fields, the
+	GROUP_* fields and GROUP_AREA"""
+	names = area.dtype.names
+	class_fields = [f for f in names if f.upper().startswith("VALUE")]
+	keep_fields = [f for f in names if f not in class_fields]
+
+	values = numpy.zeros((area.size, len(class_fields)), order="F")  # columns are copied one field at a time
+	for i, field in enumerate(class_fields):
+		values[:, i] = area[field]
+	values[numpy.isnan(values)] = 0  # nulls are zero area
+	matrices = [aggregation_matrix(groups, class_fields) for groups in schemes]
+	group_area = values.dot(numpy.hstack(matrices)) if matrices else None
+
+	results = []
+	offset = 0
+	for groups in schemes:
+		group_fields = ["GROUP_" + str(group[0]) for group in groups]
+		dtype = [(f, area.dtype[f]) for f in keep_fields] + [(f, numpy.float64) for f in group_fields + ["GROUP_AREA"]]
+		result = numpy.zeros(area.size, dtype=dtype)
+		for field in keep_fields:
+			result[field] = area[field]
+		for j, field in enumerate(group_fields):
+			result[field] = group_area[:, offset + j]
+		result["GROUP_AREA"] = group_area[:, offset:offset + len(groups)].sum(axis=1)
+		offset += len(groups)
+		results.append(result)
+	return results
+
+
+def reclass_array(area, groups):
+	"""Reclass of a tabulated area structured array for one reclass scheme (see reclass_arrays)"""
+	return reclass_arrays(area, [groups])[0]
+
+
+def main(area_table, reclass_csv, output_path, output_name, backend=None):
+	"""reclass with the arcpy or gdal io_backend (default: arcpy when it can be imported)"""
+	io = backend or io_backend.get_backend()
+
+	# read the area table once (nulls as zeros)
+	area = io.read_table(area_table)
+
+	# get groups from reclass csv file
+	groups = reclass_groups(reclass_csv)
+
+	# sum area for each of the new groups and the total area, without the old classes
+	io.write_table(reclass_array(area, groups), os.path.join(output_path, output_name))
+
+
+def batch(area_tables, reclass_csvs, output_path, backend=None, extension=""):
+	"""Reclass every area table with every reclass csv. Each table is read once and all of the schemes are applied
+	with one matrix product. Outputs are named <area table>_<reclass csv><extension> (like .dbf or .csv when the output
+	path is a folder). Returns the list of output tables"""
+	io = backend or io_backend.get_backend()
+	schemes = [reclass_groups(reclass_csv) for reclass_csv in reclass_csvs]
+	outputs = []
+	for area_table in area_tables:
+		area = io.read_table(area_table)
+		table_name = os.path.splitext(os.path.basename(area_table))[0]
+		for reclass_csv, result in zip(reclass_csvs, reclass_arrays(area, schemes)):
+			scheme_name = os.path.splitext(os.path.basename(reclass_csv))[0]
+			output_name = io.table_name("%s_%s" % (table_name, scheme_name), output_path) + extension
+			io.write_table(result, os.path.join(output_path, output_name))
+			outputs.append(os.path.join(output_path, output_name))
+	return outputs
+
+
+def main_fields(area_table, reclass_csv, output_path, output_name):
+	"""reclass with a field calculation for each group on a copy of the table (slow for large tables)"""
 	# make a copy of the area table and replace all null values with zeros
 	arcpy.TableToTable_conversion(area_table, output_path, output_name)
 	outfile = os.path.join(output_path, output_name)
@@ -115,7 +206,3 @@ def main(area_table, reclass_csv, output_path, output_name):
 
 	# remove old classes
 	delete_matching_fields(outfile, "VALUE*")
-
-
-
-
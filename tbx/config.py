@@ -13,6 +13,41 @@ well_id_field = "GRIDID"
 # buffer distance (radius to buffer around a point)
 buffer_dist = "1.5 Miles" # If units anything but miles, must change search radius in cvhm
 
+# engine for zonal statistics within the buffers: "sas" (spatial analyst supplemental tools) or "numpy" (zonal_engine.py)
+# "numpy" also averages the CVHM texture with cvhm_engine.py instead of the spatial join
+zonal_engine = "sas"
+
+# number of sub cells per side used by the numpy engine to weight the buffer edge cells when tabulating area (1 = cell center)
+area_supersample = 4
+
+# buffers that are circles (buffer polygons of points) are rasterized by the numpy engine as exact circles: the exact
+# fraction of each edge cell inside the circle when area_supersample > 1, else the cells with their center inside
+exact_circles = True
+
+# rows and columns of the blocks the numpy engine reads the value rasters in (memory use is about 8 bytes per cell)
+block_size = 2048
+
+# processes the supplemental zonal tools run the color classes on (1 runs them one after another)
+workers = 1
+
+# folder where the numpy engine caches the buffer coverage of each raster grid (None to turn off) and its size limit in MB
+coverage_cache = os.path.join(gnlmrfm, "cache", "coverage")
+coverage_cache_mb = 20000
+
+# weight the CVHM cells by their area inside the buffer (numpy engine) instead of counting every cell touching it the same
+cvhm_area_weighted = False
+
+# cell size of the distance to river raster of the numpy engine (None for the exact distance to the flowlines) and the
+# distance to a river under which the exact distance is used instead of the raster
+river_raster_cell = None
+river_refine_distance = 2000
+
+# layers of the distance predictors (see scripts/distance_layers.json), the radius of their counts and inverse distance
+# weighted loads and the power of the weights
+distance_layers = os.path.join(gnlmrfm, r"scripts\distance_layers.json")
+distance_radius = "5 Miles"
+distance_power = 2
+
 # location of the septics raster
 septic_raster = os.path.join(gnlmrfm, r"data\septics\Septics.tif")
 
@@ -0,0 +1,202 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: coverage_cache.py
+# Purpose: on disk cache of the buffer -> raster cell coverage used by the numpy zonal engine. Entries are
+#          keyed by a hash of the buffer geometries, the raster grid and the buffer distance, stored as .npy
+#          files that are memory mapped when loaded, and evicted least recently used first. The CVHM engine keeps
+#          its texture matrix and neighbor index in the same cache as named arrays (get_arrays / put_arrays).
+#
+#          python coverage_cache.py clear [cache folder]   removes every cached coverage
+#          python coverage_cache.py list [cache folder]    lists the cached coverages
+# ---------------------------------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+
+import config
+import zonal_engine
+
+
+ARRAYS = ["zone_ids", "cells", "indptr", "zones", "weights"]
+
+# json file of an entry (names of its arrays, grid of a coverage). Entries of older versions have grid.json instead
+META = "meta.json"
+
+
+def coverage_key(zone_ids, polygons, grid, supersample=1, buffer_dist=None, method="polygons"):
+	"""sha1 of everything the coverage depends on: buffer ids and geometry, grid alignment and crs, weighting and
+	rasterizing method ("polygons", or "circles" for the exact circle engine)"""
+	sha = hashlib.sha1()
+	key = (grid.key(), grid.crs, int(supersample), buffer_dist)
+	sha.update(repr(key if method == "polygons" else key + (method,)).encode("utf-8"))
+	sha.update(numpy.asarray(zone_ids).astype("U").tobytes())
+	for rings in polygons:
+		sha.update(b"|")
+		for ring in rings:
+			sha.update(numpy.ascontiguousarray(ring, dtype=numpy.float64).tobytes())
+			sha.update(b";")
+	return sha.hexdigest()
+
+
+def dataset_key(path, *params):
+	"""sha1 of the name, size and modification time of the files of a dataset (a shapefile and its sidecar files) and
+	of params, None when the dataset is not a file (like a geodatabase feature class)"""
+	if not os.path.isfile(path):
+		return None
+	folder, name = os.path.split(os.path.abspath(path))
+	stem = os.path.splitext(name)[0]
+	sha = hashlib.sha1(repr(params).encode("utf-8"))
+	for name in sorted(f for f in os.listdir(folder) if os.path.splitext(f)[0] == stem):
+		stat = os.stat(os.path.join(folder, name))
+		sha.update(repr((os.path.join(folder, name), stat.st_size, stat.st_mtime)).encode("utf-8"))
+	return sha.hexdigest()
+
+
+def _folder_size(folder):
+	total = 0
+	for name in os.listdir(folder):
+		total += os.path.getsize(os.path.join(folder, name))
+	return total
+
+
+class CoverageCache(object):
+	"""Folder of cached coverages (one sub folder per key) with a size limit in bytes"""
+
+	def __init__(self, folder, max_bytes=None):
+		self.folder = folder
+		self.max_bytes = max_bytes
+		if not os.path.isdir(folder):
+			try:
+				os.makedirs(folder)
+			except OSError:  # made by another process or thread in the meantime
+				if not os.path.isdir(folder):
+					raise
+
+	def _entry(self, key):
+		return os.path.join(self.folder, key)
+
+	def entries(self):
+		"""list of (key, bytes, last used time) from least to most recently used"""
+		entries = []
+		for key in os.listdir(self.folder):
+			path = self._entry(key)
+			if os.path.isdir(path) and (os.path.exists(os.path.join(path, META)) or
+			                            os.path.exists(os.path.join(path, "grid.json"))):
+				entries.append((key, _folder_size(path), os.path.getmtime(path)))
+		return sorted(entries, key=lambda entry: entry[2])
+
+	def get_arrays(self, key):
+		"""(meta dict, {name: memory mapped array}) of the entry for the key, or None"""
+		path = self._entry(key)
+		if not os.path.exists(os.path.join(path, META)):
+			return None
+		with open(os.path.join(path, META)) as f:
+			meta = json.load(f)
+		arrays = dict((name, numpy.load(os.path.join(path, name + ".npy"), mmap_mode="r")) for name in meta["arrays"])
+		os.utime(path, None)  # mark as used for the lru eviction
+		return meta, arrays
+
+	def get(self, key):
+		"""cached coverage for the key with memory mapped arrays, or None"""
+		entry = self.get_arrays(key)
+		if entry is None or "grid" not in entry[0]:
+			return None
+		meta, arrays = entry
+		grid = zonal_engine.RasterGrid(*meta["grid"], crs=meta.get("crs"))
+		return zonal_engine.ZoneCoverage(grid, *[arrays[name] for name in ARRAYS])
+
+	def put(self, key, coverage):
+		"""saves a coverage then evicts the least recently used entries over the size limit"""
+		arrays = [(name, getattr(coverage, name)) for name in ARRAYS]
+		self.put_arrays(key, arrays, {"grid": list(coverage.grid.key()), "crs": coverage.grid.crs})
+
+	def put_arrays(self, key, arrays, meta=None):
+		"""saves the (name, array) list and the json meta dict as the entry for the key then evicts the least
+		recently used entries over the size limit"""
+		path = self._entry(key)
+		if os.path.exists(path):
+			shutil.rmtree(path)
+
+		# write to a temporary folder first so a failed write never leaves a partial entry
+		temp = tempfile.mkdtemp(dir=self.folder, prefix="tmp_")
+		for name, array in arrays:
+			numpy.save(os.path.join(temp, name + ".npy"), numpy.ascontiguousarray(array))
+		meta = dict(meta or {}, arrays=[name for name, array in arrays])
+		with open(os.path.join(temp, META), "w") as f:
+			json.dump(meta, f)
+		try:
+			os.rename(temp, path)
+		except OSError:  # the same coverage was saved by another process or thread in the meantime
+			shutil.rmtree(temp)
+			if not os.path.exists(os.path.join(path, META)):
+				raise
+
+		self.evict(keep=key)
+
+	def evict(self, keep=None):
+		"""removes least recently used entries until the cache is within max_bytes"""
+		if self.max_bytes is None:
+			return
+		entries = self.entries()
+		total = sum(size for key, size, used in entries)
+		for key, size, used in entries:
+			if total <= self.max_bytes:
+				break
+			if key == keep:
+				continue
+			shutil.rmtree(self._entry(key))
+			total -= size
+
+	def _leftovers(self):
+		"""temporary folders of writes that never finished (see put_arrays)"""
+		return [name for name in os.listdir(self.folder)
+		        if name.startswith("tmp_") and os.path.isdir(self._entry(name))]
+
+	def invalidate(self, key=None):
+		"""removes one entry, or every entry and the temporary leftovers when key is None. Nothing else in the folder
+		is removed, and a folder with other content but no entries is not a cache and raises ValueError"""
+		entries = [entry[0] for entry in self.entries()]
+		if key:
+			keys = [key] if key in entries else []
+		else:
+			keys = entries + self._leftovers()
+			if not keys and os.listdir(self.folder):
+				raise ValueError("%s is not a coverage cache folder, nothing removed" % self.folder)
+		for name in keys:
+			shutil.rmtree(self._entry(name))
+
+
+def default_cache():
+	"""CoverageCache of config.coverage_cache and its size limit, None when the cache is turned off"""
+	if config.coverage_cache:
+		return CoverageCache(config.coverage_cache, config.coverage_cache_mb * 1e6)
+	return None
+
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2 or sys.argv[1] not in ("clear", "list"):
+		print("usage: python coverage_cache.py clear|list [cache folder]")
+		sys.exit(1)
+
+	if len(sys.argv) > 2:
+		cache_folder = sys.argv[2]
+	else:
+		cache_folder = config.coverage_cache
+
+	cache = CoverageCache(cache_folder)
+	if sys.argv[1] == "clear":
+		try:
+			cache.invalidate()
+		except ValueError as e:
+			print(e)
+			sys.exit(1)
+		print("Cleared coverage cache: %s" % cache_folder)
+	else:
+		for key, size, used in cache.entries():
+			print("%s  %10.1f MB  last used %s" % (key, size / 1e6, time.ctime(used)))
@@ -0,0 +1,373 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: cvhm_engine.py
+# Purpose: arcpy free CVHM texture of the wells (replaces the SpatialJoin with the Mean field mappings of the cvhm
+#          tool). The centroid coordinates and percent coarse depth columns are read into numpy once, the centroids
+#          within the search radius of every well are found with a KD-tree (scipy, or square bins without it) and
+#          the means of all depths are one gather and one reduction over the (well, centroid) pairs.
+#
+#          python cvhm_engine.py wells.shp centroids.shp output.dbf [--distance "1.5 Miles"] [--area-weighted]
+#
+#          The search radius is the buffer radius plus half the diagonal of a CVHM cell (1 mile), so every cell
+#          touching the buffer has its centroid inside, as in the spatial join. With --area-weighted each cell is
+#          weighted by the area of the cell inside the buffer instead of counting every cell the same.
+#
+#          All of the depths of the centroids are kept as a (centroid x depth) matrix and the neighbor index of the
+#          points in the coverage cache (config.coverage_cache), so other depths or thickness weighted depth windows
+#          (--windows 0-50 0-400, in feet) are only matrix reductions over the cached arrays.
+#
+#          python cvhm_engine.py wells.shp centroids.shp output.dbf --gw-depth GWDEPTH.dbf
+#
+#          With --gw-depth (the depth to water table of the gw_depth tool, MEAN in meters) the output is the texture
+#          of the vadose zone of each well instead: the layers from the surface down to its water table.
+# ---------------------------------------------------------------------------------------------------
+
+import argparse
+import hashlib
+import math
+import re
+import time
+
+import numpy
+
+try:
+	from scipy.spatial import cKDTree
+except ImportError:  # ArcMap python has no scipy
+	cKDTree = None
+
+import config
+import coverage_cache
+import geometry
+import io_backend
+import join_engine
+import zonal_engine
+
+# percent coarse of the top 8 depths (400 ft) of the texture model
+CVHM_DEPTHS = ["PC_D25", "PC_D75", "PC_D125", "PC_D175", "PC_D225", "PC_D275", "PC_D325", "PC_D375"]
+
+# field of the percent coarse of the layer around a depth in feet
+DEPTH_FIELD = re.compile(r"^PC_D(\d+(?:\.\d+)?)$", re.IGNORECASE)
+
+# side of the square CVHM cells
+CVHM_CELL = geometry.UNITS["miles"]
+
+
+def search_radius(radius, cell_size=CVHM_CELL):
+	"""buffer radius plus half the diagonal of a cell"""
+	return radius + math.sqrt(0.5) * cell_size
+
+
+def _bin_pairs(cx, cy, x, y, radius):
+	"""(points, centroids) within radius without scipy: the centroids are sorted by square bins of side radius and
+	each point is compared with the centroids of the 3 x 3 bins around it"""
+	x0 = min(cx.min(), x.min())
+	y0 = min(cy.min(), y.min())
+	width = int((max(cx.max(), x.max()) - x0) // radius) + 3
+	key = ((cy - y0) // radius + 1).astype(numpy.int64) * width + ((cx - x0) // radius + 1).astype(numpy.int64)
+	order = numpy.argsort(key, kind="mergesort")
+	key = key[order]
+	point_key = ((y - y0) // radius + 1).astype(numpy.int64) * width + ((x - x0) // radius + 1).astype(numpy.int64)
+
+	points = []
+	centroids = []
+	for offset in [row * width + col for row in (-1, 0, 1) for col in (-1, 0, 1)]:
+		first = numpy.searchsorted(key, point_key + offset, "left")
+		counts = numpy.searchsorted(key, point_key + offset, "right") - first
+		p = numpy.repeat(numpy.arange(x.size), counts)
+		c = order[first[p] + numpy.arange(p.size) - numpy.repeat(numpy.cumsum(counts) - counts, counts)]
+		near = numpy.hypot(cx[c] - x[p], cy[c] - y[p]) <= radius
+		points.append(p[near])
+		centroids.append(c[near])
+	return numpy.concatenate(points), numpy.concatenate(centroids)
+
+
+def neighbor_pairs(cx, cy, x, y, radius):
+	"""(points, centroids) index pairs of the centroids within radius (one value or one per point) of the points,
+	sorted by point and centroid"""
+	x = numpy.asarray(x, dtype=numpy.float64)
+	y = numpy.asarray(y, dtype=numpy.float64)
+	radius = numpy.broadcast_to(numpy.asarray(radius, dtype=numpy.float64), x.shape)
+	if not x.size or not len(cx):
+		return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+	if cKDTree is not None:
+		pairs = cKDTree(numpy.column_stack((x, y))).sparse_distance_matrix(
+			cKDTree(numpy.column_stack((cx, cy))), radius.max(), output_type="ndarray")
+		points, centroids = pairs["i"].astype(numpy.int64), pairs["j"].astype(numpy.int64)
+	else:
+		points, centroids = _bin_pairs(cx, cy, x, y, radius.max())
+	keep = numpy.hypot(cx[centroids] - x[points], cy[centroids] - y[points]) <= radius[points]
+	points, centroids = points[keep], centroids[keep]
+	order = numpy.lexsort((centroids, points))
+	return points[order], centroids[order]
+
+
+def cell_geometry(cx, cy):
+	"""(side, rotation in radians) of the square cells of a grid of centroids, from the distance and direction of
+	every centroid to its nearest neighbor (the CVHM grid is rotated along the valley)"""
+	points, centroids = neighbor_pairs(cx, cy, cx, cy, 1.5 * CVHM_CELL)
+	dx = cx[centroids] - cx[points]
+	dy = cy[centroids] - cy[points]
+	distance = numpy.hypot(dx, dy)
+	other = distance > 0
+	points, dx, dy, distance = points[other], dx[other], dy[other], distance[other]
+	if not points.size:
+		raise ValueError("The centroids are more than %s m apart, not a grid" % (1.5 * CVHM_CELL))
+	order = numpy.lexsort((distance, points))
+	first = order[numpy.concatenate(([True], points[order][1:] != points[order][:-1]))]
+	angle = 4 * numpy.arctan2(dy[first], dx[first])  # directions 90 degrees apart are the same rotation
+	return numpy.median(distance[first]), math.atan2(numpy.sin(angle).mean(), numpy.cos(angle).mean()) / 4
+
+
+def overlap_area(dx, dy, radius, cell_size, rotation=0.0):
+	"""area inside the circles of the square cells with their centers at dx, dy from the circle centers"""
+	u = dx * math.cos(rotation) + dy * math.sin(rotation)  # cell center in the axes of the grid
+	v = dy * math.cos(rotation) - dx * math.sin(rotation)
+	half = 0.5 * cell_size
+	return zonal_engine.rectangle_circle_area(u - half, v - half, u + half, v + half, radius)
+
+
+def _segment_sum(values, indptr):
+	"""sums of the rows of values in each segment indptr[i]:indptr[i + 1], 0 for the empty segments"""
+	sums = numpy.zeros((indptr.size - 1,) + values.shape[1:])
+	full = numpy.diff(indptr) > 0
+	if full.any():
+		sums[full] = numpy.add.reduceat(values, indptr[:-1][full], axis=0)
+	return sums
+
+
+class NeighborIndex(object):
+	"""Centroids around every point as compressed rows: the centroids of point i are
+	centroids[indptr[i]:indptr[i + 1]], with their weights (1, or the area of their cell inside the buffer)"""
+
+	def __init__(self, indptr, centroids, weights=None):
+		self.indptr = indptr
+		self.centroids = centroids
+		self.weights = numpy.ones(centroids.size) if weights is None else weights
+
+	@property
+	def counts(self):
+		return numpy.diff(self.indptr)
+
+	def mean(self, values):
+		"""weighted mean around every point of each column of values (centroids x columns), skipping the nan values.
+		nan where a point has no valid value"""
+		values = values[self.centroids]
+		valid = ~numpy.isnan(values)
+		weights = self.weights[:, None] * valid
+		sums = _segment_sum(numpy.where(valid, values, 0.0) * weights, self.indptr)
+		total = _segment_sum(weights, self.indptr)
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			return numpy.where(total > 0, sums / total, numpy.nan)
+
+
+def neighbor_index(cx, cy, x, y, radius, area_weighted=False, cell_size=CVHM_CELL):
+	"""NeighborIndex of the centroids within the search radius of the buffers (radius, one value or one per point),
+	with area_weighted the weights are the area of each cell inside the buffer"""
+	radius = numpy.broadcast_to(numpy.asarray(radius, dtype=numpy.float64), numpy.shape(x))
+	points, centroids = neighbor_pairs(cx, cy, x, y, search_radius(radius, cell_size))
+	weights = None
+	if area_weighted:
+		size, rotation = cell_geometry(cx, cy)
+		weights = overlap_area(cx[centroids] - x[points], cy[centroids] - y[points], radius[points], size, rotation)
+	indptr = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(points, minlength=len(x))))).astype(numpy.int64)
+	return NeighborIndex(indptr, centroids, weights)
+
+
+def depth_fields(names):
+	"""the PC_D<depth> fields of the names sorted by depth"""
+	return sorted([name for name in names if DEPTH_FIELD.match(name)],
+	              key=lambda name: float(DEPTH_FIELD.match(name).group(1)))
+
+
+def layer_bounds(depths):
+	"""(tops, bottoms) in feet of the layers of the depth fields, halfway between the depths of the fields (PC_D25 is
+	the layer from 0 to 50 ft)"""
+	mids = numpy.array([float(DEPTH_FIELD.match(depth).group(1)) for depth in depths])
+	if mids.size == 1:
+		return numpy.zeros(1), 2 * mids
+	edges = (mids[1:] + mids[:-1]) / 2
+	tops = numpy.concatenate(([max(2 * mids[0] - edges[0], 0.0)], edges))
+	bottoms = numpy.concatenate((edges, [2 * mids[-1] - edges[-1]]))
+	return tops, bottoms
+
+
+def parse_window(text):
+	"""(top, bottom) in feet of a depth window like "0-400" """
+	try:
+		top, bottom = [float(value) for value in text.split("-")]
+	except ValueError:
+		raise ValueError("Depth window '%s' is not <top>-<bottom> in feet, like 0-400" % text)
+	if bottom <= top:
+		raise ValueError("Depth window '%s' has its bottom above its top" % text)
+	return top, bottom
+
+
+def window_field(top, bottom):
+	"""output field of a depth window, PC_0_400 for 0 to 400 ft"""
+	return "PC_%g_%g" % (top, bottom)
+
+
+def thickness_weights(tops, bottoms, top, bottom):
+	"""thickness of each layer (tops, bottoms) inside the windows from top to bottom (arrays) as a (windows, layers)
+	matrix"""
+	top = numpy.asarray(top, dtype=numpy.float64)[..., None]
+	bottom = numpy.asarray(bottom, dtype=numpy.float64)[..., None]
+	return numpy.clip(numpy.minimum(bottom, bottoms) - numpy.maximum(top, tops), 0.0, None)
+
+
+def window_means(layer_means, weights):
+	"""thickness weighted means (points x windows) of the layer means (points x layers) with the (windows x layers)
+	weights, as two matrix products. Layers without a value are left out of the window"""
+	valid = ~numpy.isnan(layer_means)
+	sums = numpy.where(valid, layer_means, 0.0).dot(weights.T)
+	total = valid.astype(numpy.float64).dot(weights.T)
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		return numpy.where(total > 0, sums / total, numpy.nan)
+
+
+def profile_means(layer_means, weights):
+	"""thickness weighted mean of the layer means (points x layers) of every point over its own window (weights points
+	x layers, like the depth above the water table of each well). Layers without a value are left out"""
+	valid = ~numpy.isnan(layer_means)
+	sums = (numpy.where(valid, layer_means, 0.0) * weights).sum(axis=1)
+	total = (valid * weights).sum(axis=1)
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		return numpy.where(total > 0, sums / total, numpy.nan)
+
+
+def load_texture(io, centroids, cache=None):
+	"""(x, y, depth fields, centroids x depths matrix of percent coarse, nulls as nan) of all of the PC_D fields of
+	the centroids, from the cache when the centroid files have not changed"""
+	key = coverage_cache.dataset_key(centroids, "cvhm texture") if cache is not None else None
+	entry = cache.get_arrays(key) if key else None
+	if entry is not None:
+		meta, arrays = entry
+		return arrays["x"], arrays["y"], [str(depth) for depth in meta["depths"]], arrays["values"]
+	ids, cx, cy = io.read_points(centroids, None)
+	depths = depth_fields(io.table_fields(centroids))
+	if not depths:
+		raise ValueError("%s has no PC_D<depth> fields" % centroids)
+	table = io.read_table(centroids, depths, null_value=numpy.nan)
+	values = numpy.column_stack([table[depth].astype(numpy.float64) for depth in depths])
+	if key:
+		cache.put_arrays(key, [("x", cx), ("y", cy), ("values", values)], {"depths": depths})
+	return cx, cy, depths, values
+
+
+def load_neighbor_index(cx, cy, x, y, radius, area_weighted=False, cache=None):
+	"""neighbor_index from the cache when the centroids, points, radius and weighting are the same"""
+	radius = numpy.broadcast_to(numpy.asarray(radius, dtype=numpy.float64), numpy.shape(x))
+	key = None
+	if cache is not None:
+		sha = hashlib.sha1(repr(("cvhm neighbors", bool(area_weighted), CVHM_CELL)).encode("utf-8"))
+		for array in (cx, cy, x, y, radius):
+			sha.update(numpy.ascontiguousarray(array, dtype=numpy.float64).tobytes())
+		key = sha.hexdigest()
+		entry = cache.get_arrays(key)
+		if entry is not None:
+			arrays = entry[1]
+			return NeighborIndex(arrays["indptr"], arrays["centroids"], arrays["weights"])
+	index = neighbor_index(cx, cy, x, y, radius, area_weighted)
+	if key:
+		cache.put_arrays(key, [("indptr", index.indptr), ("centroids", index.centroids), ("weights", index.weights)])
+	return index
+
+
+def point_table(ids, columns, fields, id_field):
+	"""table of the ids and the columns (points x fields)"""
+	table = numpy.zeros(ids.size, dtype=[(id_field, ids.dtype)] + [(field, numpy.float64) for field in fields])
+	table[id_field] = ids
+	for column, field in enumerate(fields):
+		table[field] = columns[:, column]
+	return table
+
+
+def cvhm_texture(io, points, centroids, id_field, depths=None, distance=None, area_weighted=False, windows=None,
+                 cache=None):
+	"""CVHM texture table of the points (or circles table) with the buffer radius distance (default
+	config.buffer_dist): the mean percent coarse of the depths (default CVHM_DEPTHS) or, with windows ("0-400" in
+	feet), the thickness weighted mean of the layers in each window. The wells without centroids around them are left
+	out, like the KEEP_COMMON spatial join"""
+	cx, cy, fields, values = load_texture(io, centroids, cache)
+	ids, x, y, radius = io_backend.read_centers(io, points, id_field, io.spatial_reference(centroids), distance)
+	index = load_neighbor_index(cx, cy, x, y, radius, area_weighted, cache)
+	keep = index.counts > 0
+	if windows:
+		bounds = [parse_window(window) for window in windows]
+		tops, bottoms = layer_bounds(fields)
+		weights = thickness_weights(tops, bottoms, [b[0] for b in bounds], [b[1] for b in bounds])
+		names = [window_field(*b) for b in bounds]
+		means = window_means(index.mean(values), weights)
+	else:
+		names = list(depths or CVHM_DEPTHS)
+		missing = [depth for depth in names if depth not in fields]
+		if missing:
+			raise ValueError("%s has no fields %s" % (centroids, ", ".join(missing)))
+		means = index.mean(values[:, [fields.index(depth) for depth in names]])
+	return point_table(ids[keep], means[keep], names, id_field)
+
+
+def read_depths(io, table, ids, id_field, field="MEAN", units="Meters"):
+	"""depth to water in feet of every id from a table (like the MEAN of the gw_depth tool, in units), nan for the
+	ids missing from the table"""
+	rows = io.read_table(table, [id_field, field], null_value=numpy.nan)
+	target, source = join_engine.IdIndex(ids).match(rows[id_field])
+	depths = numpy.full(ids.size, numpy.nan)
+	depths[target] = rows[field].astype(numpy.float64)[source] * geometry.linear_distance("1 " + units) / \
+		geometry.UNITS["feet"]
+	return depths
+
+
+def vadose_texture(io, points, centroids, gw_table, id_field, gw_field="MEAN", gw_units="Meters", distance=None,
+                   area_weighted=False, cache=None):
+	"""vadose zone texture table of the points: PC_VADOSE, the percent coarse from the surface down to the water
+	table of each well (thickness weighted mean of the layers above it), and COARSE_FT, the feet of coarse sediment
+	above the water table. The depth to water is read from gw_table, nan for the wells without a depth. A water table
+	below the deepest layer is cut off at its bottom"""
+	cx, cy, fields, values = load_texture(io, centroids, cache)
+	ids, x, y, radius = io_backend.read_centers(io, points, id_field, io.spatial_reference(centroids), distance)
+	index = load_neighbor_index(cx, cy, x, y, radius, area_weighted, cache)
+	keep = index.counts > 0
+	depth = read_depths(io, gw_table, ids, id_field, gw_field, gw_units)
+	tops, bottoms = layer_bounds(fields)
+	weights = thickness_weights(tops, bottoms, 0.0, numpy.where(depth > 0, depth, 0.0))
+	percent = numpy.where(depth > 0, profile_means(index.mean(values), weights), numpy.nan)
+	coarse = percent / 100.0 * numpy.minimum(depth, bottoms[-1])
+	return point_table(ids[keep], numpy.column_stack((percent, coarse))[keep], ["PC_VADOSE", "COARSE_FT"], id_field)
+
+
+def main(points, centroids, output, depths=None, distance=None, area_weighted=False, windows=None, id_field=None,
+         backend=None, gw_depth=None, gw_field="MEAN", gw_units="Meters"):
+	"""writes the mean percent coarse of each depth (or depth window) around the points to the output table, or the
+	vadose zone texture with the depth to water table gw_depth"""
+	if not hasattr(backend, "read_table"):
+		backend = io_backend.get_backend(backend)
+	start = time.time()
+	id_field = id_field or config.well_id_field
+	if gw_depth:
+		table = vadose_texture(backend, points, centroids, gw_depth, id_field, gw_field, gw_units, distance,
+		                       area_weighted, coverage_cache.default_cache())
+	else:
+		table = cvhm_texture(backend, points, centroids, id_field, depths, distance, area_weighted, windows,
+		                     coverage_cache.default_cache())
+	backend.write_table(table, output)
+	print("CVHM texture of %d points in %.1f s" % (table.size, time.time() - start))
+	return table
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Mean CVHM percent coarse of each depth around the wells")
+	parser.add_argument("points", help="wells (or grid points, or a circles table)")
+	parser.add_argument("centroids", help="CVHM texture centroids")
+	parser.add_argument("output", help="output table")
+	parser.add_argument("--depths", nargs="+", help="depth fields, default %s" % " ".join(CVHM_DEPTHS))
+	parser.add_argument("--windows", nargs="+", help="depth windows in feet instead of the depths, like 0-50 0-400")
+	parser.add_argument("--gw-depth", help="table of the depth to water of the points for the vadose zone texture")
+	parser.add_argument("--gw-field", default="MEAN", help="depth to water field of the --gw-depth table")
+	parser.add_argument("--gw-units", default="Meters", help="units of the depth to water")
+	parser.add_argument("--distance", help="buffer radius, default config.buffer_dist")
+	parser.add_argument("--area-weighted", action="store_true", help="weight the cells by their area inside the buffer")
+	parser.add_argument("--id-field", help="id field of the points, default config.well_id_field")
+	parser.add_argument("--backend", choices=sorted(io_backend.BACKENDS), help="I/O backend, default arcpy if installed")
+	args = parser.parse_args()
+	main(args.points, args.centroids, args.output, args.depths, args.distance, args.area_weighted, args.windows,
+	     args.id_field, args.backend, args.gw_depth, args.gw_field, args.gw_units)
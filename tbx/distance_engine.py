@@ -0,0 +1,228 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: distance_engine.py
+# Purpose: arcpy free distance from the wells to the nearest line feature (replaces the Near_analysis of the
+#          dist2river tool). The flowlines are split into segments and the segments are sampled every spacing
+#          meters into a KD-tree. The nearest samples of every point give the candidate segments and the exact
+#          point to segment distance is computed for those, in batches of points.
+#
+#          python distance_engine.py near wells.shp NHDFlowlines_major.shp RIVER_DISTANCE.dbf
+#          python distance_engine.py benchmark NHDFlowlines_major.shp [--points 100000]
+#
+#          A point is done when its k-th nearest sample is farther than the nearest segment found plus half the
+#          sample spacing: every other segment has a sample within half the spacing of its nearest point, so it
+#          cannot be nearer. The other points are searched again with more samples, so the distances are exact.
+#          The output has NEAR_FID and NEAR_DIST like Near_analysis, the StreamOrde of the nearest flowline and
+#          NEAR_ALONG, the distance along the flowline from its start to the nearest point.
+# ---------------------------------------------------------------------------------------------------
+
+import argparse
+import time
+
+import numpy
+
+try:
+	from scipy.spatial import cKDTree
+except ImportError:  # ArcMap python has no scipy
+	cKDTree = None
+
+import config
+import geometry
+import io_backend
+
+# points per batch, memory use is about points x samples searched x 50 bytes
+BATCH_SIZE = 100000
+
+
+def line_segments(lines):
+	"""(x0, y0, x1, y1, feature row, measure of the segment start along its feature) of every segment of the lines
+	(list of parts for each feature). The measure continues across the parts of a feature"""
+	segments = []
+	rows = []
+	for row, parts in enumerate(lines):
+		for part in parts:
+			part = numpy.asarray(part, dtype=numpy.float64)[:, :2]
+			segments.append(numpy.hstack((part[:-1], part[1:])))
+			rows.append(numpy.full(len(part) - 1, row, dtype=numpy.int64))
+	if not segments:
+		raise ValueError("No line segments")
+	segments = numpy.vstack(segments)
+	rows = numpy.concatenate(rows)
+	length = numpy.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+	# measure of the segment start: cumulative length of the segments before it in the same feature
+	end = numpy.cumsum(length)
+	first = numpy.concatenate(([True], rows[1:] != rows[:-1]))
+	feature_start = numpy.maximum.accumulate(numpy.where(first, end - length, 0.0))
+	return segments[:, 0], segments[:, 1], segments[:, 2], segments[:, 3], rows, end - length - feature_start
+
+
+class SegmentIndex(object):
+	"""KD-tree of points sampled along the segments at most spacing apart (the vertices and the segments split
+	into equal parts), each sample knowing its segment"""
+
+	def __init__(self, x0, y0, x1, y1, spacing=None):
+		self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+		length = numpy.hypot(x1 - x0, y1 - y0)
+		if spacing is None:
+			spacing = max(numpy.median(length), 1e-9)
+		parts = numpy.maximum(numpy.ceil(length / spacing), 1).astype(numpy.int64)
+		self.half = 0.5 * (length / parts).max()  # every point of a segment is within half of this of a sample
+		counts = parts + 1
+		self.segment = numpy.repeat(numpy.arange(x0.size), counts)
+		t = (numpy.arange(self.segment.size) - numpy.repeat(numpy.cumsum(counts) - counts, counts)) / \
+			numpy.repeat(parts, counts).astype(numpy.float64)
+		s = self.segment
+		self.samples = numpy.column_stack((x0[s] + t * (x1[s] - x0[s]), y0[s] + t * (y1[s] - y0[s])))
+		self.tree = cKDTree(self.samples) if cKDTree is not None else None
+
+	def nearest(self, x, y, k=8, batch_size=BATCH_SIZE):
+		"""(distance, segment, fraction along the segment) of the nearest segment of every point"""
+		x = numpy.asarray(x, dtype=numpy.float64)
+		y = numpy.asarray(y, dtype=numpy.float64)
+		if self.tree is None:
+			return brute_force_nearest(x, y, self.x0, self.y0, self.x1, self.y1)
+		distance = numpy.empty(x.size)
+		segment = numpy.empty(x.size, dtype=numpy.int64)
+		fraction = numpy.empty(x.size)
+		for start in range(0, x.size, batch_size):
+			todo = numpy.arange(start, min(start + batch_size, x.size))
+			search = min(k, self.samples.shape[0])
+			while todo.size:
+				sample_distance, sample = self.tree.query(numpy.column_stack((x[todo], y[todo])), search)
+				sample = sample.reshape(todo.size, -1)
+				sample_distance = sample_distance.reshape(todo.size, -1)
+				seg = self.segment[sample]
+				d, t = geometry.segment_projection(x[todo, None], y[todo, None], self.x0[seg], self.y0[seg],
+				                                   self.x1[seg], self.y1[seg])
+				best = numpy.argmin(d, axis=1)
+				rows = numpy.arange(todo.size)
+				distance[todo] = d[rows, best]
+				segment[todo] = seg[rows, best]
+				fraction[todo] = t[rows, best]
+				if search == self.samples.shape[0]:
+					break
+				# nearer segments than the best found have a sample nearer than the best distance plus half
+				todo = todo[sample_distance[:, -1] - self.half < distance[todo]]
+				search = min(4 * search, self.samples.shape[0])
+		return distance, segment, fraction
+
+
+def brute_force_nearest(x, y, x0, y0, x1, y1, batch_size=None):
+	"""reference (distance, segment, fraction) of every point to every segment, in batches of points"""
+	x = numpy.asarray(x, dtype=numpy.float64)
+	y = numpy.asarray(y, dtype=numpy.float64)
+	batch_size = batch_size or max(1, 2000000 // max(x0.size, 1))
+	distance = numpy.empty(x.size)
+	segment = numpy.empty(x.size, dtype=numpy.int64)
+	fraction = numpy.empty(x.size)
+	for start in range(0, x.size, batch_size):
+		stop = min(start + batch_size, x.size)
+		d, t = geometry.segment_projection(x[start:stop, None], y[start:stop, None], x0, y0, x1, y1)
+		best = numpy.argmin(d, axis=1)
+		rows = numpy.arange(stop - start)
+		distance[start:stop], segment[start:stop], fraction[start:stop] = d[rows, best], best, t[rows, best]
+	return distance, segment, fraction
+
+
+class LineIndex(object):
+	"""Segment index of the lines of a feature class with the feature (row and id) of every segment"""
+
+	def __init__(self, ids, lines, spacing=None):
+		self.ids = ids
+		self.x0, self.y0, self.x1, self.y1, self.rows, self.measure = line_segments(lines)
+		self.index = SegmentIndex(self.x0, self.y0, self.x1, self.y1, spacing)
+
+	def nearest(self, x, y):
+		"""(distance, feature row, measure along the feature) of the nearest line of every point"""
+		distance, segment, fraction = self.index.nearest(x, y)
+		length = numpy.hypot(self.x1[segment] - self.x0[segment], self.y1[segment] - self.y0[segment])
+		return distance, self.rows[segment], self.measure[segment] + fraction * length
+
+
+def read_line_index(io, lines, spatial_reference=None, spacing=None):
+	"""LineIndex of a line feature class projected to spatial_reference"""
+	ids, parts = io.read_lines(lines, None, spatial_reference)
+	return LineIndex(ids, parts, spacing)
+
+
+def near_table(io, points, lines, id_field, order_field="StreamOrde", spacing=None):
+	"""table of the nearest line of every point (or circle center): NEAR_FID, NEAR_DIST (in the units of the lines),
+	the order_field of the line when it has one and NEAR_ALONG, the distance along the line from its start"""
+	spatial_reference = io.spatial_reference(lines)
+	ids, x, y, radius = io_backend.read_centers(io, points, id_field, spatial_reference)
+	index = read_line_index(io, lines, spatial_reference, spacing)
+	distance, row, along = index.nearest(x, y)
+
+	fields = [(id_field, ids.dtype), ("NEAR_FID", numpy.int64), ("NEAR_DIST", numpy.float64)]
+	orders = None
+	if order_field and order_field in io.table_fields(lines):
+		orders = io.read_table(lines, [order_field])[order_field]
+		fields.append((order_field, orders.dtype))
+	fields.append(("NEAR_ALONG", numpy.float64))
+	table = numpy.zeros(ids.size, dtype=fields)
+	table[id_field] = ids
+	table["NEAR_FID"] = index.ids[row]
+	table["NEAR_DIST"] = distance
+	if orders is not None:
+		table[order_field] = orders[row]
+	table["NEAR_ALONG"] = along
+	return table
+
+
+def benchmark(io, lines, points=100000, seed=0):
+	"""times the segment index against the brute force reference on random points in the extent of the lines and
+	returns the largest difference of the distances"""
+	start = time.time()
+	index = read_line_index(io, lines)
+	print("%d segments, %d samples read and indexed in %.1f s" % (index.x0.size, index.index.samples.shape[0],
+	                                                             time.time() - start))
+	random = numpy.random.RandomState(seed)
+	xmin, xmax = min(index.x0.min(), index.x1.min()), max(index.x0.max(), index.x1.max())
+	ymin, ymax = min(index.y0.min(), index.y1.min()), max(index.y0.max(), index.y1.max())
+	x = random.uniform(xmin, xmax, points)
+	y = random.uniform(ymin, ymax, points)
+
+	start = time.time()
+	distance, segment, fraction = index.index.nearest(x, y)
+	indexed = time.time() - start
+	reference = min(points, max(1000, 2 * 10 ** 9 // (index.x0.size * 100)))  # brute force on a sample if too slow
+	start = time.time()
+	expected = brute_force_nearest(x[:reference], y[:reference], index.x0, index.y0, index.x1, index.y1)[0]
+	brute = (time.time() - start) * points / reference
+	difference = numpy.abs(distance[:reference] - expected).max()
+	print("index: %d points in %.2f s, brute force: %.1f s (%s), largest difference %g m" % (
+		points, indexed, brute, "measured" if reference == points else "from %d points" % reference, difference))
+	return difference
+
+
+def main(points, lines, output, id_field=None, order_field="StreamOrde", spacing=None, backend=None):
+	"""writes the distance from the points to the nearest line to the output table"""
+	if not hasattr(backend, "read_table"):
+		backend = io_backend.get_backend(backend)
+	start = time.time()
+	table = near_table(backend, points, lines, id_field or config.well_id_field, order_field, spacing)
+	backend.write_table(table, output)
+	print("Nearest line of %d points in %.1f s" % (table.size, time.time() - start))
+	return table
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Distance from the wells to the nearest line (major river)")
+	parser.add_argument("--backend", choices=sorted(io_backend.BACKENDS), help="I/O backend, default arcpy if installed")
+	commands = parser.add_subparsers(dest="command")
+	near = commands.add_parser("near", help="nearest line of every point")
+	near.add_argument("points", help="wells (or grid points, or a circles table)")
+	near.add_argument("lines", help="line feature class (NHDFlowlines_major)")
+	near.add_argument("output", help="output table")
+	near.add_argument("--id-field", help="id field of the points, default config.well_id_field")
+	near.add_argument("--order-field", default="StreamOrde", help="field of the lines copied to the output")
+	near.add_argument("--spacing", type=float, help="sample spacing along the lines, default the median segment length")
+	bench = commands.add_parser("benchmark", help="segment index against brute force on random points")
+	bench.add_argument("lines", help="line feature class")
+	bench.add_argument("--points", type=int, default=100000, help="number of random points")
+	args = parser.parse_args()
+	if args.command == "near":
+		main(args.points, args.lines, args.output, args.id_field, args.order_field, args.spacing, args.backend)
+	elif args.command == "benchmark":
+		benchmark(io_backend.get_backend(args.backend), args.lines, args.points)
+	else:
+		parser.print_help()
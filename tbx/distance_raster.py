@@ -0,0 +1,169 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: distance_raster.py
+# Purpose: distance to the major rivers as a raster computed once for the domain and sampled for any set of points
+#          (wells, predictor grids). The flowlines are burned into a grid of cell_size, the exact euclidean distance
+#          transform of the grid (scipy) gives the distance of every cell center to the nearest river cell, and the
+#          raster is saved in the coverage cache (config.coverage_cache) and memory mapped from there the next time.
+#
+#          python distance_raster.py wells.shp NHDFlowlines_major.shp RIVER_DISTANCE.dbf --cell-size 100
+#                                    [--refine 2000]
+#
+#          The points are sampled with bilinear interpolation between the four nearest cell centers. The raster is
+#          within a cell diagonal of the distance to the lines, so the points nearer than refine to a river (where that
+#          error matters most) and the points outside the raster get the exact distance of distance_engine instead.
+# ---------------------------------------------------------------------------------------------------
+
+import argparse
+import math
+import time
+
+import numpy
+
+import config
+import coverage_cache
+import distance_engine
+import io_backend
+import zonal_engine
+
+# distance around the extent of the lines covered by the raster
+RASTER_MARGIN = 20000.0
+
+
+def raster_grid(xmin, ymin, xmax, ymax, cell_size, crs=None):
+	"""RasterGrid of square cells covering the extent, snapped to multiples of the cell size so that the same lines
+	and cell size always give the same grid"""
+	xmin = math.floor(xmin / cell_size) * cell_size
+	ymax = math.ceil(ymax / cell_size) * cell_size
+	ncols = int(math.ceil((xmax - xmin) / cell_size))
+	nrows = int(math.ceil((ymax - ymin) / cell_size))
+	return zonal_engine.RasterGrid(xmin, ymax, cell_size, cell_size, nrows, ncols, crs=crs)
+
+
+def burn_segments(grid, x0, y0, x1, y1):
+	"""boolean (rows, columns) grid of the cells crossed by the segments, found from points along every segment at
+	most half a cell apart"""
+	burned = numpy.zeros((grid.nrows, grid.ncols), dtype=bool)
+	length = numpy.hypot(x1 - x0, y1 - y0)
+	steps = numpy.maximum(numpy.ceil(2 * length / min(grid.cell_width, grid.cell_height)), 1).astype(numpy.int64)
+	counts = steps + 1
+	for start in range(0, x0.size, 100000):  # blocks of segments to bound the memory of the points
+		stop = min(start + 100000, x0.size)
+		segment = numpy.repeat(numpy.arange(start, stop), counts[start:stop])
+		first = numpy.repeat(numpy.cumsum(counts[start:stop]) - counts[start:stop], counts[start:stop])
+		t = (numpy.arange(segment.size) - first) / steps[segment].astype(numpy.float64)
+		x = x0[segment] + t * (x1[segment] - x0[segment])
+		y = y0[segment] + t * (y1[segment] - y0[segment])
+		cols = numpy.floor((x - grid.xmin) / grid.cell_width).astype(numpy.int64)
+		rows = numpy.floor((grid.ymax - y) / grid.cell_height).astype(numpy.int64)
+		inside = (rows >= 0) & (rows < grid.nrows) & (cols >= 0) & (cols < grid.ncols)
+		burned[rows[inside], cols[inside]] = True
+	return burned
+
+
+def distance_transform(grid, burned):
+	"""exact euclidean distance from every cell center to the nearest burned cell center"""
+	try:
+		from scipy import ndimage
+	except ImportError:
+		raise ImportError("The distance raster needs scipy, use the vector distance (distance_engine.py) without it")
+	if not burned.any():
+		raise ValueError("No lines inside the raster")
+	return ndimage.distance_transform_edt(~burned, sampling=(grid.cell_height, grid.cell_width)).astype(numpy.float32)
+
+
+class DistanceRaster(object):
+	"""distance to the nearest line at the cell centers of a grid"""
+
+	def __init__(self, grid, values):
+		self.grid = grid
+		self.values = values
+
+	def sample(self, x, y):
+		"""bilinear interpolation of the distance between the four cell centers around each point, nan for the
+		points outside of the cell centers of the raster"""
+		grid = self.grid
+		col = (numpy.asarray(x, dtype=numpy.float64) - grid.xmin) / grid.cell_width - 0.5
+		row = (grid.ymax - numpy.asarray(y, dtype=numpy.float64)) / grid.cell_height - 0.5
+		inside = (col >= 0) & (col <= grid.ncols - 1) & (row >= 0) & (row <= grid.nrows - 1)
+		col0 = numpy.clip(numpy.floor(col).astype(numpy.int64), 0, max(grid.ncols - 2, 0))
+		row0 = numpy.clip(numpy.floor(row).astype(numpy.int64), 0, max(grid.nrows - 2, 0))
+		fx = numpy.clip(col - col0, 0.0, 1.0)
+		fy = numpy.clip(row - row0, 0.0, 1.0)
+		col1 = numpy.minimum(col0 + 1, grid.ncols - 1)
+		row1 = numpy.minimum(row0 + 1, grid.nrows - 1)
+		values = self.values
+		top = values[row0, col0] * (1 - fx) + values[row0, col1] * fx
+		bottom = values[row1, col0] * (1 - fx) + values[row1, col1] * fx
+		return numpy.where(inside, top * (1 - fy) + bottom * fy, numpy.nan)
+
+
+def build_distance_raster(index, cell_size, extent=None, crs=None):
+	"""DistanceRaster of the segments of a distance_engine.LineIndex over the extent (xmin, ymin, xmax, ymax),
+	default the extent of the lines and RASTER_MARGIN around it"""
+	if extent is None:
+		x = numpy.concatenate((index.x0, index.x1))
+		y = numpy.concatenate((index.y0, index.y1))
+		extent = (x.min() - RASTER_MARGIN, y.min() - RASTER_MARGIN, x.max() + RASTER_MARGIN, y.max() + RASTER_MARGIN)
+	grid = raster_grid(extent[0], extent[1], extent[2], extent[3], float(cell_size), crs)
+	burned = burn_segments(grid, index.x0, index.y0, index.x1, index.y1)
+	return DistanceRaster(grid, distance_transform(grid, burned))
+
+
+def load_distance_raster(io, lines, cell_size, extent=None, cache=None):
+	"""DistanceRaster of a line feature class, memory mapped from the cache when the lines, cell size and extent are
+	the same as a previous run"""
+	key = None
+	if cache is not None:
+		key = coverage_cache.dataset_key(lines, "distance raster", float(cell_size), extent and list(extent))
+		entry = cache.get_arrays(key) if key else None
+		if entry is not None:
+			meta, arrays = entry
+			return DistanceRaster(zonal_engine.RasterGrid(*meta["grid"], crs=meta.get("crs")), arrays["distance"])
+	crs = io.spatial_reference(lines)
+	raster = build_distance_raster(distance_engine.read_line_index(io, lines), cell_size, extent, crs)
+	if key:
+		cache.put_arrays(key, [("distance", raster.values)], {"grid": list(raster.grid.key()), "crs": crs})
+	return raster
+
+
+def raster_near_table(io, points, lines, id_field, cell_size, refine=None, extent=None, cache=None):
+	"""table of the distance (NEAR_DIST) from every point (or circle center) to the nearest line sampled from the
+	distance raster, with the exact distance for the points within refine of a line or outside the raster"""
+	ids, x, y, radius = io_backend.read_centers(io, points, id_field, io.spatial_reference(lines))
+	raster = load_distance_raster(io, lines, cell_size, extent, cache)
+	distance = raster.sample(x, y)
+	exact = numpy.isnan(distance)
+	if refine:
+		# the sampled distance is within a cell diagonal of the exact one, so no point nearer than refine is missed
+		exact |= distance < refine + math.hypot(raster.grid.cell_width, raster.grid.cell_height)
+	if exact.any():
+		distance[exact] = distance_engine.read_line_index(io, lines).nearest(x[exact], y[exact])[0]
+	table = numpy.zeros(ids.size, dtype=[(id_field, ids.dtype), ("NEAR_DIST", numpy.float64)])
+	table[id_field] = ids
+	table["NEAR_DIST"] = distance
+	return table
+
+
+def main(points, lines, output, cell_size, refine=None, id_field=None, backend=None):
+	"""writes the distance from the points to the nearest line, sampled from the distance raster, to the output table"""
+	if not hasattr(backend, "read_table"):
+		backend = io_backend.get_backend(backend)
+	start = time.time()
+	table = raster_near_table(backend, points, lines, id_field or config.well_id_field, cell_size, refine,
+	                          cache=coverage_cache.default_cache())
+	backend.write_table(table, output)
+	print("Distance of %d points in %.1f s" % (table.size, time.time() - start))
+	return table
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Distance from the points to the nearest line from a distance raster")
+	parser.add_argument("points", help="wells (or grid points, or a circles table)")
+	parser.add_argument("lines", help="line feature class (NHDFlowlines_major)")
+	parser.add_argument("output", help="output table")
+	parser.add_argument("--cell-size", type=float, default=100.0, help="cell size of the distance raster")
+	parser.add_argument("--refine", type=float, help="exact distance for the points nearer than this to a line")
+	parser.add_argument("--id-field", help="id field of the points, default config.well_id_field")
+	parser.add_argument("--backend", choices=sorted(io_backend.BACKENDS), help="I/O backend, default arcpy if installed")
+	args = parser.parse_args()
+	main(args.points, args.lines, args.output, args.cell_size, args.refine, args.id_field, args.backend)
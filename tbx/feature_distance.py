@@ -0,0 +1,338 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: feature_distance.py
+# Purpose: distance predictors of many point, line and polygon layers (canals, dairies, WWTPs, the basin boundary)
+#          in one pass over the wells, replacing one Near_analysis per layer. For every layer NAME the output has
+#            NAME_DIST   distance to the nearest feature (to the boundary for polygons)
+#            NAME_N      number of features within the radius (polygons containing the well or with their boundary
+#                        within the radius)
+#            NAME_IDW    sum of the load of the features within the radius divided by distance ** power, for the
+#                        layers with a load (distances under min_distance count as min_distance)
+#            NAME_IN     1 if the well is inside a polygon of the layer (polygon layers)
+#
+#          python feature_distance.py wells.shp distance_layers.json FEATURE_DISTANCE.dbf [--radius "5 Miles"]
+#
+#          The layers are a json file (see scripts/distance_layers.json) of {"name", "type" (point, line or polygon),
+#          "path", "id_field", "load", "load_id", "load_field", "radius"}: the load of each feature is load_field of
+#          the load table (like DirectAppNrates.csv, joined on load_id) or of the layer itself. Each layer is read and
+#          indexed once (a KD-tree of the points, the segment index of distance_engine for the lines and the polygon
+#          boundaries), then the wells are searched in batches. Names of up to 6 characters keep whole dbf fields.
+# ---------------------------------------------------------------------------------------------------
+
+import argparse
+import os
+import time
+from collections import OrderedDict
+
+import numpy
+
+try:
+	from scipy.spatial import cKDTree
+except ImportError:  # ArcMap python has no scipy
+	cKDTree = None
+
+import config
+import distance_engine
+import geometry
+import io_backend
+import join_engine
+
+# points per batch, the pairs within the radius of a batch are held in memory at once
+BATCH_SIZE = 20000
+
+# distances under this count as this in the inverse distance weights (a well on top of a facility)
+MIN_DISTANCE = 100.0
+
+LAYER_TYPES = ["point", "line", "polygon"]
+
+
+def coordinate_pairs(tree, cx, cy, x, y, radius):
+	"""(points, coordinates) index pairs of the indexed coordinates (cx, cy and their KD-tree, None without scipy)
+	within radius of the points"""
+	if not x.size or not cx.size:
+		return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+	if tree is not None:
+		pairs = cKDTree(numpy.column_stack((x, y))).sparse_distance_matrix(tree, radius, output_type="ndarray")
+		return pairs["i"].astype(numpy.int64), pairs["j"].astype(numpy.int64)
+	points = []
+	coordinates = []
+	batch_size = max(1, 2000000 // cx.size)
+	for start in range(0, x.size, batch_size):
+		stop = min(start + batch_size, x.size)
+		p, c = numpy.nonzero(numpy.hypot(x[start:stop, None] - cx, y[start:stop, None] - cy) <= radius)
+		points.append(p + start)
+		coordinates.append(c)
+	return numpy.concatenate(points), numpy.concatenate(coordinates)
+
+
+def run_starts(key):
+	"""index of the first value of every run of equal values of a sorted array (a sort is much faster than unique)"""
+	if not key.size:
+		return numpy.zeros(0, dtype=numpy.int64)
+	return numpy.flatnonzero(numpy.concatenate(([True], key[1:] != key[:-1])))
+
+
+def nearest_pairs(points, features, distance, count):
+	"""pairs of (points, features) with the smallest distance of each point and feature (of count features)"""
+	key = points * count + features
+	order = numpy.argsort(key)
+	key = key[order]
+	starts = run_starts(key)
+	if not starts.size:
+		return points[:0], features[:0], distance[:0]
+	return key[starts] // count, key[starts] % count, numpy.minimum.reduceat(distance[order], starts)
+
+
+def polygon_pairs(x, y, x0, y0, x1, y1, rows, bins=None):
+	"""(points, polygon rows) of the points inside the polygons, by the even odd rule over the edges (x0, y0) -
+	(x1, y1) of the rings of each polygon row. The edges are sorted into horizontal bands and every point is only
+	tested against the edges of its band"""
+	ylo = numpy.minimum(y0, y1)
+	yhi = numpy.maximum(y0, y1)
+	edges = numpy.nonzero(yhi > ylo)[0]  # horizontal edges never cross the horizontal ray
+	if not edges.size or not x.size:
+		return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+	bins = bins or max(1, int(numpy.sqrt(edges.size)))
+	bottom = ylo[edges].min()
+	height = (yhi[edges].max() - bottom) / bins
+	first = numpy.minimum(((ylo[edges] - bottom) // height).astype(numpy.int64), bins - 1)
+	last = numpy.minimum(((yhi[edges] - bottom) // height).astype(numpy.int64), bins - 1)
+	counts = last - first + 1
+	band_edge = numpy.repeat(edges, counts)
+	band = numpy.repeat(first, counts) + numpy.arange(band_edge.size) - \
+		numpy.repeat(numpy.cumsum(counts) - counts, counts)
+	order = numpy.argsort(band, kind="mergesort")
+	band_edge = band_edge[order]
+	starts = numpy.searchsorted(band[order], numpy.arange(bins + 1))
+
+	point_band = numpy.floor((y - bottom) / height)
+	candidates = numpy.nonzero((point_band >= 0) & (point_band < bins))[0]
+	candidates = candidates[numpy.argsort(point_band[candidates], kind="mergesort")]
+	point_starts = numpy.searchsorted(point_band[candidates], numpy.arange(bins + 1))
+	points = []
+	polygons = []
+	for b in range(bins):
+		e = band_edge[starts[b]:starts[b + 1]]
+		in_band = candidates[point_starts[b]:point_starts[b + 1]]
+		if not e.size or not in_band.size:
+			continue
+		ex0, ey0, ex1, ey1 = x0[e], y0[e], x1[e], y1[e]
+		batch_size = max(1, 2000000 // e.size)
+		for start in range(0, in_band.size, batch_size):
+			p = in_band[start:start + batch_size, None]
+			cross = (ey0 > y[p]) != (ey1 > y[p])
+			cross &= x[p] < ex0 + (y[p] - ey0) * (ex1 - ex0) / (ey1 - ey0)  # the band has no horizontal edges
+			pi, ei = numpy.nonzero(cross)
+			points.append(p[pi, 0])
+			polygons.append(rows[e[ei]])
+	if not points:
+		return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+	count = int(rows.max()) + 1
+	key = numpy.sort(numpy.concatenate(points) * count + numpy.concatenate(polygons))
+	starts = run_starts(key)
+	crossings = numpy.diff(numpy.append(starts, key.size))
+	key = key[starts[crossings % 2 == 1]]
+	return key // count, key % count
+
+
+class FeatureLayer(object):
+	"""index of the features of a layer with the load of every feature (None without a load). The layer types define
+	search(x, y): (distance to the nearest feature, (points, features, distance) pairs within the radius, other
+	columns)"""
+
+	def __init__(self, name, ids, radius, load=None):
+		self.name = name
+		self.ids = ids
+		self.radius = radius
+		self.load = load
+
+	def predictors(self, x, y, power=2, min_distance=MIN_DISTANCE):
+		"""columns NAME_DIST, NAME_N, NAME_IDW (with a load) and the columns of the layer type of the points"""
+		distance, (points, features, pair_distance), other = self.search(x, y)
+		columns = OrderedDict()
+		columns[self.name + "_DIST"] = distance
+		columns[self.name + "_N"] = numpy.bincount(points, minlength=x.size)
+		if self.load is not None:
+			weights = self.load[features] / numpy.maximum(pair_distance, min_distance) ** power
+			# bincount gives integers when there are no pairs
+			columns[self.name + "_IDW"] = numpy.bincount(points, weights, minlength=x.size).astype(numpy.float64)
+		columns.update((self.name + "_" + field, column) for field, column in other.items())
+		return columns
+
+
+class PointLayer(FeatureLayer):
+	"""KD-tree of the points of a layer"""
+
+	def __init__(self, name, ids, x, y, radius, load=None):
+		FeatureLayer.__init__(self, name, ids, radius, load)
+		if not ids.size:
+			raise ValueError("Layer %s has no points" % name)
+		self.x = x
+		self.y = y
+		self.tree = cKDTree(numpy.column_stack((x, y))) if cKDTree is not None else None
+
+	def search(self, x, y):
+		if self.tree is not None:
+			distance = self.tree.query(numpy.column_stack((x, y)))[0]
+		else:
+			distance = distance_engine.brute_force_nearest(x, y, self.x, self.y, self.x, self.y)[0]
+		points, features = coordinate_pairs(self.tree, self.x, self.y, x, y, self.radius)
+		pair_distance = numpy.hypot(self.x[features] - x[points], self.y[features] - y[points])
+		return distance, (points, features, pair_distance), {}
+
+
+class LineLayer(FeatureLayer):
+	"""segment index (distance_engine.LineIndex) of the lines of a layer"""
+
+	def __init__(self, name, ids, lines, radius, load=None, spacing=None):
+		FeatureLayer.__init__(self, name, ids, radius, load)
+		self.index = distance_engine.LineIndex(ids, lines, spacing)
+
+	def segment_pairs(self, x, y):
+		"""(points, features, distance) of the features with a segment within the radius of the points. Every point
+		of a segment is within half of the sample spacing of a sample, so the samples within the radius plus that
+		find every segment within the radius"""
+		index = self.index.index
+		points, samples = coordinate_pairs(index.tree, index.samples[:, 0], index.samples[:, 1], x, y,
+		                                   self.radius + index.half)
+		key = numpy.sort(points * index.x0.size + index.segment[samples])
+		key = key[run_starts(key)]  # each point and segment once
+		points, segments = key // index.x0.size, key % index.x0.size
+		distance = geometry.segment_distance(x[points], y[points], index.x0[segments], index.y0[segments],
+		                                     index.x1[segments], index.y1[segments])
+		near = distance <= self.radius
+		return nearest_pairs(points[near], self.index.rows[segments[near]], distance[near], self.ids.size)
+
+	def search(self, x, y):
+		return self.index.nearest(x, y)[0], self.segment_pairs(x, y), {}
+
+
+class PolygonLayer(LineLayer):
+	"""segment index of the polygon boundaries of a layer, with the even odd rule for the points inside"""
+
+	def __init__(self, name, ids, polygons, radius, load=None, spacing=None):
+		rings = []
+		for polygon in polygons:
+			closed = []
+			for ring in polygon:
+				ring = numpy.asarray(ring, dtype=numpy.float64)[:, :2]
+				if (ring[0] != ring[-1]).any():
+					ring = numpy.vstack((ring, ring[:1]))
+				closed.append(ring)
+			rings.append(closed)
+		LineLayer.__init__(self, name, ids, rings, radius, load, spacing)
+
+	def search(self, x, y):
+		index = self.index
+		inside_points, inside_features = polygon_pairs(x, y, index.x0, index.y0, index.x1, index.y1, index.rows)
+		points, features, distance = self.segment_pairs(x, y)
+		pairs = nearest_pairs(numpy.concatenate((points, inside_points)), numpy.concatenate((features, inside_features)),
+		                      numpy.concatenate((distance, numpy.zeros(inside_points.size))), self.ids.size)
+		inside = numpy.zeros(x.size, dtype=numpy.int64)
+		inside[inside_points] = 1
+		return index.nearest(x, y)[0], pairs, {"IN": inside}
+
+
+def read_load(io, layer, ids):
+	"""load of every feature: load_field of the load table joined on load_id, or of the layer, 0 for the features
+	missing from the load table"""
+	table = layer.get("load", layer["path"])
+	if table == layer["path"]:
+		return io.read_table(table, [layer["load_field"]])[layer["load_field"]].astype(numpy.float64)
+	load_id = layer.get("load_id", layer.get("id_field"))
+	rows = io.read_table(table, [load_id, layer["load_field"]])
+	target, source = join_engine.IdIndex(ids).match(rows[load_id])
+	load = numpy.zeros(ids.size)
+	numpy.add.at(load, target, rows[layer["load_field"]].astype(numpy.float64)[source])  # facilities in several rows
+	return load
+
+
+def read_layer(io, layer, spatial_reference=None, radius=None):
+	"""FeatureLayer of a layer of the spec projected to spatial_reference"""
+	name = layer.get("name")
+	if not name:
+		raise ValueError("Layer %s has no name" % layer.get("path"))
+	layer_type = layer.get("type", "").lower()
+	if layer_type not in LAYER_TYPES:
+		raise ValueError("Layer %s: unknown type '%s', use one of %s" % (name, layer.get("type"), ", ".join(LAYER_TYPES)))
+	radius = geometry.linear_distance(layer.get("radius") or radius or config.distance_radius)
+	id_field = layer.get("id_field")
+	if layer_type == "point":
+		ids, x, y = io.read_points(layer["path"], id_field, spatial_reference)
+		feature_layer = PointLayer(name, ids, x, y, radius)
+	elif layer_type == "line":
+		ids, lines = io.read_lines(layer["path"], id_field, spatial_reference)
+		feature_layer = LineLayer(name, ids, lines, radius, spacing=layer.get("spacing"))
+	else:
+		ids, polygons = io.read_polygons(layer["path"], id_field, spatial_reference)
+		feature_layer = PolygonLayer(name, ids, polygons, radius, spacing=layer.get("spacing"))
+	if layer.get("load_field"):
+		feature_layer.load = read_load(io, layer, ids)
+	return feature_layer
+
+
+def load_layers(spec_file):
+	"""layers of a spec file with the paths relative to the spec file made absolute, and the other settings"""
+	spec = join_engine.load_spec(spec_file)
+	folder = os.path.dirname(os.path.abspath(spec_file))
+	for layer in spec["layers"]:
+		for key in ("path", "load"):
+			if key in layer:
+				layer[key] = os.path.normpath(os.path.join(folder, layer[key]))
+	return spec
+
+
+def distance_predictors(io, points, layers, id_field, radius=None, power=None, min_distance=MIN_DISTANCE,
+                        batch_size=BATCH_SIZE):
+	"""wide table of the distance predictors of every layer (dicts of the spec) for the points (or circle centers),
+	in the units of the spatial reference of the first layer"""
+	names = [layer.get("name") for layer in layers]
+	if not layers or len(set(names)) < len(names):
+		raise ValueError("The layers need different names: %s" % ", ".join(str(name) for name in names))
+	power = config.distance_power if power is None else power
+	spatial_reference = io.spatial_reference(layers[0]["path"])
+	ids, x, y, _ = io_backend.read_centers(io, points, id_field, spatial_reference)
+	feature_layers = [read_layer(io, layer, spatial_reference, radius) for layer in layers]
+
+	table = None
+	for start in range(0, ids.size, batch_size):
+		stop = min(start + batch_size, ids.size)
+		columns = OrderedDict()
+		for feature_layer in feature_layers:
+			columns.update(feature_layer.predictors(x[start:stop], y[start:stop], power, min_distance))
+		if table is None:
+			table = numpy.zeros(ids.size, dtype=[(id_field, ids.dtype)] + [(name, column.dtype)
+			                                                               for name, column in columns.items()])
+			table[id_field] = ids
+		for name, column in columns.items():
+			table[name][start:stop] = column
+	if table is None:
+		raise ValueError("No points in %s" % points)
+	return table
+
+
+def main(points, layers, output, radius=None, power=None, id_field=None, backend=None):
+	"""writes the distance predictors of the layers of a spec file for the points to the output table"""
+	if not hasattr(backend, "read_table"):
+		backend = io_backend.get_backend(backend)
+	start = time.time()
+	spec = load_layers(layers)
+	table = distance_predictors(backend, points, spec["layers"], id_field or config.well_id_field,
+	                            radius or spec.get("radius"), spec.get("power") if power is None else power,
+	                            spec.get("min_distance", MIN_DISTANCE))
+	backend.write_table(table, output)
+	print("Distance predictors of %d layers for %d points in %.1f s" % (len(spec["layers"]), table.size,
+	                                                                    time.time() - start))
+	return table
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Nearest distance, count and inverse distance weighted load of layers")
+	parser.add_argument("points", help="wells (or grid points, or a circles table)")
+	parser.add_argument("layers", help="json file of the layers (scripts/distance_layers.json)")
+	parser.add_argument("output", help="output table")
+	parser.add_argument("--radius", help='radius of the counts and loads like "5 Miles", default config.distance_radius')
+	parser.add_argument("--power", type=float, help="power of the inverse distance weights, default config.distance_power")
+	parser.add_argument("--id-field", help="id field of the points, default config.well_id_field")
+	parser.add_argument("--backend", choices=sorted(io_backend.BACKENDS), help="I/O backend, default arcpy if installed")
+	args = parser.parse_args()
+	main(args.points, args.layers, args.output, args.radius, args.power, args.id_field, args.backend)
@@ -0,0 +1,67 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: geometry.py
+# Purpose: plain numpy geometry helpers shared by the arcpy free engines (units and buffer circles)
+# ---------------------------------------------------------------------------------------------------
+
+import numpy
+
+
+# meters in each linear unit used in config.buffer_dist
+UNITS = {
+	"meters": 1.0,
+	"kilometers": 1000.0,
+	"feet": 0.3048,
+	"miles": 1609.344,
+}
+
+
+def linear_distance(text):
+	"""Distance in meters of an arcpy linear unit string like "1.5 Miles" """
+	value, unit = text.split()
+	unit = unit.lower()
+	if not unit.endswith("s"):
+		unit += "s"
+	if unit not in UNITS:
+		raise ValueError("Unknown linear unit '%s', use one of %s" % (unit, ", ".join(UNITS)))
+	return float(value) * UNITS[unit]
+
+
+def circle_rings(x, y, radius, segments=90):
+	"""Ring of a regular polygon with segments vertices around each (x, y) point. Returns an array of shape
+	(points, segments, 2). The vertices are on the circle, so the polygon area is a little under pi * r ** 2"""
+	angle = numpy.linspace(0, 2 * numpy.pi, segments, endpoint=False)
+	x = numpy.asarray(x, dtype=numpy.float64)[:, None]
+	y = numpy.asarray(y, dtype=numpy.float64)[:, None]
+	radius = numpy.asarray(radius, dtype=numpy.float64)
+	if radius.ndim:
+		radius = radius[:, None]  # a radius for each point
+	return numpy.dstack((x + radius * numpy.cos(angle), y + radius * numpy.sin(angle)))
+
+
+def segment_projection(px, py, x0, y0, x1, y1):
+	"""(distance, fraction along the segment) of the nearest point of the segments (x0, y0) - (x1, y1) to the points
+	(px, py), all arrays broadcast together"""
+	dx = x1 - x0
+	dy = y1 - y0
+	length2 = dx * dx + dy * dy
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		t = numpy.clip(((px - x0) * dx + (py - y0) * dy) / length2, 0.0, 1.0)
+	t = numpy.where(length2 > 0, t, 0.0)  # zero length segments are points
+	return numpy.hypot(px - (x0 + t * dx), py - (y0 + t * dy)), t
+
+
+def segment_distance(px, py, x0, y0, x1, y1):
+	"""Distance from the points (px, py) to the segments (x0, y0) - (x1, y1), all arrays broadcast together"""
+	return segment_projection(px, py, x0, y0, x1, y1)[0]
+
+
+def ring_edges(rings):
+	"""(x0, y0, x1, y1) arrays of the edges of all of the rings, closing the rings that are open"""
+	edges = []
+	for ring in rings:
+		ring = numpy.asarray(ring, dtype=numpy.float64)[:, :2]
+		if len(ring) and (ring[0] != ring[-1]).any():
+			ring = numpy.vstack((ring, ring[:1]))
+		edges.append(numpy.hstack((ring[:-1], ring[1:])))
+	edges = numpy.vstack(edges) if edges else numpy.zeros((0, 4))
+	return edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
@@ -0,0 +1,606 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: io_backend.py
+# Purpose: raster, vector and table I/O for the numpy engines behind one interface, with an arcpy backend for
+#          the toolbox and a rasterio/fiona (GDAL) backend so the same pipelines run outside of ArcGIS.
+#
+#          Every backend has the methods
+#            spatial_reference(dataset)                 spatial reference of a raster or feature class as a string
+#            read_raster(raster)                        (window reader, zonal_engine.RasterGrid, nodata value)
+#            read_points(fc, id_field, sr=None)         (ids, x, y) projected to sr, the feature ids when id_field
+#                                                       is None
+#            read_polygons(fc, id_field, sr=None)       (ids, list of rings for each polygon) projected to sr, the
+#                                                       feature ids when id_field is None
+#            read_lines(fc, id_field, sr=None)          (ids, list of parts (vertex arrays) for each line) projected
+#                                                       to sr, the feature ids when id_field is None
+#            write_polygons(fc, id_field, ids, polygons, sr)  replaces the feature class with the polygons
+#            upsert_polygons(fc, id_field, ids, polygons, remove_ids, sr)  removes the features of remove_ids and
+#                                                       adds the polygons
+#            write_points(fc, id_field, ids, x, y, sr)  replaces the feature class with the points
+#            project_points(x, y, from_sr, to_sr)       x and y projected from one spatial reference to another
+#            read_table(table, fields=None, null_value=0)  numpy structured array, nulls as null_value
+#            table_fields(table)                        field names of a table without reading its rows
+#            write_table(array, table)                  replaces the table with the structured array
+#            table_name(name, workspace)                valid table name for the workspace
+#
+#          Tables named .parquet (Apache Parquet) or .arrow/.feather (Arrow IPC) are read and written with pyarrow by
+#          both backends: typed columns, text columns dictionary encoded and no limit on the field names.
+#
+#          Buffers can also be a circles table (id, X, Y, RADIUS) with the spatial reference in a .prj file next to
+#          it (write_circles / read_circles), which the numpy engines use instead of buffer polygons.
+# ---------------------------------------------------------------------------------------------------
+
+import os
+import re
+import struct
+
+import numpy
+
+import config
+import geometry
+import zonal_engine
+
+
+class ArcpyBackend(object):
+	"""I/O through arcpy (ArcMap / ArcGIS Pro)"""
+	name = "arcpy"
+
+	def __init__(self):
+		import arcpy
+		self.arcpy = arcpy
+
+	def _spatial_reference(self, sr):
+		if sr is None or hasattr(sr, "exportToString"):
+			return sr
+		spatial_reference = self.arcpy.SpatialReference()
+		spatial_reference.loadFromString(sr)
+		return spatial_reference
+
+	def spatial_reference(self, dataset):
+		return self.arcpy.Describe(dataset).spatialReference.exportToString()
+
+	def read_raster(self, raster):
+		"""The reader returns the numpy array of rows row0:row1 and columns col0:col1 of the raster"""
+		arcpy = self.arcpy
+		ras = arcpy.Raster(raster)
+		grid = zonal_engine.RasterGrid(ras.extent.XMin, ras.extent.YMax, ras.meanCellWidth, ras.meanCellHeight,
+		                               ras.height, ras.width, crs=ras.spatialReference.exportToString())
+
+		def read(row0, row1, col0, col1):
+			lower_left = arcpy.Point(grid.xmin + col0 * grid.cell_width, grid.ymax - row1 * grid.cell_height)
+			return arcpy.RasterToNumPyArray(ras, lower_left, col1 - col0, row1 - row0)
+		return read, grid, ras.noDataValue
+
+	def read_points(self, fc, id_field, spatial_reference=None):
+		fields = [id_field or "OID@", "SHAPE@X", "SHAPE@Y"]
+		rows = self.arcpy.da.FeatureClassToNumPyArray(fc, fields,
+		                                              spatial_reference=self._spatial_reference(spatial_reference))
+		return rows[fields[0]], rows["SHAPE@X"].astype(numpy.float64), rows["SHAPE@Y"].astype(numpy.float64)
+
+	def read_polygons(self, fc, id_field, spatial_reference=None):
+		ids = []
+		polygons = []
+		fields = [id_field or "OID@", "SHAPE@"]
+		with self.arcpy.da.SearchCursor(fc, fields, spatial_reference=self._spatial_reference(spatial_reference)) as cursor:
+			for row in cursor:
+				rings = []
+				for part in row[1]:
+					ring = []
+					for pnt in part:
+						if pnt is None:  # null point separates the interior rings
+							rings.append(ring)
+							ring = []
+						else:
+							ring.append((pnt.X, pnt.Y))
+					rings.append(ring)
+				ids.append(row[0])
+				polygons.append([numpy.array(ring) for ring in rings if len(ring) > 2])
+		return numpy.array(ids), polygons
+
+	def read_lines(self, fc, id_field, spatial_reference=None):
+		ids = []
+		lines = []
+		fields = [id_field or "OID@", "SHAPE@"]
+		with self.arcpy.da.SearchCursor(fc, fields, spatial_reference=self._spatial_reference(spatial_reference)) as cursor:
+			for row in cursor:
+				parts = []
+				if row[1] is not None:
+					for part in row[1]:
+						parts.append(numpy.array([(pnt.X, pnt.Y) for pnt in part if pnt is not None]))
+				ids.append(row[0])
+				lines.append([part for part in parts if len(part) > 1])
+		return numpy.array(ids), lines
+
+	def write_polygons(self, fc, id_field, ids, polygons, spatial_reference=None):
+		arcpy = self.arcpy
+		if arcpy.Exists(fc):
+			arcpy.Delete_management(fc)
+		sr = self._spatial_reference(spatial_reference)
+		path, name = os.path.split(fc)
+		arcpy.CreateFeatureclass_management(path, name, "POLYGON", spatial_reference=sr)
+		arcpy.AddField_management(fc, id_field, "TEXT" if numpy.asarray(ids).dtype.kind in "US" else "LONG")
+		self._insert_polygons(fc, id_field, ids, polygons, sr)
+
+	def _insert_polygons(self, fc, id_field, ids, polygons, sr):
+		arcpy = self.arcpy
+		with arcpy.da.InsertCursor(fc, [id_field, "SHAPE@"]) as cursor:
+			for zone_id, rings in zip(ids, polygons):
+				parts = arcpy.Array([arcpy.Array([arcpy.Point(x, y) for x, y in ring]) for ring in rings])
+				cursor.insertRow([zone_id.item() if hasattr(zone_id, "item") else zone_id, arcpy.Polygon(parts, sr)])
+
+	def upsert_polygons(self, fc, id_field, ids, polygons, remove_ids, spatial_reference=None):
+		remove = set(numpy.asarray(remove_ids).tolist())
+		with self.arcpy.da.UpdateCursor(fc, [id_field]) as cursor:
+			for row in cursor:
+				if row[0] in remove:
+					cursor.deleteRow()
+		self._insert_polygons(fc, id_field, ids, polygons, self._spatial_reference(spatial_reference))
+
+	def write_points(self, fc, id_field, ids, x, y, spatial_reference=None):
+		arcpy = self.arcpy
+		if arcpy.Exists(fc):
+			arcpy.Delete_management(fc)
+		sr = self._spatial_reference(spatial_reference)
+		path, name = os.path.split(fc)
+		arcpy.CreateFeatureclass_management(path, name, "POINT", spatial_reference=sr)
+		arcpy.AddField_management(fc, id_field, "TEXT" if numpy.asarray(ids).dtype.kind in "US" else "LONG")
+		with arcpy.da.InsertCursor(fc, [id_field, "SHAPE@XY"]) as cursor:
+			for row in zip(numpy.asarray(ids).tolist(), zip(numpy.asarray(x).tolist(), numpy.asarray(y).tolist())):
+				cursor.insertRow(row)
+
+	def project_points(self, x, y, from_sr, to_sr):
+		arcpy = self.arcpy
+		from_sr = self._spatial_reference(from_sr)
+		to_sr = self._spatial_reference(to_sr)
+		points = [arcpy.PointGeometry(arcpy.Point(px, py), from_sr).projectAs(to_sr).firstPoint
+		          for px, py in zip(numpy.asarray(x).tolist(), numpy.asarray(y).tolist())]
+		return numpy.array([p.X for p in points]), numpy.array([p.Y for p in points])
+
+	def read_table(self, table, fields=None, null_value=0):
+		if is_columnar(table):
+			return read_columnar(table, fields, null_value)
+		if fields is None:
+			fields = [f.name for f in self.arcpy.ListFields(table) if f.type not in ("OID", "Geometry")]
+		return self.arcpy.da.TableToNumPyArray(table, fields, null_value=null_value)
+
+	def table_fields(self, table):
+		if is_columnar(table):
+			return columnar_fields(table)
+		return [f.name for f in self.arcpy.ListFields(table) if f.type not in ("OID", "Geometry")]
+
+	def write_table(self, array, table):
+		if is_columnar(table):
+			return write_columnar(array, table)
+		check_dbf_fields(array, table)
+		if self.arcpy.Exists(table):
+			self.arcpy.Delete_management(table)
+		self.arcpy.da.NumPyArrayToTable(array, table)
+
+	def table_name(self, name, workspace):
+		return self.arcpy.ValidateTableName(name, workspace)
+
+
+# numpy dtype kind -> fiona field type
+FIONA_TYPES = {"i": "int", "u": "int", "f": "float", "U": "str", "S": "str", "b": "bool"}
+
+# table extension -> fiona (GDAL) driver
+DRIVERS = {".csv": "CSV", ".dbf": "ESRI Shapefile", ".shp": "ESRI Shapefile", ".gpkg": "GPKG", ".gdb": "OpenFileGDB"}
+
+
+# columnar table extensions written with pyarrow
+COLUMNAR = (".parquet", ".arrow", ".feather")
+
+
+def is_columnar(table):
+	return os.path.splitext(table)[1].lower() in COLUMNAR
+
+
+def check_dbf_fields(array, table):
+	"""dbf field names are cut to 10 characters, which would make fields like VALUE_212910 and VALUE_212911 of a
+	tabulated area table the same field"""
+	if os.path.splitext(table)[1].lower() != ".dbf":
+		return
+	names = [field[:10] for field in array.dtype.names]
+	same = sorted(set(f for f in array.dtype.names if names.count(f[:10]) > 1))
+	if same:
+		raise ValueError("Fields %s of %s are the same in a dbf (10 character names), write a .parquet table instead"
+		                 % (", ".join(same), table))
+
+
+def structured_array(fields, columns, block_rows=16384):
+	"""numpy structured array of the columns, filled a block of rows at a time so the rows stay in the cache while all
+	of the fields are copied (about twice as fast as copying whole columns into a wide table)"""
+	array = numpy.zeros(len(columns[0]) if columns else 0, dtype=[(f, c.dtype) for f, c in zip(fields, columns)])
+	for start in range(0, array.size, block_rows):
+		rows = array[start:start + block_rows]
+		for field, column in zip(fields, columns):
+			rows[field] = column[start:start + block_rows]
+	return array
+
+
+def write_columnar(array, table):
+	"""Writes a numpy structured array as a parquet or arrow table with the dtype of every field. Text fields are
+	dictionary encoded, the parquet writer also dictionary encodes the id and class columns of each row group"""
+	import pyarrow
+	import pyarrow.parquet
+
+	columns = []
+	for field in array.dtype.names:
+		values = array[field]
+		if values.dtype.kind in "US":
+			column = pyarrow.array(values.astype(numpy.str_).tolist(), pyarrow.string()).dictionary_encode()
+		else:
+			column = pyarrow.array(numpy.ascontiguousarray(values))
+		columns.append(column)
+	arrow_table = pyarrow.Table.from_arrays(columns, names=list(array.dtype.names))
+	if os.path.splitext(table)[1].lower() == ".parquet":
+		pyarrow.parquet.write_table(arrow_table, table)
+	else:
+		with pyarrow.OSFile(table, "wb") as sink:
+			with pyarrow.ipc.new_file(sink, arrow_table.schema) as writer:
+				writer.write_table(arrow_table)
+
+
+def columnar_fields(table):
+	"""field names of a parquet or arrow table from its schema"""
+	import pyarrow
+	import pyarrow.parquet
+
+	if os.path.splitext(table)[1].lower() == ".parquet":
+		return pyarrow.parquet.read_schema(table).names
+	with pyarrow.memory_map(table, "r") as source:
+		return pyarrow.ipc.open_file(source).schema.names
+
+
+def read_columnar(table, fields=None, null_value=0):
+	"""Reads a parquet or arrow table as a numpy structured array, nulls as null_value (integer fields with nulls are
+	float64 when null_value is not an integer)"""
+	import pyarrow
+	import pyarrow.parquet
+
+	if os.path.splitext(table)[1].lower() == ".parquet":
+		arrow_table = pyarrow.parquet.read_table(table, columns=fields)
+	else:
+		with pyarrow.memory_map(table, "r") as source:
+			arrow_table = pyarrow.ipc.open_file(source).read_all()
+		if fields is not None:
+			arrow_table = arrow_table.select(fields)
+
+	columns = []
+	for field, column in zip(arrow_table.column_names, arrow_table.columns):
+		if pyarrow.types.is_dictionary(column.type):
+			column = column.cast(column.type.value_type)
+		if pyarrow.types.is_string(column.type) or pyarrow.types.is_large_string(column.type):
+			values = numpy.array(column.fill_null("").to_pylist(), dtype=numpy.str_)
+		elif column.null_count == 0:
+			values = column.to_numpy()
+		elif pyarrow.types.is_integer(column.type) and float(null_value or 0).is_integer():
+			values = column.fill_null(int(null_value or 0)).to_numpy()
+		else:
+			values = column.cast(pyarrow.float64()).fill_null(float(null_value)).to_numpy()
+		columns.append(values)
+	return structured_array(arrow_table.column_names, columns)
+
+
+def _dbf_header(f):
+	"""(record count, header size, record size, (name, type, size, decimals) of every field) of an open dbf file"""
+	count, header_size, record_size = struct.unpack("<4xIHH", f.read(12))
+	f.seek(32)
+	descriptors = []
+	while True:
+		descriptor = f.read(32)
+		if not descriptor or descriptor[:1] == b"\r":
+			break
+		name, field_type, size, decimals = struct.unpack("<11sc4xBB", descriptor[:18])
+		descriptors.append((name.split(b"\0")[0].decode("ascii"), field_type.decode("ascii"), size, decimals))
+	return count, header_size, record_size, descriptors
+
+
+def dbf_fields(table):
+	"""field names of a dbf table from its header"""
+	with open(table, "rb") as f:
+		return [d[0] for d in _dbf_header(f)[3]]
+
+
+def read_dbf(table, fields=None, null_value=0):
+	"""Reads a dbf table into a numpy structured array column by column: the fixed width records are read in one
+	block and every field is converted as a whole array. Numeric fields without decimals are int64 (float64 when they
+	have nulls and null_value is not an integer), nulls (blank or "*" filled values) are null_value"""
+	with open(table, "rb") as f:
+		count, header_size, record_size, descriptors = _dbf_header(f)
+		f.seek(header_size)
+		# fields by position, the names can repeat (the first one is read, like GDAL)
+		record = [("deleted", "S1")] + [("f%d" % i, "S%d" % d[2]) for i, d in enumerate(descriptors)]
+		skip = record_size - sum(d[2] for d in descriptors) - 1
+		if skip > 0:
+			record.append(("padding", "S%d" % skip))
+		records = numpy.fromfile(f, dtype=record, count=count)
+	records = records[records["deleted"] != b"*"]
+
+	encoding = "utf-8"
+	cpg = os.path.splitext(table)[0] + ".cpg"
+	if os.path.exists(cpg):
+		with open(cpg) as f:
+			encoding = f.read().strip() or encoding
+
+	positions = {}
+	for i, d in enumerate(descriptors):
+		positions.setdefault(d[0], i)
+	if fields is None:
+		fields = sorted(positions, key=positions.get)
+	columns = []
+	for field in fields:
+		if field not in positions:
+			raise ValueError("Field %s not found in %s" % (field, table))
+		name, field_type, size, decimals = descriptors[positions[field]]
+		raw = numpy.char.strip(records["f%d" % positions[field]])
+		if field_type in "NF":
+			null = (raw == b"") | numpy.char.startswith(raw, b"*")
+			values = numpy.where(null, b"0", raw)
+			integer = field_type == "N" and decimals == 0 and size < 19
+			if integer and (not null.any() or float(null_value or 0).is_integer()):
+				column = values.astype(numpy.int64)
+				if null.any():
+					column[null] = null_value or 0
+			else:
+				column = values.astype(numpy.float64)
+				column[null] = null_value
+		elif field_type == "L":
+			column = numpy.char.upper(raw) == b"T"
+		else:
+			column = numpy.char.decode(raw, encoding, "replace")
+		columns.append(column)
+
+	return structured_array(fields, columns)
+
+
+def _split_dataset(path):
+	"""(data source, layer) of a path, where layers of a geodatabase or geopackage are given as <source>/<layer>"""
+	parent, name = os.path.split(path)
+	if os.path.splitext(parent)[1].lower() in (".gdb", ".gpkg"):
+		return parent, name
+	return path, None
+
+
+def _polygon_records(id_field, ids, polygons):
+	"""fiona records of the polygons (list of rings each) with their ids"""
+	for zone_id, rings in zip(ids.tolist(), polygons):
+		coordinates = [[tuple(p) for p in ring] + [tuple(ring[0])] for ring in rings]
+		yield {"geometry": {"type": "Polygon", "coordinates": coordinates}, "properties": {id_field: zone_id}}
+
+
+class GdalBackend(object):
+	"""I/O with rasterio (rasters) and fiona (features and tables), no arcpy needed"""
+	name = "gdal"
+
+	def __init__(self):
+		import fiona
+		import rasterio
+		self.fiona = fiona
+		self.rasterio = rasterio
+
+	def _open(self, path, **kwargs):
+		source, layer = _split_dataset(path)
+		return self.fiona.open(source, layer=layer, **kwargs)
+
+	def spatial_reference(self, dataset):
+		try:
+			with self.rasterio.open(dataset) as src:
+				return src.crs.to_wkt() if src.crs else None
+		except self.rasterio.errors.RasterioIOError:
+			with self._open(dataset) as src:
+				return src.crs_wkt or None
+
+	def read_raster(self, raster):
+		reader = zonal_engine.RasterioReader(raster)
+		return reader, reader.grid, reader.nodata
+
+	def read_points(self, fc, id_field, spatial_reference=None):
+		from fiona.transform import transform
+
+		with self._open(fc) as src:
+			features = list(src)
+			crs = src.crs_wkt
+		ids = numpy.array([feature["properties"][id_field] if id_field else int(feature.id) for feature in features])
+		x = numpy.array([feature["geometry"]["coordinates"][0] for feature in features], dtype=numpy.float64)
+		y = numpy.array([feature["geometry"]["coordinates"][1] for feature in features], dtype=numpy.float64)
+		if spatial_reference and crs and crs != spatial_reference and len(features):
+			x, y = transform(crs, spatial_reference, x.tolist(), y.tolist())
+			x, y = numpy.array(x), numpy.array(y)
+		return ids, x, y
+
+	def read_polygons(self, fc, id_field, spatial_reference=None):
+		from fiona.transform import transform_geom
+
+		ids = []
+		polygons = []
+		with self._open(fc) as src:
+			transform = spatial_reference and src.crs_wkt and src.crs_wkt != spatial_reference
+			for feature in src:
+				geometry = feature["geometry"]
+				if transform:
+					geometry = transform_geom(src.crs_wkt, spatial_reference, geometry)
+				parts = geometry["coordinates"]
+				if geometry["type"] == "Polygon":
+					parts = [parts]
+				rings = [numpy.asarray(ring, dtype=numpy.float64)[:, :2] for part in parts for ring in part]
+				ids.append(feature["properties"][id_field] if id_field else int(feature.id))
+				polygons.append([ring for ring in rings if len(ring) > 2])
+		return numpy.array(ids), polygons
+
+	def read_lines(self, fc, id_field, spatial_reference=None):
+		from fiona.transform import transform_geom
+
+		ids = []
+		lines = []
+		with self._open(fc) as src:
+			transform = spatial_reference and src.crs_wkt and src.crs_wkt != spatial_reference
+			for feature in src:
+				geometry = feature["geometry"]
+				parts = []
+				if geometry is not None:
+					if transform:
+						geometry = transform_geom(src.crs_wkt, spatial_reference, geometry)
+					parts = geometry["coordinates"]
+					if geometry["type"] == "LineString":
+						parts = [parts]
+				ids.append(feature["properties"][id_field] if id_field else int(feature.id))
+				lines.append([numpy.asarray(part, dtype=numpy.float64)[:, :2] for part in parts if len(part) > 1])
+		return numpy.array(ids), lines
+
+	def write_polygons(self, fc, id_field, ids, polygons, spatial_reference=None):
+		source, layer = _split_dataset(fc)
+		driver = DRIVERS.get(os.path.splitext(source)[1].lower())
+		if driver is None:
+			raise ValueError("Unsupported feature class format: %s" % fc)
+		if layer is None and os.path.exists(source):
+			self.fiona.remove(source, driver=driver)
+
+		ids = numpy.asarray(ids)
+		schema = {"geometry": "Polygon", "properties": {id_field: FIONA_TYPES[ids.dtype.kind]}}
+		with self.fiona.open(source, "w", driver=driver, schema=schema, layer=layer, crs_wkt=spatial_reference) as dst:
+			dst.writerecords(_polygon_records(id_field, ids, polygons))
+
+	def upsert_polygons(self, fc, id_field, ids, polygons, remove_ids, spatial_reference=None):
+		# fiona cannot delete features, so the kept features are copied as they are (without reading their
+		# geometry into numpy) to the feature class written again with the new polygons
+		remove = set(numpy.asarray(remove_ids).tolist())
+		with self._open(fc) as src:
+			schema, crs_wkt, driver = src.schema, src.crs_wkt, src.driver
+			kept = [feature for feature in src if feature["properties"][id_field] not in remove]
+		source, layer = _split_dataset(fc)
+		if layer is None:
+			self.fiona.remove(source, driver=driver)
+		with self.fiona.open(source, "w", driver=driver, schema=schema, layer=layer, crs_wkt=crs_wkt) as dst:
+			dst.writerecords(kept)
+			dst.writerecords(_polygon_records(id_field, numpy.asarray(ids), polygons))
+
+	def write_points(self, fc, id_field, ids, x, y, spatial_reference=None):
+		source, layer = _split_dataset(fc)
+		driver = DRIVERS.get(os.path.splitext(source)[1].lower())
+		if driver is None:
+			raise ValueError("Unsupported feature class format: %s" % fc)
+		if layer is None and os.path.exists(source):
+			self.fiona.remove(source, driver=driver)
+
+		ids = numpy.asarray(ids)
+		schema = {"geometry": "Point", "properties": {id_field: FIONA_TYPES[ids.dtype.kind]}}
+		with self.fiona.open(source, "w", driver=driver, schema=schema, layer=layer, crs_wkt=spatial_reference) as dst:
+			dst.writerecords({"geometry": {"type": "Point", "coordinates": (px, py)}, "properties": {id_field: point_id}}
+			                 for point_id, px, py in zip(ids.tolist(), numpy.asarray(x).tolist(), numpy.asarray(y).tolist()))
+
+	def project_points(self, x, y, from_sr, to_sr):
+		from fiona.transform import transform
+
+		x, y = transform(from_sr, to_sr, numpy.asarray(x).tolist(), numpy.asarray(y).tolist())
+		return numpy.array(x), numpy.array(y)
+
+	def read_table(self, table, fields=None, null_value=0):
+		if is_columnar(table):
+			return read_columnar(table, fields, null_value)
+		if os.path.splitext(table)[1].lower() == ".dbf":
+			return read_dbf(table, fields, null_value)
+		with self._open(table) as src:
+			schema = src.schema["properties"]
+			if fields is None:
+				fields = list(schema)
+			rows = [feature["properties"] for feature in src]
+
+		columns = []
+		for field in fields:
+			field_type = schema[field].split(":")[0]
+			values = [row[field] for row in rows]
+			if field_type == "int" and (None not in values or float(null_value or 0).is_integer()):
+				columns.append(numpy.array([null_value or 0 if v is None else v for v in values], dtype=numpy.int64))
+			elif field_type in ("int", "float"):
+				columns.append(numpy.array([null_value if v is None else v for v in values], dtype=numpy.float64))
+			else:
+				columns.append(numpy.array(["" if v is None else v for v in values]))
+		array = numpy.zeros(len(rows), dtype=[(f, c.dtype) for f, c in zip(fields, columns)])
+		for field, column in zip(fields, columns):
+			array[field] = column
+		return array
+
+	def table_fields(self, table):
+		if is_columnar(table):
+			return columnar_fields(table)
+		if os.path.splitext(table)[1].lower() == ".dbf":
+			return dbf_fields(table)
+		with self._open(table) as src:
+			return list(src.schema["properties"])
+
+	def write_table(self, array, table):
+		if is_columnar(table):
+			return write_columnar(array, table)
+		check_dbf_fields(array, table)
+		source, layer = _split_dataset(table)
+		driver = DRIVERS.get(os.path.splitext(source)[1].lower())
+		if driver is None:
+			raise ValueError("Unsupported table format: %s" % table)
+		if layer is None and os.path.exists(source):
+			os.remove(source)
+
+		schema = {"geometry": "None", "properties": {}}
+		for field in array.dtype.names:
+			schema["properties"][field] = FIONA_TYPES[array.dtype[field].kind]
+		options = {"CREATE_CSVT": "YES"} if driver == "CSV" else {}  # field types for reading the csv back
+		with self.fiona.open(source, "w", driver=driver, schema=schema, layer=layer, **options) as dst:
+			dst.writerecords({"geometry": None, "properties": dict(zip(array.dtype.names, row.tolist()))}
+			                 for row in array)
+
+	def table_name(self, name, workspace):
+		return re.sub("[^0-9A-Za-z_]", "_", name)
+
+
+BACKENDS = {"arcpy": ArcpyBackend, "gdal": GdalBackend}
+
+# fields of a circles table besides the id field
+CIRCLE_FIELDS = ["X", "Y", "RADIUS"]
+
+
+def write_circles(io, table, id_field, ids, x, y, radius, spatial_reference=None):
+	"""Writes buffers as a circles table (id, X, Y, RADIUS) and its spatial reference to <table>.prj"""
+	circles = numpy.zeros(len(ids), dtype=[(id_field, numpy.asarray(ids).dtype)] +
+	                                      [(field, numpy.float64) for field in CIRCLE_FIELDS])
+	circles[id_field], circles["X"], circles["Y"], circles["RADIUS"] = ids, x, y, radius
+	io.write_table(circles, table)
+	if spatial_reference:
+		with open(os.path.splitext(table)[0] + ".prj", "w") as f:
+			f.write(spatial_reference)
+
+
+def read_circles(io, table, id_field, spatial_reference=None):
+	"""(ids, x, y, radius) of a circles table with the centers projected to spatial_reference, None if the table is
+	not a circles table (buffer polygons)"""
+	fields = io.table_fields(table)
+	if id_field not in fields or not all(field in fields for field in CIRCLE_FIELDS):
+		return None
+	circles = io.read_table(table, [id_field] + CIRCLE_FIELDS)
+	x, y = circles["X"], circles["Y"]
+	prj = os.path.splitext(table)[0] + ".prj"
+	if spatial_reference and os.path.exists(prj) and len(x):
+		with open(prj) as f:
+			circles_sr = f.read()
+		if circles_sr != spatial_reference:
+			x, y = io.project_points(x, y, circles_sr, spatial_reference)
+	return circles[id_field], x, y, circles["RADIUS"]
+
+
+def read_centers(io, points, id_field, spatial_reference=None, distance=None):
+	"""(ids, x, y, radius) of the points (radius the distance, default config.buffer_dist) or of a circles table"""
+	circles = read_circles(io, points, id_field, spatial_reference)
+	if circles is not None:
+		return circles
+	ids, x, y = io.read_points(points, id_field, spatial_reference)
+	return ids, x, y, numpy.full(ids.size, geometry.linear_distance(distance or config.buffer_dist))
+
+
+def get_backend(name=None):
+	"""Backend by name ("arcpy" or "gdal"). None uses arcpy when it can be imported, else gdal"""
+	if name is None:
+		try:
+			return ArcpyBackend()
+		except ImportError:
+			return GdalBackend()
+	if name not in BACKENDS:
+		raise ValueError("Unknown I/O backend '%s', use one of %s" % (name, ", ".join(BACKENDS)))
+	return BACKENDS[name]()
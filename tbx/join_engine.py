@@ -0,0 +1,165 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: join_engine.py
+# Purpose: joins the result tables of the tools to the points as the table of predictors for the model (replaces
+#          export/join_dbfs.R). The tables, the fields to keep, their new names and the area field they are divided
+#          by (the CAML group areas as a fraction of the buffer area) are a json spec, see export/join_spec.json.
+#
+#          python join_engine.py spec.json folder output [--id-field GRIDID] [--backend arcpy|gdal]
+#
+#          Every table is read once into columns and matched to the points through one index of the point ids, and
+#          the output table is allocated once and written once.
+# ---------------------------------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import time
+from collections import OrderedDict
+
+import numpy
+
+import io_backend
+
+# extensions tried for a table name of the spec without one
+TABLE_EXTENSIONS = [".parquet", ".arrow", ".dbf", ".csv"]
+
+
+def load_spec(spec_file):
+	with open(spec_file) as f:
+		return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def find_table(folder, name):
+	"""path of the table name of the spec in the folder (or geodatabase)"""
+	path = os.path.join(folder, name)
+	if os.path.splitext(name)[1] or os.path.splitext(folder)[1].lower() in (".gdb", ".gpkg"):
+		return path
+	for extension in TABLE_EXTENSIONS:
+		if os.path.exists(path + extension):
+			return path + extension
+	raise ValueError("Table %s not found in %s" % (name, folder))
+
+
+class IdIndex(object):
+	"""Row of every id of the target table, built once and used for every table. Integer ids (WELLID, GRIDID) that
+	are about as dense as the number of rows use a lookup array, other ids one sort of the target ids"""
+
+	def __init__(self, ids):
+		self.ids = ids
+		self.lookup = None
+		if ids.dtype.kind in "iu" and ids.size and ids.min() >= 0 and ids.max() < 4 * ids.size + 1024:
+			self.lookup = numpy.full(int(ids.max()) + 1, -1, dtype=numpy.int64)
+			self.lookup[ids] = numpy.arange(ids.size)
+		else:
+			self.order = numpy.argsort(ids, kind="mergesort")
+			self.sorted = ids[self.order]
+
+	def match(self, ids):
+		"""(rows of the target, rows of the table) with the same id. Float ids of a table (a numeric dbf field with
+		decimals or nulls) match integer target ids only when they are whole numbers, nulls (nan) match nothing"""
+		valid = None
+		if self.ids.dtype.kind in "iu" and ids.dtype.kind == "f":
+			valid = numpy.nonzero(numpy.isfinite(ids))[0]
+			ids = ids[valid]
+			fraction = ids != numpy.floor(ids)
+			if fraction.any():
+				raise ValueError("Ids %s are not whole numbers" % ", ".join(str(i) for i in ids[fraction][:5]))
+		ids = ids.astype(self.ids.dtype)
+		if self.lookup is not None:
+			inside = numpy.nonzero((ids >= 0) & (ids < self.lookup.size))[0]
+			rows = self.lookup[ids[inside]]
+			found = rows >= 0
+			rows, table_rows = rows[found], inside[found]
+		elif not self.sorted.size:
+			rows, table_rows = numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+		else:
+			order = numpy.argsort(ids, kind="mergesort")  # sorted ids make the search a merge of the two lists
+			position = numpy.searchsorted(self.sorted, ids[order])
+			position[position == self.sorted.size] = 0
+			found = self.sorted[position] == ids[order]
+			rows, table_rows = self.order[position[found]], order[found]
+		if valid is not None:
+			table_rows = valid[table_rows]
+		return rows, table_rows
+
+
+def read_columns(io, table, id_field, fields, divide_by=None):
+	"""ids and {field: float64 values} of a table, the fields divided by the divide_by field (its own values kept)"""
+	names = [id_field] + [f for f in fields if f != id_field]
+	if divide_by and divide_by not in names:
+		names.append(divide_by)
+	array = io.read_table(table, names, null_value=numpy.nan)
+	ids = array[id_field]
+	present = ids[ids == ids] if ids.dtype.kind == "f" else ids  # rows without an id (nan) are not joined
+	if numpy.unique(present).size != present.size:
+		raise ValueError("%s has more than one row for some %s values" % (table, id_field))
+	columns = OrderedDict((field, array[field].astype(numpy.float64)) for field in fields)
+	if divide_by:
+		area = array[divide_by].astype(numpy.float64)
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			for field in fields:
+				if field != divide_by:
+					columns[field] = columns[field] / area
+	return ids, columns
+
+
+def join_tables(spec, resolve, io, id_field=None):
+	"""The joined table of the spec. resolve gives the path of a table name of the spec. Points missing from a table
+	get nan for its fields, like the NA of the R join"""
+	id_field = id_field or spec["id_field"]
+	target = spec["target"]
+	points = io.read_table(resolve(target["table"]), null_value=numpy.nan)
+	keep = [f for f in target.get("fields", []) if f in points.dtype.names and f != id_field]  # WELL_NA is only in wells
+	target_ids = points[id_field]
+	index = IdIndex(target_ids)
+
+	tables = []
+	dtype = [(id_field, target_ids.dtype)] + [(f, points.dtype[f]) for f in keep]
+	for table in spec["tables"]:
+		fields = table["fields"]
+		ids, columns = read_columns(io, resolve(table["table"]), id_field, list(fields), table.get("divide_by"))
+		rows, table_rows = index.match(ids)
+		source = numpy.full(target_ids.size, -1, dtype=numpy.int64)  # row of the table for every point, -1 for none
+		source[rows] = table_rows
+		tables.append((fields, columns, source))
+		dtype += [(fields[field], numpy.float64) for field in fields]
+	names = [d[0] for d in dtype]
+	duplicates = sorted(set(n for n in names if names.count(n) > 1))
+	if duplicates:
+		raise ValueError("Output fields named more than once: %s" % ", ".join(duplicates))
+
+	joined = numpy.zeros(target_ids.size, dtype=dtype)
+	joined[id_field] = target_ids
+	for field in keep:
+		joined[field] = points[field]
+	for fields, columns, source in tables:
+		missing = source < 0
+		for field, name in fields.items():
+			values = columns[field][source]
+			values[missing] = numpy.nan
+			joined[name] = values
+	return joined
+
+
+def main(spec_file, folder, output, id_field=None, backend=None):
+	"""joins the tables of the spec in the folder (wells or grid) and writes the output table"""
+	if not hasattr(backend, "read_table"):
+		backend = io_backend.get_backend(backend)
+	spec = load_spec(spec_file)
+	start = time.time()
+	joined = join_tables(spec, lambda name: find_table(folder, name), backend, id_field)
+	backend.write_table(joined, output)
+	print("Joined %d tables for %d points into %s in %.1f s" % (len(spec["tables"]), joined.size, output,
+	                                                           time.time() - start))
+	return joined
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Joins the result tables to the points as the table of predictors")
+	parser.add_argument("spec", help="json join spec (see export/join_spec.json)")
+	parser.add_argument("folder", help="folder (or geodatabase) of the result tables")
+	parser.add_argument("output", help="output table")
+	parser.add_argument("--id-field", help="id field, overrides the spec (WELLID or GRIDID)")
+	parser.add_argument("--backend", choices=sorted(io_backend.BACKENDS), help="I/O backend, default arcpy if installed")
+	args = parser.parse_args()
+	main(args.spec, args.folder, args.output, args.id_field, args.backend)
@@ -0,0 +1,665 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: pipeline.py
+# Purpose: headless predictor build. Runs a declarative pipeline (json file) of numpy engine steps
+#          (buffer or grid -> caml -> reclass -> zonal, cvhm -> vadose, river, distance -> join) as a DAG,
+#          independent steps at the same time, and skips the steps whose inputs, parameters and config settings have
+#          not changed since the last run.
+#
+#          python pipeline.py pipeline.json [--workers N] [--backend arcpy|gdal] [--force] [--incremental]
+#
+#          With --incremental only the new, moved and deleted points (by id field) are computed when nothing else
+#          changed: the buffer step buffers the changed points and upserts them into its output, the caml and zonal
+#          steps rasterize and tabulate only the changed buffers and the cvhm, vadose, river and distance steps only
+#          the changed points, and upsert the rows into their tables (the rows of deleted points are removed). The
+#          changes come from the buffer step, or from the points (or grid circles) used by the last run of the step.
+#
+#          See scripts/pipeline_wells.json for an example. Values "@<step>" are the output tables of another step
+#          (which makes the DAG), relative paths are relative to the pipeline file.
+# ---------------------------------------------------------------------------------------------------
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+try:
+	import queue
+except ImportError:  # python 2
+	import Queue as queue
+
+import caml_area_reclass
+import config
+import coverage_cache
+import cvhm_engine
+import distance_engine
+import distance_raster
+import feature_distance
+import geometry
+import io_backend
+import join_engine
+import predictor_grid
+import zonal_engine
+
+import numpy
+
+STATE_FILE = "pipeline_state.json"
+
+try:
+	string_types = basestring  # python 2 json strings are unicode
+except NameError:
+	string_types = str
+
+
+def log(step, message):
+	sys.stdout.write("%s [%s] %s\n" % (time.strftime("%H:%M:%S"), step, message))  # one write per line from threads
+	sys.stdout.flush()
+
+
+def _single(value):
+	"""the only table of a step reference"""
+	if isinstance(value, list):
+		if len(value) != 1:
+			raise ValueError("Expected one table, got %s" % value)
+		return value[0]
+	return value
+
+
+def _tables(values):
+	"""flat list of tables from tables and step references"""
+	result = []
+	for value in values if isinstance(values, list) else [values]:
+		result.extend(value if isinstance(value, list) else [value])
+	return result
+
+
+class Step(object):
+	"""Output location and I/O of one step of the pipeline"""
+
+	def __init__(self, name, pipeline, changes=None, incremental=False):
+		self.name = name
+		self.pipeline = pipeline
+		self.io = pipeline.io
+		self.id_field = pipeline.id_field
+		self.workspace = pipeline.workspace
+		self.extension = pipeline.extension
+		self.changes = changes  # ids of the buffers to recompute ("changed") and remove ("deleted"), None for all
+		self.report = None  # ids changed by a buffer step since its last run
+		self.incremental = incremental  # a buffer step may update the buffers of its last run
+
+	def table(self, name):
+		return os.path.join(self.workspace, "%s_%s%s" % (self.name, name, self.extension))
+
+	def log(self, message):
+		log(self.name, message)
+
+	def snapshot_file(self):
+		return os.path.join(self.workspace, self.name + "_points.npy")
+
+	def subset(self, points):
+		"""the points (or circles table), or a copy of only the changed points when the step recomputes those"""
+		if self.changes is None:
+			return points
+		circles = io_backend.read_circles(self.io, points, self.id_field)
+		if circles is not None:
+			ids, x, y, radius = circles
+			keep = zonal_engine.isin(ids, self.changes["changed"])
+			output = self.table("changed")
+			io_backend.write_circles(self.io, output, self.id_field, ids[keep], x[keep], y[keep], radius[keep])
+			prj = os.path.splitext(points)[0] + ".prj"
+			if os.path.exists(prj):
+				shutil.copyfile(prj, os.path.splitext(output)[0] + ".prj")
+		else:
+			ids, x, y = self.io.read_points(points, self.id_field)
+			keep = zonal_engine.isin(ids, self.changes["changed"])
+			output = os.path.join(self.workspace, self.name + "_changed.shp")
+			self.io.write_points(output, self.id_field, ids[keep], x[keep], y[keep], self.io.spatial_reference(points))
+		return output
+
+	def coverage(self, buffers, raster, grid, supersample, coverages):
+		"""buffer coverage of the raster grid, shared by the rasters of the step on the same grid and cached on disk"""
+		key = (grid.key(), supersample)
+		if key not in coverages:
+			spatial_reference = self.io.spatial_reference(raster)
+			circles = io_backend.read_circles(self.io, buffers, self.id_field, spatial_reference)
+			if circles is not None:  # buffers of a grid step as center and radius
+				ids = circles[0]
+				polygons = [[numpy.array([circle])] for circle in zip(*circles[1:])]  # for the cache key only
+			else:
+				ids, polygons = self.io.read_polygons(buffers, self.id_field, spatial_reference)
+			keep = numpy.ones(ids.size, dtype=bool)
+			if self.changes is not None:
+				keep = zonal_engine.isin(ids, self.changes["changed"])
+				ids, polygons = ids[keep], [polygon for polygon, k in zip(polygons, keep) if k]
+			method = "circles" if circles is not None or config.exact_circles else "polygons"
+			cache = coverage = None
+			if config.coverage_cache:
+				cache = coverage_cache.CoverageCache(config.coverage_cache, config.coverage_cache_mb * 1e6)
+				cache_key = coverage_cache.coverage_key(ids, polygons, grid, supersample, config.buffer_dist, method)
+				coverage = cache.get(cache_key)
+			if coverage is None:
+				self.log("Rasterizing %d buffers" % len(ids))
+				if circles is not None:
+					coverage = zonal_engine.rasterize_circles(grid, ids, circles[1][keep], circles[2][keep],
+					                                          circles[3][keep], supersample)
+				elif config.exact_circles:
+					coverage = zonal_engine.rasterize_buffers(grid, ids, polygons, supersample)
+				else:
+					coverage = zonal_engine.rasterize_polygons(grid, ids, polygons, supersample)
+				if cache is not None:
+					cache.put(cache_key, coverage)
+			coverages[key] = coverage
+		return coverages[key]
+
+	def write(self, table, output, fill=numpy.nan):
+		"""writes a table, or upserts the recomputed rows into the table of the last run"""
+		if self.changes is not None:
+			old = self.io.read_table(output, null_value=numpy.nan)
+			remove = self.changes["changed"] + self.changes["deleted"]
+			table = zonal_engine.upsert_table(old, table, remove, self.id_field, fill)
+		self.io.write_table(table, output)
+
+	def remove(self, outputs):
+		"""removes the rows of the deleted points from the tables of the last run"""
+		for output in outputs:
+			table = self.io.read_table(output, null_value=numpy.nan)
+			self.io.write_table(zonal_engine.upsert_table(table, table[:0], self.changes["deleted"], self.id_field), output)
+
+
+def point_snapshot(ids, x, y, radius):
+	"""(id, x, y, r) array of the points or circles of a run, compared with the next run by changed_points"""
+	snapshot = numpy.zeros(len(ids), dtype=[("id", numpy.asarray(ids).dtype), ("x", numpy.float64), ("y", numpy.float64),
+	                                        ("r", numpy.float64)])
+	snapshot["id"], snapshot["x"], snapshot["y"], snapshot["r"] = ids, x, y, radius
+	return snapshot
+
+
+def load_snapshot(path):
+	"""point_snapshot saved by the last run, None if there is none"""
+	if not os.path.exists(path):
+		return None
+	snapshot = numpy.load(path)
+	return snapshot if snapshot.dtype.names == ("id", "x", "y", "r") else None
+
+
+def changed_points(previous, current):
+	"""ids of the new, moved or resized points and of the deleted points of the current point_snapshot compared to
+	the previous one"""
+	ids = current["id"]
+	if previous.size == 0:
+		return ids.tolist(), []
+	previous = previous[numpy.argsort(previous["id"], kind="mergesort")]
+	position = numpy.minimum(numpy.searchsorted(previous["id"], ids), previous.size - 1)
+	found = previous["id"][position] == ids
+	moved = found & ((previous["x"][position] != current["x"]) | (previous["y"][position] != current["y"]) |
+	                 (previous["r"][position] != current["r"]))
+	changed = ids[~found | moved]
+	deleted = previous["id"][~zonal_engine.isin(previous["id"], ids)]
+	return changed.tolist(), deleted.tolist()
+
+
+def run_buffer(step, points, distance=None, segments=90):
+	"""circular buffer polygons around the points"""
+	radius = geometry.linear_distance(distance or config.buffer_dist)
+	ids, x, y = step.io.read_points(points, step.id_field)
+	output = os.path.join(step.workspace, step.name + ".shp")
+	spatial_reference = step.io.spatial_reference(points)
+
+	# the points changed since the last run, for this step and the caml and zonal steps of the buffers
+	current = point_snapshot(ids, x, y, radius)
+	previous = load_snapshot(step.snapshot_file()) if os.path.exists(output) else None
+	if previous is None:
+		step.report = {"from": None, "changed": ids.tolist(), "deleted": []}
+	else:
+		changed, deleted = changed_points(previous, current)
+		step.report = {"from": step.pipeline._file_hash(output), "changed": changed, "deleted": deleted}
+		step.log("%d new or moved and %d deleted points" % (len(changed), len(deleted)))
+
+	last = step.pipeline._last_run(step.name)
+	if step.incremental and previous is not None and last and last.get("changes", {}).get("to") == step.report["from"]:
+		# the buffers of the last run are still the output: only buffer the changed points and replace theirs
+		keep = zonal_engine.isin(ids, step.report["changed"])
+		step.log("Buffering %d changed points by %s m" % (keep.sum(), radius))
+		polygons = [[ring] for ring in geometry.circle_rings(x[keep], y[keep], radius, segments)]
+		step.io.upsert_polygons(output, step.id_field, ids[keep], polygons,
+		                        step.report["changed"] + step.report["deleted"], spatial_reference)
+	else:
+		step.log("Buffering %d points by %s m" % (ids.size, radius))
+		polygons = [[ring] for ring in geometry.circle_rings(x, y, radius, segments)]
+		step.io.write_polygons(output, step.id_field, ids, polygons, spatial_reference)
+	numpy.save(step.snapshot_file(), current)
+	return [output]
+
+
+def run_grid(step, boundary, spacing=predictor_grid.GRID_SPACING, distance="3 Miles", radius=None):
+	"""grid points within distance of the boundary polygons, written as the circles table of their buffers"""
+	spatial_reference = step.io.spatial_reference(boundary)
+	ids, polygons = step.io.read_polygons(boundary, None)
+	ids, x, y = predictor_grid.grid_points(polygons, float(spacing), geometry.linear_distance(distance))
+	radius = geometry.linear_distance(radius or config.buffer_dist)
+	step.log("%d grid points, buffers of %s m" % (ids.size, radius))
+	output = step.table("circles")
+	io_backend.write_circles(step.io, output, step.id_field, ids, x, y, numpy.full(ids.size, radius), spatial_reference)
+	return [output]
+
+
+def run_caml(step, buffers, rasters, long=False):
+	"""tabulated area of the landuse rasters (year -> raster), the years on the same grid in one pass"""
+	buffers = _single(buffers)
+	stacks = OrderedDict()
+	for year in sorted(rasters):
+		reader, grid, nodata = step.io.read_raster(rasters[year])
+		stacks.setdefault(grid.key(), []).append((int(year), reader, nodata, grid, rasters[year]))
+
+	tables, classes = OrderedDict(), OrderedDict()
+	coverages = {}
+	for stack in stacks.values():
+		step.log("Tabulating CAML %s" % ", ".join(str(layer[0]) for layer in stack))
+		coverage = step.coverage(buffers, stack[0][4], stack[0][3], config.area_supersample, coverages)
+		layers = [layer[:3] for layer in stack]
+		stack_tables, stack_classes = zonal_engine.tabulate_area_stack(coverage, layers, step.id_field,
+		                                                               config.block_size, return_classes=True)
+		tables.update(stack_tables)
+		classes.update(stack_classes)
+
+	outputs = []
+	for year, table in tables.items():
+		outputs.append(step.table("CAML_%s" % year))
+		step.write(table, outputs[-1], fill=0)
+	if long:
+		outputs.append(step.table("CAML_LONG"))
+		step.write(zonal_engine.long_table(tables, classes, step.id_field, "YEAR"), outputs[-1])
+	return outputs
+
+
+def run_reclass(step, tables, csvs):
+	"""every area table reclassed with every csv"""
+	step.log("Reclassing %d tables with %d csv files" % (len(_tables(tables)), len(csvs)))
+	return caml_area_reclass.batch(_tables(tables), csvs, step.workspace, step.io, step.extension)
+
+
+def run_zonal(step, buffers, layers):
+	"""zonal statistics (or tabulated area with "AREA") of the [name, raster, statistics type] layers"""
+	buffers = _single(buffers)
+	coverages = {}
+	outputs = []
+	for name, raster, statistics_type in layers:
+		step.log("Working on %s" % name)
+		reader, grid, nodata = step.io.read_raster(raster)
+		supersample = config.area_supersample if statistics_type.upper() == "AREA" else 1
+		coverage = step.coverage(buffers, raster, grid, supersample, coverages)
+		table = zonal_engine.zonal_tables(coverage, [(name, reader, nodata, statistics_type)], step.id_field,
+		                                  config.block_size)[name]
+		outputs.append(step.table(name))
+		step.write(table, outputs[-1], fill=0 if statistics_type.upper() == "AREA" else numpy.nan)
+	return outputs
+
+
+def run_cvhm(step, points, centroids, depths=None, distance=None, area_weighted=None, windows=None):
+	"""mean CVHM percent coarse of the depths, or of the depth windows ("0-400" in feet), around the points (or the
+	circles of a grid step)"""
+	points = _single(points)
+	if area_weighted is None:
+		area_weighted = config.cvhm_area_weighted
+	step.log("CVHM texture%s" % (" weighted by cell area" if area_weighted else ""))
+	table = cvhm_engine.cvhm_texture(step.io, step.subset(points), centroids, step.id_field, depths, distance,
+	                                 area_weighted, windows, coverage_cache.default_cache())
+	output = step.table("CVHM")
+	step.write(table, output)
+	return [output]
+
+
+def run_vadose(step, points, centroids, gw_depth, gw_layer="GWDEPTH", gw_field="MEAN", gw_units="Meters",
+               distance=None, area_weighted=None):
+	"""CVHM percent coarse above the water table of each point. gw_depth is the depth to water table, or the outputs
+	of a zonal step with the layer named gw_layer"""
+	points = _single(points)
+	tables = _tables(gw_depth)
+	if len(tables) > 1:
+		names = [os.path.splitext(os.path.basename(table))[0] for table in tables]
+		tables = [table for table, name in zip(tables, names) if name == gw_layer or name.endswith("_" + gw_layer)]
+	if area_weighted is None:
+		area_weighted = config.cvhm_area_weighted
+	step.log("Vadose zone texture with the depth to water of %s" % _single(tables))
+	table = cvhm_engine.vadose_texture(step.io, step.subset(points), centroids, _single(tables), step.id_field, gw_field,
+	                                   gw_units, distance, area_weighted, coverage_cache.default_cache())
+	output = step.table("VADOSE")
+	step.write(table, output)
+	return [output]
+
+
+def run_river(step, points, rivers, order_field="StreamOrde", spacing=None, cell_size=None, refine=None):
+	"""distance from the points (or the circles of a grid step) to the nearest river, its order and the distance
+	along it, or with a cell_size (default config.river_raster_cell) only the distance sampled from the cached
+	distance raster, exact within refine (default config.river_refine_distance) of a river"""
+	points = step.subset(_single(points))
+	if cell_size is None:
+		cell_size = config.river_raster_cell
+	output = step.table("RIVER_DISTANCE")
+	if cell_size:
+		if refine is None:
+			refine = config.river_refine_distance
+		step.log("Distance to the nearest of %s from a %g m raster" % (os.path.basename(rivers), cell_size))
+		table = distance_raster.raster_near_table(step.io, points, rivers, step.id_field, cell_size, refine,
+		                                          cache=coverage_cache.default_cache())
+	else:
+		step.log("Distance to the nearest of %s" % os.path.basename(rivers))
+		table = distance_engine.near_table(step.io, points, rivers, step.id_field, order_field, spacing)
+	step.write(table, output)
+	return [output]
+
+
+def run_distance(step, points, layers, radius=None, power=None, min_distance=feature_distance.MIN_DISTANCE):
+	"""nearest distance, count within the radius and inverse distance weighted load of the points (or the circles of a
+	grid step) for each of the layers (dicts as in scripts/distance_layers.json), in one wide table"""
+	points = step.subset(_single(points))
+	step.log("Distance predictors of %s" % ", ".join(layer.get("name", "?") for layer in layers))
+	table = feature_distance.distance_predictors(step.io, points, layers, step.id_field, radius, power, min_distance)
+	output = step.table("FEATURE_DISTANCE")
+	step.write(table, output)
+	return [output]
+
+
+def run_join(step, tables, output=None, spec=None, points=None):
+	"""one wide table of all of the tables on the id field with the fields named <table>_<field>, or with a join spec
+	(see export/join_spec.json) the predictor table of the spec, its table names being the names of the input tables
+	without the extension and points its target table. output is the table name in the workspace (default
+	<step>_features)"""
+	tables = _tables(tables)
+	step.log("Joining %d tables" % len(tables))
+	output = os.path.join(step.workspace, output) if output else step.table("features")
+	if spec:
+		spec = join_engine.load_spec(spec)
+		names = dict((os.path.splitext(os.path.basename(table))[0], table) for table in tables)
+		if points:
+			names[spec["target"]["table"]] = points
+		resolve = lambda name: names[name] if name in names else join_engine.find_table(step.workspace, name)
+		step.io.write_table(join_engine.join_tables(spec, resolve, step.io, step.id_field), output)
+		return [output]
+	arrays = OrderedDict()
+	for table in tables:
+		arrays[os.path.splitext(os.path.basename(table))[0]] = step.io.read_table(table, null_value=float("nan"))
+	step.io.write_table(zonal_engine.wide_table(arrays, step.id_field), output)
+	return [output]
+
+
+# tool name -> (function, config settings the outputs depend on)
+TOOLS = {
+	"buffer": (run_buffer, ["buffer_dist"]),
+	"grid": (run_grid, ["buffer_dist"]),
+	"caml": (run_caml, ["area_supersample", "block_size"]),
+	"reclass": (run_reclass, []),
+	"zonal": (run_zonal, ["area_supersample", "block_size"]),
+	"cvhm": (run_cvhm, ["buffer_dist", "cvhm_area_weighted"]),
+	"vadose": (run_vadose, ["buffer_dist", "cvhm_area_weighted"]),
+	"river": (run_river, ["river_raster_cell", "river_refine_distance"]),
+	"distance": (run_distance, ["distance_radius", "distance_power"]),
+	"join": (run_join, []),
+}
+
+# tools that can be run for only the changed points -> parameter of the points (or buffers)
+INCREMENTAL = {"caml": "buffers", "zonal": "buffers", "cvhm": "points", "vadose": "points", "river": "points",
+               "distance": "points"}
+
+
+class Pipeline(object):
+	"""Steps of a pipeline file, the DAG between them and the hashes of the last run"""
+
+	def __init__(self, spec_file, backend=None, incremental=False):
+		with open(spec_file) as f:
+			spec = json.load(f, object_pairs_hook=OrderedDict)
+		self.folder = os.path.dirname(os.path.abspath(spec_file))
+		self.io = io_backend.get_backend(backend)
+		self.id_field = spec.get("id_field", config.well_id_field)
+		self.workspace = self._path(spec["workspace"])
+		self.extension = spec.get("format", ".dbf" if self.io.name == "arcpy" else ".csv")
+		self.steps = spec["steps"]
+		self.incremental = incremental or spec.get("incremental", False)
+		self.lock = threading.Lock()
+
+		self.depends = OrderedDict()
+		for name, params in self.steps.items():
+			if params.get("tool") not in TOOLS:
+				raise ValueError("Step %s: unknown tool '%s', use one of %s" % (name, params.get("tool"), ", ".join(TOOLS)))
+			self.depends[name] = sorted(set(self._references(params)))
+			for depend in self.depends[name]:
+				if depend not in self.steps:
+					raise ValueError("Step %s: no step named '%s'" % (name, depend))
+		self.order = self._topological_order()
+
+		if not os.path.exists(self.workspace):
+			os.makedirs(self.workspace)
+		self.state_file = os.path.join(self.workspace, STATE_FILE)
+		self.state = {"steps": {}, "files": {}}
+		if os.path.exists(self.state_file):
+			with open(self.state_file) as f:
+				self.state = json.load(f)
+
+	def _path(self, value):
+		return os.path.normpath(os.path.join(self.folder, value))
+
+	def _references(self, value):
+		if isinstance(value, dict):
+			return [ref for v in value.values() for ref in self._references(v)]
+		if isinstance(value, list):
+			return [ref for v in value for ref in self._references(v)]
+		if isinstance(value, string_types) and value.startswith("@"):
+			return [value[1:]]
+		return []
+
+	def _topological_order(self):
+		order = []
+		done = set()
+		visiting = set()
+
+		def visit(name):
+			if name in done:
+				return
+			if name in visiting:
+				raise ValueError("Pipeline has a cycle through step %s" % name)
+			visiting.add(name)
+			for depend in self.depends[name]:
+				visit(depend)
+			visiting.discard(name)
+			done.add(name)
+			order.append(name)
+
+		for name in self.steps:
+			visit(name)
+		return order
+
+	def _resolve(self, value, outputs):
+		"""step parameters with the references replaced by the output tables and the paths made absolute"""
+		if isinstance(value, dict):
+			return OrderedDict((k, self._resolve(v, outputs)) for k, v in value.items())
+		if isinstance(value, list):
+			return [self._resolve(v, outputs) for v in value]
+		if isinstance(value, string_types):
+			if value.startswith("@"):
+				return list(outputs[value[1:]])
+			if os.path.exists(self._path(value)):
+				return self._path(value)
+		return value
+
+	def _file_hash(self, path):
+		"""sha1 of the content of a file (with its sidecar files) or folder, cached by size and modification time"""
+		stem = os.path.splitext(path)[0]
+		if os.path.isdir(path):
+			files = sorted(os.path.join(root, f) for root, dirs, names in os.walk(path) for f in names)
+		else:
+			folder = os.path.dirname(path) or "."
+			files = sorted(os.path.join(folder, f) for f in os.listdir(folder)
+			               if os.path.splitext(os.path.join(folder, f))[0] == stem and not f.endswith(".lock"))
+		sha = hashlib.sha1()
+		for name in files:
+			stat = os.stat(name)
+			with self.lock:
+				cached = self.state["files"].get(name)
+			if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+				digest = cached[2]
+			else:
+				file_sha = hashlib.sha1()
+				with open(name, "rb") as f:
+					for chunk in iter(lambda: f.read(1 << 20), b""):
+						file_sha.update(chunk)
+				digest = file_sha.hexdigest()
+				with self.lock:
+					self.state["files"][name] = [stat.st_size, stat.st_mtime, digest]
+			sha.update((os.path.basename(name) + digest).encode("utf-8"))
+		return sha.hexdigest()
+
+	def _hash(self, name, params, skip=()):
+		"""hash of the tool, parameters (except skip), content of every input file and config settings of a step"""
+		tool, settings = TOOLS[self.steps[name]["tool"]]
+		params = OrderedDict((k, v) for k, v in params.items() if k not in skip)
+
+		def content(value):
+			if isinstance(value, dict):
+				return OrderedDict((k, content(v)) for k, v in value.items())
+			if isinstance(value, list):
+				return [content(v) for v in value]
+			if isinstance(value, string_types) and os.path.exists(value):
+				return self._file_hash(value)
+			return value
+
+		key = {"params": content(params), "id_field": self.id_field, "format": self.extension, "backend": self.io.name,
+		       "config": dict((setting, getattr(config, setting)) for setting in settings)}
+		return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+	def _last_run(self, name):
+		"""state of the last run of a step, read under the lock as the other threads update it"""
+		with self.lock:
+			return self.state["steps"].get(name)
+
+	def _save_state(self):
+		with self.lock:
+			with open(self.state_file, "w") as f:
+				json.dump(self.state, f, indent=1, sort_keys=True)
+
+	def run_step(self, name, outputs, force=False):
+		"""runs a step unless its hash matches the last run and its outputs exist. Returns the output tables"""
+		params = self._resolve(self.steps[name], outputs)
+		tool = params.pop("tool")
+		step_hash = self._hash(name, params)
+		last = self._last_run(name)
+		if not force and last and last["hash"] == step_hash and all(os.path.exists(t) for t in last["outputs"]):
+			log(name, "Unchanged, skipping")
+			return last["outputs"]
+
+		step = Step(name, self, None if force else self._changes(name, params, last), self.incremental and not force)
+		start = time.time()
+		if step.changes is not None:
+			log(name, "Updating %d changed and %d deleted points" % (len(step.changes["changed"]),
+			                                                        len(step.changes["deleted"])))
+		if step.changes is not None and not step.changes["changed"]:
+			step.remove(last["outputs"])
+			step_outputs = last["outputs"]
+		else:
+			step_outputs = TOOLS[tool][0](step, **params)
+		log(name, "Done in %.1f s" % (time.time() - start))
+
+		step_state = {"hash": step_hash, "outputs": step_outputs}
+		param = INCREMENTAL.get(tool)
+		if param in params:
+			# to find the points changed by the next run
+			step_state["static_hash"] = self._hash(name, params, skip=[param])
+			step_state["input_hash"] = self._file_hash(_single(params[param]))
+			centers = self._centers(param, _single(params[param]))
+			if centers is not None:
+				numpy.save(os.path.join(self.workspace, name + "_inputs.npy"), centers)
+		if step.report is not None:
+			step_state["changes"] = dict(step.report, to=self._file_hash(step_outputs[0]))
+		with self.lock:
+			self.state["steps"][name] = step_state
+		self._save_state()
+		return step_outputs
+
+	def _centers(self, param, table):
+		"""point_snapshot of the points or circles table of a step, None for buffer polygons"""
+		circles = io_backend.read_circles(self.io, table, self.id_field)
+		if circles is not None:
+			return point_snapshot(*circles)
+		if param == "points":
+			ids, x, y = self.io.read_points(table, self.id_field)
+			return point_snapshot(ids, x, y, 0.0)
+		return None
+
+	def _changes(self, name, params, last):
+		"""ids to recompute when only the points (or buffers) of a step changed since its last run, else None"""
+		param = INCREMENTAL.get(self.steps[name]["tool"])
+		if not self.incremental or not last or param not in params:
+			return None
+		if not all(os.path.exists(t) for t in last["outputs"]):
+			return None
+		if last.get("static_hash") != self._hash(name, params, skip=[param]):
+			return None
+		reference = self.steps[name][param]
+		source = None
+		if isinstance(reference, string_types) and reference.startswith("@"):
+			source = self._last_run(reference[1:])
+		if source and "changes" in source:
+			# buffers of a buffer step: the changes must be from the buffers of the last run to the buffers of this run
+			changes = source["changes"]
+			if changes["from"] != last.get("input_hash") or changes["to"] != self._file_hash(_single(params[param])):
+				return None
+			return changes
+		# points or circles: compared with the ones of the last run
+		previous = load_snapshot(os.path.join(self.workspace, name + "_inputs.npy"))
+		current = self._centers(param, _single(params[param]))
+		if previous is None or current is None:
+			return None
+		changed, deleted = changed_points(previous, current)
+		return {"changed": changed, "deleted": deleted}
+
+	def run(self, workers=1, force=False):
+		"""runs the steps in dependency order, up to workers independent steps at the same time"""
+		if self.io.name == "arcpy" and workers > 1:
+			log("pipeline", "arcpy is not thread safe, running one step at a time")
+			workers = 1
+
+		outputs = {}
+		pending = list(self.order)
+		running = set()
+		finished = queue.Queue()
+		pool = ThreadPool(workers)
+
+		def run_safe(name, inputs):
+			try:
+				finished.put((name, self.run_step(name, inputs, force), None))
+			except Exception as e:
+				finished.put((name, None, e))
+
+		try:
+			while pending or running:
+				for name in [n for n in pending if all(d in outputs for d in self.depends[n])]:
+					pending.remove(name)
+					running.add(name)
+					pool.apply_async(run_safe, (name, dict(outputs)))
+
+				name, step_outputs, error = finished.get()
+				running.discard(name)
+				if error is not None:
+					log(name, "Failed: %s" % error)
+					raise error
+				outputs[name] = step_outputs
+		finally:
+			pool.close()
+			pool.join()
+		return outputs
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Runs a gnlm-rfm predictor pipeline file")
+	parser.add_argument("pipeline", help="pipeline json file")
+	parser.add_argument("--workers", type=int, default=1, help="steps to run at the same time")
+	parser.add_argument("--backend", choices=sorted(io_backend.BACKENDS), help="I/O backend (default: arcpy if installed)")
+	parser.add_argument("--force", action="store_true", help="run every step even when nothing changed")
+	parser.add_argument("--incremental", action="store_true", help="only compute the new, moved and deleted points")
+	args = parser.parse_args()
+
+	Pipeline(args.pipeline, args.backend, args.incremental).run(args.workers, args.force)
@@ -0,0 +1,153 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: predictor_grid.py
+# Purpose: builds the predictor grid without the fishnet and buffer tools: the regular grid of points is made as
+#          numpy coordinates, the points inside the groundwater basin or within a distance of its boundary are kept
+#          and numbered (GRIDID), and the buffers can be written as a circles table (center and radius) that the
+#          numpy engines read instead of buffer polygons.
+#
+#          python predictor_grid.py basin.shp points.shp [--spacing 2414.020828] [--distance "3 Miles"]
+#                                   [--circles circles.csv] [--backend arcpy|gdal]
+# ---------------------------------------------------------------------------------------------------
+
+import argparse
+import time
+
+import numpy
+
+import config
+import geometry
+import io_backend
+
+# 1.5 miles, the spacing of the fishnet of the predictor grid in the README
+GRID_SPACING = 2414.020828
+
+
+def lattice(xmin, ymin, xmax, ymax, spacing, origin=None):
+	"""x (columns) and y (rows, from the bottom up) coordinates of the regular grid covering the extent. The points
+	are the centers of the fishnet cells starting at origin (default the lower left corner of the extent)"""
+	x0, y0 = origin if origin is not None else (xmin, ymin)
+	first_col = numpy.floor((xmin - x0) / spacing)
+	first_row = numpy.floor((ymin - y0) / spacing)
+	xs = x0 + (numpy.arange(first_col, numpy.ceil((xmax - x0) / spacing)) + 0.5) * spacing
+	ys = y0 + (numpy.arange(first_row, numpy.ceil((ymax - y0) / spacing)) + 0.5) * spacing
+	return xs, ys
+
+
+def inside_rings(xs, ys, rings):
+	"""Boolean (rows, columns) grid of the points inside the rings (even-odd rule, so holes are outside). Every edge
+	crossing of a grid row is found at once and the crossings left of each point are counted with a cumulative sum"""
+	x0, y0, x1, y1 = geometry.ring_edges(rings)
+	low = numpy.minimum(y0, y1)
+	high = numpy.maximum(y0, y1)
+	first = numpy.searchsorted(ys, low, "left")  # rows with low <= y < high cross the edge
+	counts = numpy.searchsorted(ys, high, "left") - first
+	edge = numpy.repeat(numpy.arange(x0.size), counts)
+	row = first[edge] + numpy.arange(edge.size) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+	y = ys[row]
+	x = x0[edge] + (y - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+	col = numpy.searchsorted(xs, x, "right")  # first point right of the crossing
+	width = xs.size + 1
+	crossings = numpy.bincount(row * width + col, minlength=ys.size * width).reshape(ys.size, width)
+	return numpy.cumsum(crossings[:, :-1], axis=1) % 2 == 1
+
+
+def _slab(a, b, low, high):
+	"""(start, end) of the x with low <= a * x + b <= high, (inf, -inf) when there is none"""
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		x0, x1 = (low - b) / a, (high - b) / a
+	everywhere = (low <= b) & (b <= high)
+	start = numpy.where(a != 0, numpy.minimum(x0, x1), numpy.where(everywhere, -numpy.inf, numpy.inf))
+	end = numpy.where(a != 0, numpy.maximum(x0, x1), numpy.where(everywhere, numpy.inf, -numpy.inf))
+	return start, end
+
+
+def near_rings(xs, ys, rings, distance, block_size=65536):
+	"""Boolean (rows, columns) grid of the points within distance of an edge of the rings. The points within distance
+	of an edge on a grid row are an interval of the row (the row across the two end circles and the band along the
+	edge), found for every (edge, row) pair at once and marked with a cumulative sum of the interval starts and ends.
+	The edges are done block_size at a time"""
+	width = xs.size + 1
+	marks = numpy.zeros(ys.size * width, dtype=numpy.int64)
+	edges = geometry.ring_edges(rings)
+	for block in range(0, edges[0].size, block_size):
+		x0, y0, x1, y1 = [e[block:block + block_size] for e in edges]
+		first = numpy.searchsorted(ys, numpy.minimum(y0, y1) - distance, "left")
+		counts = numpy.searchsorted(ys, numpy.maximum(y0, y1) + distance, "right") - first
+		edge = numpy.repeat(numpy.arange(x0.size), counts)
+		row = first[edge] + numpy.arange(edge.size) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+		y = ys[row]
+		x0, y0, x1, y1 = x0[edge], y0[edge], x1[edge], y1[edge]
+
+		start, end = numpy.full(row.size, numpy.inf), numpy.full(row.size, -numpy.inf)
+		for cx, cy in ((x0, y0), (x1, y1)):
+			half = distance ** 2 - (y - cy) ** 2
+			inside = half >= 0
+			half = numpy.sqrt(numpy.where(inside, half, 0))
+			start = numpy.where(inside, numpy.minimum(start, cx - half), start)
+			end = numpy.where(inside, numpy.maximum(end, cx + half), end)
+		# band: projection on the edge within the edge and distance to its line within distance
+		dx, dy = x1 - x0, y1 - y0
+		length = numpy.hypot(dx, dy)
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			ux, uy = numpy.where(length > 0, dx / length, 0), numpy.where(length > 0, dy / length, 0)
+		along = _slab(ux, uy * (y - y0) - ux * x0, 0, length)
+		across = _slab(-uy, ux * (y - y0) + uy * x0, -distance, distance)
+		band_start, band_end = numpy.maximum(along[0], across[0]), numpy.minimum(along[1], across[1])
+		band = (band_start <= band_end) & (length > 0)
+		start = numpy.where(band, numpy.minimum(start, band_start), start)
+		end = numpy.where(band, numpy.maximum(end, band_end), end)
+
+		found = start <= end
+		row = row[found]
+		marks += numpy.bincount(row * width + numpy.searchsorted(xs, start[found], "left"), minlength=marks.size)
+		marks -= numpy.bincount(row * width + numpy.searchsorted(xs, end[found], "right"), minlength=marks.size)
+	return numpy.cumsum(marks.reshape(ys.size, width)[:, :-1], axis=1) > 0
+
+
+def grid_points(polygons, spacing=GRID_SPACING, distance=0.0, origin=None):
+	"""(ids, x, y) of the grid points inside the polygons (lists of rings) or within distance of their boundary.
+	The ids start at 1 and go along the rows from the lower left corner, like the fishnet"""
+	rings = [ring for polygon in polygons for ring in polygon]
+	points = numpy.vstack(rings)
+	xs, ys = lattice(points[:, 0].min() - distance, points[:, 1].min() - distance,
+	                 points[:, 0].max() + distance, points[:, 1].max() + distance, spacing, origin)
+	keep = numpy.zeros((ys.size, xs.size), dtype=bool)
+	for polygon in polygons:  # each polygon on its own, the basins can touch or overlap
+		keep |= inside_rings(xs, ys, polygon)
+	if distance > 0:
+		keep |= near_rings(xs, ys, rings, distance)
+	rows, cols = numpy.nonzero(keep)
+	return numpy.arange(1, rows.size + 1), xs[cols], ys[rows]
+
+
+def main(boundary, output, spacing=GRID_SPACING, distance="3 Miles", circles=None, radius=None, id_field="GRIDID",
+         backend=None):
+	"""Writes the grid points within distance (linear unit like "3 Miles") of the boundary polygons to the output
+	feature class and, if circles is given, the buffers (radius, default config.buffer_dist) as a circles table"""
+	if not hasattr(backend, "read_table"):
+		backend = io_backend.get_backend(backend)
+	start = time.time()
+	spatial_reference = backend.spatial_reference(boundary)
+	ids, polygons = backend.read_polygons(boundary, None)
+	ids, x, y = grid_points(polygons, float(spacing), geometry.linear_distance(distance))
+	backend.write_points(output, id_field, ids, x, y, spatial_reference)
+	if circles:
+		radius = geometry.linear_distance(radius or config.buffer_dist)
+		io_backend.write_circles(backend, circles, id_field, ids, x, y, numpy.full(ids.size, radius), spatial_reference)
+	print("%d grid points in %.1f s" % (ids.size, time.time() - start))
+	return ids, x, y
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Builds the predictor grid points and buffer circles")
+	parser.add_argument("boundary", help="groundwater basin polygons")
+	parser.add_argument("output", help="output grid points feature class")
+	parser.add_argument("--spacing", type=float, default=GRID_SPACING, help="grid spacing in the units of the boundary")
+	parser.add_argument("--distance", default="3 Miles", help="keep points within this distance of the boundary")
+	parser.add_argument("--circles", help="also write the buffers as a circles table (id, X, Y, RADIUS)")
+	parser.add_argument("--radius", help="buffer radius, default config.buffer_dist")
+	parser.add_argument("--id-field", default="GRIDID", help="id field of the grid points")
+	parser.add_argument("--backend", choices=sorted(io_backend.BACKENDS), help="I/O backend, default arcpy if installed")
+	args = parser.parse_args()
+	main(args.boundary, args.output, args.spacing, args.distance, args.circles, args.radius, args.id_field, args.backend)
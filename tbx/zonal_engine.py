@@ -0,0 +1,846 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: zonal_engine.py
+# Purpose: arcpy free zonal statistics for overlapping well buffers. Every buffer is rasterized once into a
+#          sparse cell -> zone matrix so all zones are summarized with a single read of the value raster
+#          instead of one ZonalStatisticsAsTable run per group of non overlapping buffers.
+# ---------------------------------------------------------------------------------------------------
+
+import numpy
+from collections import OrderedDict
+
+
+# output fields for each statistics type (same names and order as arcpy.sa.ZonalStatisticsAsTable)
+STATISTICS = OrderedDict([
+	("ALL", ["MIN", "MAX", "RANGE", "MEAN", "STD", "SUM"]),
+	("MEAN", ["MEAN"]),
+	("MAXIMUM", ["MAX"]),
+	("MINIMUM", ["MIN"]),
+	("RANGE", ["RANGE"]),
+	("STD", ["STD"]),
+	("SUM", ["SUM"]),
+	("MIN_MAX", ["MIN", "MAX"]),
+	("MEAN_STD", ["MEAN", "STD"]),
+	("MIN_MAX_MEAN", ["MIN", "MAX", "MEAN"]),
+])
+
+
+class RasterGrid(object):
+	"""Cell layout of a north up raster: upper left corner, cell size and number of rows and columns"""
+
+	def __init__(self, xmin, ymax, cell_width, cell_height, nrows, ncols, crs=None):
+		self.xmin = float(xmin)
+		self.ymax = float(ymax)
+		self.cell_width = float(cell_width)
+		self.cell_height = float(cell_height)
+		self.nrows = int(nrows)
+		self.ncols = int(ncols)
+		self.crs = crs  # spatial reference as wkt (informational only)
+
+	@property
+	def xmax(self):
+		return self.xmin + self.ncols * self.cell_width
+
+	@property
+	def ymin(self):
+		return self.ymax - self.nrows * self.cell_height
+
+	@property
+	def shape(self):
+		return self.nrows, self.ncols
+
+	@property
+	def cell_area(self):
+		return self.cell_width * self.cell_height
+
+	def key(self):
+		"""tuple that identifies the grid alignment"""
+		return self.xmin, self.ymax, self.cell_width, self.cell_height, self.nrows, self.ncols
+
+	def __eq__(self, other):
+		return isinstance(other, RasterGrid) and self.key() == other.key()
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __repr__(self):
+		return "RasterGrid(xmin=%r, ymax=%r, cell_width=%r, cell_height=%r, nrows=%r, ncols=%r)" % self.key()
+
+	def window(self, xmin, ymin, xmax, ymax):
+		"""rows and columns (row0, row1, col0, col1) of the cells that intersect a bounding box, clipped to the grid"""
+		col0 = int(numpy.floor((xmin - self.xmin) / self.cell_width))
+		col1 = int(numpy.ceil((xmax - self.xmin) / self.cell_width))
+		row0 = int(numpy.floor((self.ymax - ymax) / self.cell_height))
+		row1 = int(numpy.ceil((self.ymax - ymin) / self.cell_height))
+		return max(row0, 0), min(row1, self.nrows), max(col0, 0), min(col1, self.ncols)
+
+
+class ZoneCoverage(object):
+	"""Sparse cell -> zone matrix in CSR form, compressed over the covered cells only.
+
+	cells   -- sorted flat (row * ncols + col) index of every cell covered by at least one zone
+	indptr  -- zones covering cells[i] are zones[indptr[i]:indptr[i + 1]]
+	zones   -- position of the zone in zone_ids for each entry
+	weights -- fraction of the cell that belongs to the zone for each entry (1 for cell center rasterizing)
+	"""
+
+	def __init__(self, grid, zone_ids, cells, indptr, zones, weights):
+		self.grid = grid
+		self.zone_ids = numpy.asarray(zone_ids)
+		self.cells = numpy.asarray(cells, dtype=numpy.int64)
+		self.indptr = numpy.asarray(indptr, dtype=numpy.int64)
+		self.zones = numpy.asarray(zones, dtype=numpy.int32)
+		self.weights = numpy.asarray(weights, dtype=numpy.float64)
+
+	@property
+	def n_zones(self):
+		return self.zone_ids.size
+
+	@property
+	def n_cells(self):
+		return self.cells.size
+
+	@property
+	def nnz(self):
+		return self.zones.size
+
+	def cell_counts(self):
+		"""number of zones covering each covered cell"""
+		return numpy.diff(self.indptr)
+
+	def entry_cells(self):
+		"""flat cell index for every entry of the matrix"""
+		return numpy.repeat(self.cells, self.cell_counts())
+
+
+def _ring_edges(rings):
+	"""start and end coordinates of every edge of the polygon rings"""
+	x0, y0, x1, y1 = [], [], [], []
+	for ring in rings:
+		ring = numpy.asarray(ring, dtype=numpy.float64)
+		if ring.shape[0] < 3:
+			continue
+		x0.append(ring[:, 0])
+		y0.append(ring[:, 1])
+		x1.append(numpy.roll(ring[:, 0], -1))  # closes the ring
+		y1.append(numpy.roll(ring[:, 1], -1))
+	if not x0:
+		return None
+	return numpy.concatenate(x0), numpy.concatenate(y0), numpy.concatenate(x1), numpy.concatenate(y1)
+
+
+def _expand_ranges(starts, stops):
+	"""concatenation of numpy.arange(start, stop) for every pair"""
+	lengths = stops - starts
+	total = lengths.sum()
+	if total == 0:
+		return numpy.zeros(0, dtype=numpy.int64)
+	offsets = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths)
+	return offsets + numpy.arange(total, dtype=numpy.int64)
+
+
+def _scanline_cells(edges, xmin, ymax, cell_width, cell_height, row0, row1, col0, col1, ncols):
+	"""flat index of the cells between row0:row1 and col0:col1 with their center inside the polygon (even odd rule)"""
+	x0, y0, x1, y1 = edges
+	ys = ymax - (numpy.arange(row0, row1) + 0.5) * cell_height
+	y = ys[:, numpy.newaxis]
+
+	# x where each edge crosses the scanline through the cell centers
+	crosses = (y0 <= y) != (y1 <= y)
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		xs = numpy.where(crosses, x0 + (y - y0) / (y1 - y0) * (x1 - x0), numpy.inf)
+	xs.sort(axis=1)
+	ncross = crosses.sum(axis=1).max() if crosses.size else 0
+	if ncross == 0:
+		return numpy.zeros(0, dtype=numpy.int64)
+	xs = xs[:, :ncross]
+
+	# pairs of crossings bound the inside of the polygon
+	rows = numpy.repeat(numpy.arange(row0, row1), ncross // 2)
+	enter = xs[:, 0::2].ravel()
+	leave = xs[:, 1::2].ravel()
+	inside = numpy.isfinite(enter) & numpy.isfinite(leave)
+	rows, enter, leave = rows[inside], enter[inside], leave[inside]
+
+	# columns with the center in [enter, leave)
+	start = numpy.ceil((enter - xmin) / cell_width - 0.5).astype(numpy.int64)
+	stop = numpy.ceil((leave - xmin) / cell_width - 0.5).astype(numpy.int64)
+	start = numpy.clip(start, col0, col1)
+	stop = numpy.clip(stop, col0, col1)
+	keep = stop > start
+	rows, start, stop = rows[keep], start[keep], stop[keep]
+	return _expand_ranges(rows * ncols + start, rows * ncols + stop)
+
+
+def polygon_cells(grid, rings, supersample=1):
+	"""Cells of the grid covered by a polygon and the fraction of each cell covered.
+
+	With supersample = 1 a cell belongs to the polygon when its center is inside (same as FeatureToRaster),
+	otherwise the fraction is estimated from supersample x supersample sub cell centers.
+	"""
+	edges = _ring_edges(rings)
+	if edges is None:
+		return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+	x0, y0, x1, y1 = edges
+	row0, row1, col0, col1 = grid.window(min(x0.min(), x1.min()), min(y0.min(), y1.min()),
+	                                     max(x0.max(), x1.max()), max(y0.max(), y1.max()))
+	if row1 <= row0 or col1 <= col0:
+		return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+
+	n = int(supersample)
+	if n <= 1:
+		cells = _scanline_cells(edges, grid.xmin, grid.ymax, grid.cell_width, grid.cell_height,
+		                        row0, row1, col0, col1, grid.ncols)
+		return cells, numpy.ones(cells.size)
+
+	# rasterize on a finer grid then count the sub cells that fall in each cell
+	sub_ncols = grid.ncols * n
+	sub = _scanline_cells(edges, grid.xmin, grid.ymax, grid.cell_width / n, grid.cell_height / n,
+	                      row0 * n, row1 * n, col0 * n, col1 * n, sub_ncols)
+	parent = (sub // sub_ncols // n) * grid.ncols + (sub % sub_ncols) // n
+	cells, counts = numpy.unique(parent, return_counts=True)
+	return cells, counts / float(n * n)
+
+
+def build_coverage(grid, zone_ids, zone_cells):
+	"""Assembles the cell -> zone matrix from the (cells, weights) of each zone"""
+	cells = [c for c, w in zone_cells]
+	weights = [w for c, w in zone_cells]
+	zones = [numpy.full(c.size, i, dtype=numpy.int32) for i, c in enumerate(cells)]
+
+	if cells:
+		cells = numpy.concatenate(cells)
+		weights = numpy.concatenate(weights)
+		zones = numpy.concatenate(zones)
+	else:
+		cells, weights, zones = numpy.zeros(0, numpy.int64), numpy.zeros(0), numpy.zeros(0, numpy.int32)
+
+	# sort entries by cell, stable so zones stay in input order within a cell
+	order = numpy.argsort(cells, kind="mergesort")
+	cells, zones, weights = cells[order], zones[order], weights[order]
+	unique_cells, counts = numpy.unique(cells, return_counts=True)
+	indptr = numpy.concatenate([[0], numpy.cumsum(counts)])
+	return ZoneCoverage(grid, zone_ids, unique_cells, indptr, zones, weights)
+
+
+def rasterize_polygons(grid, zone_ids, polygons, supersample=1):
+	"""Sparse coverage of overlapping polygons on a raster grid.
+
+	zone_ids -- one id per polygon (the zone field values)
+	polygons -- one list of rings per polygon, each ring a sequence of (x, y) in the grid's coordinates
+	"""
+	zone_cells = [polygon_cells(grid, rings, supersample) for rings in polygons]
+	return build_coverage(grid, zone_ids, zone_cells)
+
+
+def _disk_corner_area(x, y, r):
+	"""Area of the part of a disk of radius r centered on 0, 0 with X <= x and Y <= y (arrays)"""
+	x = numpy.clip(x, -r, r)
+	y = numpy.clip(y, -r, r)
+
+	def integral(t):  # integral of sqrt(r^2 - t^2) from 0 to t
+		return 0.5 * (t * numpy.sqrt(numpy.maximum(r * r - t * t, 0.0)) + r * r * numpy.arcsin(numpy.clip(t / r, -1.0, 1.0)))
+
+	# the disk column at X below y has length h + clip(y, -h, h) where h = sqrt(r^2 - X^2), and clip(y, -h, h) is y
+	# where |X| <= w = sqrt(r^2 - y^2) and sign(y) * h outside of that
+	w = numpy.sqrt(numpy.maximum(r * r - y * y, 0.0))
+	left = integral(x) - integral(-r)
+	inner = numpy.clip(x, -w, w)
+	inner_area = integral(inner) - integral(-w)
+	return left + y * (inner + w) + numpy.sign(y) * (left - inner_area)
+
+
+def rectangle_circle_area(x0, y0, x1, y1, r):
+	"""Area of the rectangles x0 <= X <= x1, y0 <= Y <= y1 (arrays) inside the disk of radius r centered on 0, 0"""
+	return (_disk_corner_area(x1, y1, r) - _disk_corner_area(x0, y1, r) - _disk_corner_area(x1, y0, r) +
+	        _disk_corner_area(x0, y0, r))
+
+
+def circle_template(fx, fy, radius, cell_width, cell_height, exact=True):
+	"""Cells covered by a circle whose center is at fx, fy (fractions of a cell from the left and top edges of the
+	center cell). Returns rows and columns relative to the center cell and the fraction of each cell inside the circle
+	(exact circle-cell intersection area), or with exact=False the cells with their center inside with weight 1.
+
+	Each row of cells is split into the cells fully inside the circle, which are ranges of columns, and the cells on
+	the edge, the only ones that need the area formula."""
+	r = float(radius)
+	k = int(numpy.ceil(r / cell_height)) + 1
+	drow = numpy.arange(-k, k + 1)
+	top = (fy - drow) * cell_height
+	bottom = top - cell_height
+
+	if not exact:
+		center = top - 0.5 * cell_height
+		inside = numpy.abs(center) <= r
+		half = numpy.sqrt(numpy.maximum(r * r - center * center, 0.0))
+		first = numpy.ceil((-half / cell_width) + fx - 0.5).astype(numpy.int64)
+		last = numpy.floor((half / cell_width) + fx - 0.5).astype(numpy.int64)
+		keep = inside & (last >= first)
+		rows = numpy.repeat(drow[keep], (last - first + 1)[keep])
+		cols = _expand_ranges(first[keep], last[keep] + 1)
+		return rows, cols, numpy.ones(rows.size)
+
+	near = numpy.where((bottom < 0) & (top > 0), 0.0, numpy.minimum(numpy.abs(top), numpy.abs(bottom)))
+	far = numpy.maximum(numpy.abs(top), numpy.abs(bottom))
+	touch = near < r
+	near_half = numpy.sqrt(numpy.maximum(r * r - near * near, 0.0))
+	far_half = numpy.where(far <= r, numpy.sqrt(numpy.maximum(r * r - far * far, 0.0)), -1.0)
+
+	# columns touching the circle (left < w and right > -w) and fully inside it (-w <= left, right <= w)
+	touch_first = numpy.floor(-near_half / cell_width + fx).astype(numpy.int64)
+	touch_last = numpy.ceil(near_half / cell_width + fx).astype(numpy.int64) - 1
+	in_first = numpy.ceil(-far_half / cell_width + fx).astype(numpy.int64)
+	in_last = numpy.floor(far_half / cell_width + fx).astype(numpy.int64) - 1
+	none_inside = (far_half < 0) | (in_last < in_first)
+	in_first = numpy.where(none_inside, touch_last + 1, in_first)
+	in_last = numpy.where(none_inside, touch_last, in_last)
+
+	def cells(first, last):
+		keep = touch & (last >= first)
+		return numpy.repeat(drow[keep], (last - first + 1)[keep]), _expand_ranges(first[keep], last[keep] + 1)
+
+	inner_rows, inner_cols = cells(in_first, in_last)
+	left_rows, left_cols = cells(touch_first, numpy.minimum(in_first - 1, touch_last))
+	right_rows, right_cols = cells(numpy.maximum(in_last + 1, touch_first), touch_last)
+	edge_rows = numpy.concatenate((left_rows, right_rows))
+	edge_cols = numpy.concatenate((left_cols, right_cols))
+
+	x0 = (edge_cols - fx) * cell_width
+	x1 = x0 + cell_width
+	y1 = (fy - edge_rows) * cell_height
+	y0 = y1 - cell_height
+	edge_weights = numpy.clip(rectangle_circle_area(x0, y0, x1, y1, r) / (cell_width * cell_height), 0.0, 1.0)
+	keep = edge_weights > 1e-12
+	rows = numpy.concatenate((inner_rows, edge_rows[keep]))
+	cols = numpy.concatenate((inner_cols, edge_cols[keep]))
+	return rows, cols, numpy.concatenate((numpy.ones(inner_rows.size), edge_weights[keep]))
+
+
+def circle_cells(grid, x, y, radius, exact=True, templates=None):
+	"""Cells of the grid covered by a circle and the fraction of each cell covered (see circle_template). Circles
+	with the same radius and the same position within their center cell share their template through the templates
+	dict, as the points of a grid aligned with the raster do"""
+	col_position = (x - grid.xmin) / grid.cell_width
+	row_position = (grid.ymax - y) / grid.cell_height
+	col, row = int(numpy.floor(col_position)), int(numpy.floor(row_position))
+	fx, fy = round(col_position - col, 9), round(row_position - row, 9)
+	key = (fx, fy, float(radius), exact)
+	if templates is None or key not in templates:
+		template = circle_template(fx, fy, radius, grid.cell_width, grid.cell_height, exact)
+		if templates is None:
+			templates = {}
+		templates[key] = template
+	drow, dcol, weights = templates[key]
+	rows = row + drow
+	cols = col + dcol
+	inside = (rows >= 0) & (rows < grid.nrows) & (cols >= 0) & (cols < grid.ncols)
+	return (rows[inside] * grid.ncols + cols[inside]).astype(numpy.int64), weights[inside]
+
+
+def rasterize_circles(grid, zone_ids, x, y, radius, supersample=1):
+	"""Sparse coverage of overlapping circles (centers x, y and a radius or one radius per circle). With supersample
+	> 1 the weights are the exact fraction of each cell inside the circle, with 1 the cells with their center inside
+	(same as rasterize_polygons)"""
+	radius = numpy.broadcast_to(numpy.asarray(radius, dtype=numpy.float64), numpy.shape(x))
+	templates = {}
+	zone_cells = [circle_cells(grid, cx, cy, r, supersample > 1, templates)
+	              for cx, cy, r in zip(numpy.asarray(x).tolist(), numpy.asarray(y).tolist(), radius.tolist())]
+	return build_coverage(grid, zone_ids, zone_cells)
+
+
+def fit_circle(rings, tolerance=0.001):
+	"""(x, y, radius) of a polygon that is a densified circle (one ring with its vertices within tolerance * radius of
+	the circle, like the buffers of points), else None"""
+	if len(rings) != 1 or len(rings[0]) < 16:
+		return None
+	ring = numpy.asarray(rings[0], dtype=numpy.float64)[:, :2]
+	x, y = ring[:, 0], ring[:, 1]
+	cross = x * numpy.roll(y, -1) - numpy.roll(x, -1) * y
+	area = cross.sum() / 2.0
+	if area == 0:
+		return None
+	cx = ((x + numpy.roll(x, -1)) * cross).sum() / (6.0 * area)
+	cy = ((y + numpy.roll(y, -1)) * cross).sum() / (6.0 * area)
+	distance = numpy.hypot(x - cx, y - cy)
+	radius = distance.mean()
+	if distance.max() - distance.min() > tolerance * radius:
+		return None
+	return cx, cy, radius
+
+
+def rasterize_buffers(grid, zone_ids, polygons, supersample=1):
+	"""rasterize_polygons with the polygons that are circles (the buffers of points) rasterized as exact circles"""
+	templates = {}
+	zone_cells = []
+	for rings in polygons:
+		circle = fit_circle(rings)
+		if circle is None:
+			zone_cells.append(polygon_cells(grid, rings, supersample))
+		else:
+			zone_cells.append(circle_cells(grid, circle[0], circle[1], circle[2], supersample > 1, templates))
+	return build_coverage(grid, zone_ids, zone_cells)
+
+
+def _valid_values(values, nodata):
+	"""mask of the values that are not nodata or nan"""
+	valid = numpy.ones(values.shape, dtype=bool)
+	if nodata is not None:
+		valid &= values != nodata
+	if values.dtype.kind == "f":
+		valid &= ~numpy.isnan(values)
+	return valid
+
+
+def array_reader(values):
+	"""window reader over a raster already in memory"""
+	values = numpy.asarray(values)
+
+	def read(row0, row1, col0, col1):
+		return values[row0:row1, col0:col1]
+	return read
+
+
+def coverage_blocks(coverage, block_size=2048):
+	"""Splits the covered cells into block_size x block_size windows of the grid.
+
+	Yields ((row0, row1, col0, col1), position of each covered cell in the flattened window, number of entries of
+	each covered cell, entry indices). Windows without covered cells are skipped.
+	"""
+	grid = coverage.grid
+	rows = coverage.cells // grid.ncols
+	cols = coverage.cells % grid.ncols
+	nblock_cols = -(-grid.ncols // block_size)
+	block = (rows // block_size) * nblock_cols + cols // block_size
+
+	order = numpy.argsort(block, kind="mergesort")
+	blocks, starts = numpy.unique(block[order], return_index=True)
+	stops = numpy.append(starts[1:], order.size)
+	for b, start, stop in zip(blocks, starts, stops):
+		row0 = (b // nblock_cols) * block_size
+		col0 = (b % nblock_cols) * block_size
+		row1 = min(row0 + block_size, grid.nrows)
+		col1 = min(col0 + block_size, grid.ncols)
+		idx = order[start:stop]
+		local = (rows[idx] - row0) * (col1 - col0) + (cols[idx] - col0)
+		first, last = coverage.indptr[idx], coverage.indptr[idx + 1]
+		yield (row0, row1, col0, col1), local, last - first, _expand_ranges(first, last)
+
+
+def _group_reduce(ufunc, groups, values, n, fill):
+	"""ufunc (numpy.minimum, numpy.maximum) reduction of the values of each group, fill for empty groups"""
+	out = numpy.full(n, fill, dtype=numpy.float64)
+	if groups.size:
+		order = numpy.argsort(groups, kind="mergesort")
+		groups = groups[order]
+		starts = numpy.flatnonzero(numpy.concatenate(([True], groups[1:] != groups[:-1])))
+		out[groups[starts]] = ufunc.reduceat(values[order], starts)
+	return out
+
+
+class ZonalAccumulator(object):
+	"""Running per zone statistics updated one window of the value raster at a time.
+
+	Keeps the weighted count, sum, sum of squared deviations from the mean (merged between windows with the
+	parallel variance formula, which stays accurate where a plain sum of squares loses precision), min, max and
+	the number of nodata cells of each zone.
+	"""
+
+	def __init__(self, n_zones):
+		self.count = numpy.zeros(n_zones)
+		self.total = numpy.zeros(n_zones)
+		self.m2 = numpy.zeros(n_zones)
+		self.vmin = numpy.full(n_zones, numpy.inf)
+		self.vmax = numpy.full(n_zones, -numpy.inf)
+		self.nodata = numpy.zeros(n_zones)
+
+	def update(self, zones, weights, values, valid):
+		"""adds the entries (zone, cell weight, cell value, value is data) of one window"""
+		n = self.count.size
+		values = numpy.where(valid, values, 0).astype(numpy.float64)
+		w = numpy.where(valid, weights, 0.0)
+
+		count = numpy.bincount(zones, weights=w, minlength=n)
+		total = numpy.bincount(zones, weights=w * values, minlength=n)
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			mean = numpy.where(count > 0, total / count, 0.0)
+			old_mean = numpy.where(self.count > 0, self.total / self.count, 0.0)
+			m2 = numpy.bincount(zones, weights=w * (values - mean[zones]) ** 2, minlength=n)
+			combined = self.count + count
+			delta = mean - old_mean
+			self.m2 += m2 + numpy.where(combined > 0, delta * delta * self.count * count / combined, 0.0)
+		self.count = combined
+		self.total += total
+
+		self.vmin = numpy.minimum(self.vmin, _group_reduce(numpy.minimum, zones[valid], values[valid], n, numpy.inf))
+		self.vmax = numpy.maximum(self.vmax, _group_reduce(numpy.maximum, zones[valid], values[valid], n, -numpy.inf))
+		self.nodata += numpy.bincount(zones, weights=(~valid).astype(numpy.float64), minlength=n)
+
+	def table(self, zone_ids, cell_area, statistics_type="ALL", ignore_nodata=True, zone_field="Value"):
+		"""ZonalStatisticsAsTable style table of the zones with data"""
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			mean = self.total / self.count
+			std = numpy.sqrt(numpy.maximum(self.m2 / self.count, 0.0))
+		results = {"MIN": self.vmin, "MAX": self.vmax, "RANGE": self.vmax - self.vmin, "MEAN": mean, "STD": std,
+		           "SUM": self.total}
+
+		keep = self.count > 0
+		if not ignore_nodata:
+			keep &= self.nodata == 0
+
+		fields = STATISTICS[statistics_type]
+		dtype = [(zone_field, zone_ids.dtype), ("COUNT", numpy.float64), ("AREA", numpy.float64)]
+		dtype += [(field, numpy.float64) for field in fields]
+		table = numpy.zeros(int(keep.sum()), dtype=dtype)
+		table[zone_field] = zone_ids[keep]
+		table["COUNT"] = self.count[keep]
+		table["AREA"] = self.count[keep] * cell_area
+		for field in fields:
+			table[field] = results[field][keep]
+		return table
+
+
+class ClassAccumulator(object):
+	"""Running per zone class histograms (area of each class) updated one window of the class raster at a time"""
+
+	def __init__(self, n_zones, classes=None):
+		self.fixed = classes is not None
+		# sorted and unique for the searchsorted lookup of the columns
+		self.classes = numpy.unique(numpy.asarray(classes if classes is not None else []))
+		self.area = numpy.zeros((n_zones, self.classes.size))
+
+	def _add_classes(self, values):
+		"""adds columns for the classes not seen in an earlier window (with the dtype of the class raster)"""
+		classes = numpy.union1d(self.classes, values) if self.classes.size else numpy.unique(values)
+		if classes.size == self.classes.size:
+			return
+		area = numpy.zeros((self.area.shape[0], classes.size))
+		area[:, numpy.searchsorted(classes, self.classes)] = self.area
+		self.classes, self.area = classes, area
+
+	def update(self, zones, weights, values, valid):
+		"""adds the entries (zone, cell area within the zone, cell class, value is data) of one window"""
+		if not self.fixed:
+			self._add_classes(numpy.unique(values[valid]))
+		nz, nc = self.area.shape
+		if nc == 0:
+			return
+
+		# one hot column of each entry, other classes are dropped
+		column = numpy.clip(numpy.searchsorted(self.classes, values), 0, nc - 1)
+		valid = valid & (self.classes[column] == values)
+		w = numpy.where(valid, weights, 0.0)
+		self.area += numpy.bincount(zones.astype(numpy.int64) * nc + column, weights=w, minlength=nz * nc).reshape(nz, nc)
+
+	def table(self, zone_ids, keep, zone_field="Value"):
+		"""TabulateArea style wide table with a VALUE_<class> field per class"""
+		dtype = [(zone_field, zone_ids.dtype)] + [(class_field_name(c), numpy.float64) for c in self.classes]
+		table = numpy.zeros(int(keep.sum()), dtype=dtype)
+		table[zone_field] = zone_ids[keep]
+		for i, c in enumerate(self.classes):
+			table[class_field_name(c)] = self.area[keep, i]
+		return table
+
+
+def stream_entries(coverage, readers, nodatas, block_size=2048):
+	"""Reads every window with covered cells once from each of the rasters (window readers on the coverage grid).
+
+	Yields (entry indices, [entry values of each raster], [entry is data for each raster]) for each window, so
+	several co-registered rasters (like the years of a time series) share one decomposition of the coverage.
+	"""
+	for window, local, counts, entries in coverage_blocks(coverage, block_size):
+		values, valid = [], []
+		for reader, nodata in zip(readers, nodatas):
+			cell_values = numpy.asarray(reader(*window)).ravel()[local]
+			values.append(numpy.repeat(cell_values, counts))
+			valid.append(numpy.repeat(_valid_values(cell_values, nodata), counts))
+		yield entries, values, valid
+
+
+def _stream(coverage, reader, nodata, accumulator, block_size, weights):
+	"""passes every window of the raster with covered cells through the accumulator"""
+	for entries, values, valid in stream_entries(coverage, [reader], [nodata], block_size):
+		accumulator.update(coverage.zones[entries], weights[entries], values[0], valid[0])
+
+
+def zonal_statistics(coverage, values, nodata=None, statistics_type="ALL", ignore_nodata=True, zone_field="Value",
+                     block_size=2048):
+	"""Zonal statistics for every zone of the coverage from one pass over the value raster.
+
+	values is a 2d array on the coverage grid or a window reader, read(row0, row1, col0, col1), so the raster is
+	streamed in block_size x block_size windows and only one window is in memory. Returns a numpy structured array
+	with the zone field, COUNT, AREA and the fields of the statistics type (see STATISTICS), ready for
+	arcpy.da.NumPyArrayToTable. Zones without any data cells are left out, same as ZonalStatisticsAsTable. With
+	ignore_nodata False a zone that covers a nodata cell is left out as well.
+	"""
+	statistics_type = statistics_type.upper()
+	if statistics_type not in STATISTICS:
+		raise ValueError("Statistics type '%s' not supported, use one of %s" % (statistics_type, ", ".join(STATISTICS)))
+	reader = _check_values(coverage, values)
+
+	accumulator = ZonalAccumulator(coverage.n_zones)
+	_stream(coverage, reader, nodata, accumulator, block_size, coverage.weights)
+	return accumulator.table(coverage.zone_ids, coverage.grid.cell_area, statistics_type, ignore_nodata, zone_field)
+
+
+def class_field_name(value):
+	"""VALUE_<class> field name used by TabulateArea"""
+	return "VALUE_%d" % value if float(value).is_integer() else "VALUE_%s" % value
+
+
+def tabulate_area(coverage, values, nodata=None, zone_field="Value", classes=None, block_size=2048):
+	"""Area of each class of a class raster within every zone (the TabulateArea wide table).
+
+	The area table is the product of the zone x cell coverage matrix (fractional cell weights times the cell area)
+	and the one hot cell x class matrix, done as weighted bincounts over the (zone, class) pairs of each window of
+	the class raster (values is a 2d array or a window reader, see zonal_statistics). Returns a numpy structured
+	array with the zone field and a VALUE_<class> field per class, in ascending class order. classes defaults to all
+	of the classes found within the zones.
+	"""
+	reader = _check_values(coverage, values)
+
+	accumulator = ClassAccumulator(coverage.n_zones, classes)
+	_stream(coverage, reader, nodata, accumulator, block_size, coverage.weights * coverage.grid.cell_area)
+	keep = numpy.bincount(coverage.zones, minlength=coverage.n_zones) > 0
+	return accumulator.table(coverage.zone_ids, keep, zone_field)
+
+
+def _sum_duplicates(keys, area):
+	"""sums the area of the rows with the same keys (tuple of arrays), returns the unique keys and area"""
+	if area.size == 0:
+		return keys, area
+	order = numpy.lexsort(keys[::-1])
+	keys = tuple(k[order] for k in keys)
+	new = numpy.zeros(area.size, dtype=bool)
+	new[0] = True
+	for k in keys:
+		new[1:] |= k[1:] != k[:-1]
+	starts = numpy.flatnonzero(new)
+	return tuple(k[starts] for k in keys), numpy.add.reduceat(area[order], starts)
+
+
+class TransitionAccumulator(object):
+	"""Running sparse (zone, from class, to class) areas of two co-registered class rasters"""
+
+	def __init__(self, max_rows=5000000):
+		self.max_rows = max_rows
+		self.parts = []
+		self.rows = 0
+
+	def update(self, zones, weights, from_values, to_values, valid):
+		"""adds the entries (zone, cell area within the zone, class of each raster, both are data) of one window"""
+		keys, area = _sum_duplicates((zones[valid], from_values[valid], to_values[valid]), weights[valid])
+		self.parts.append(keys + (area,))
+		self.rows += area.size
+		if self.rows > self.max_rows:
+			self._compact()
+
+	def _compact(self):
+		"""merges the window parts so memory stays about the number of distinct transitions"""
+		if len(self.parts) > 1:
+			columns = [numpy.concatenate(c) for c in zip(*self.parts)]
+			keys, area = _sum_duplicates(tuple(columns[:3]), columns[3])
+			self.parts = [keys + (area,)]
+		self.rows = self.parts[0][3].size if self.parts else 0
+
+	def table(self, zone_ids, zone_field="Value"):
+		"""COO table with a row for every (zone, FROM_CLASS, TO_CLASS) with area"""
+		self._compact()
+		if self.parts:
+			zones, from_values, to_values, area = self.parts[0]
+		else:
+			zones = from_values = to_values = numpy.zeros(0, dtype=numpy.int64)
+			area = numpy.zeros(0)
+		dtype = [(zone_field, zone_ids.dtype), ("FROM_CLASS", from_values.dtype), ("TO_CLASS", to_values.dtype),
+		         ("AREA", numpy.float64)]
+		table = numpy.zeros(area.size, dtype=dtype)
+		table[zone_field] = zone_ids[zones]
+		table["FROM_CLASS"] = from_values
+		table["TO_CLASS"] = to_values
+		table["AREA"] = area
+		return table
+
+
+def transition_tables(coverage, layers, zone_field="Value", block_size=2048):
+	"""Area of every class transition between consecutive co-registered class rasters (like the CAML years).
+
+	layers -- list of (name, values, nodata) in time order with values on the coverage grid (array or window reader)
+	Every window is read once for all of the layers. Returns an OrderedDict of (name, next name) -> sparse table with
+	the zone field, FROM_CLASS, TO_CLASS and AREA, only the transitions with area are kept.
+	"""
+	readers = [_check_values(coverage, values) for name, values, nodata in layers]
+	pairs = [(layers[i][0], layers[i + 1][0]) for i in range(len(layers) - 1)]
+	accumulators = [TransitionAccumulator() for pair in pairs]
+	weights = coverage.weights * coverage.grid.cell_area
+	for entries, values, valid in stream_entries(coverage, readers, [nodata for name, v, nodata in layers], block_size):
+		zones = coverage.zones[entries]
+		for i, accumulator in enumerate(accumulators):
+			accumulator.update(zones, weights[entries], values[i], values[i + 1], valid[i] & valid[i + 1])
+
+	tables = OrderedDict()
+	for pair, accumulator in zip(pairs, accumulators):
+		tables[pair] = accumulator.table(coverage.zone_ids, zone_field)
+	return tables
+
+
+def _check_values(coverage, values):
+	"""window reader for the values"""
+	if callable(values):
+		return values
+	if values.shape != coverage.grid.shape:
+		raise ValueError("Raster shape %s does not match the coverage grid %s" % (values.shape, coverage.grid.shape))
+	return array_reader(values)
+
+
+def tabulate_area_stack(coverage, layers, zone_field="Value", block_size=2048, return_classes=False):
+	"""Tabulated area of several co-registered class rasters (the bands of a stack, like the CAML years) in one pass.
+
+	layers -- list of (name, values, nodata) with values on the coverage grid (array or window reader)
+	Each window is read once for all of the layers and updates the class histograms of every layer. Returns an
+	OrderedDict of name -> tabulate_area table, with return_classes also an OrderedDict of name -> class values of the
+	VALUE_<class> fields (for long_table).
+	"""
+	readers = [_check_values(coverage, values) for name, values, nodata in layers]
+	accumulators = [ClassAccumulator(coverage.n_zones) for layer in layers]
+	weights = coverage.weights * coverage.grid.cell_area
+	for entries, values, valid in stream_entries(coverage, readers, [nodata for name, v, nodata in layers], block_size):
+		zones = coverage.zones[entries]
+		for accumulator, layer_values, layer_valid in zip(accumulators, values, valid):
+			accumulator.update(zones, weights[entries], layer_values, layer_valid)
+
+	keep = numpy.bincount(coverage.zones, minlength=coverage.n_zones) > 0
+	tables, classes = OrderedDict(), OrderedDict()
+	for (name, values, nodata), accumulator in zip(layers, accumulators):
+		tables[name] = accumulator.table(coverage.zone_ids, keep, zone_field)
+		classes[name] = accumulator.classes
+	if return_classes:
+		return tables, classes
+	return tables
+
+
+def long_table(tables, classes, zone_field="Value", key_field="YEAR"):
+	"""Long format (zone, key, CLASS, AREA) table of the tabulate_area tables of an OrderedDict key -> table, classes
+	the class values of the VALUE_<class> fields of every key (see tabulate_area_stack). Rows with no area are left
+	out."""
+	zones, keys, class_values, areas = [], [], [], []
+	for key, table in tables.items():
+		for field, value in zip(table.dtype.names[1:], classes[key]):
+			area = table[field]
+			has_area = area > 0
+			zones.append(table[zone_field][has_area])
+			keys.append(numpy.repeat(key, has_area.sum()))
+			class_values.append(numpy.repeat(value, has_area.sum()))
+			areas.append(area[has_area])
+
+	key_values = numpy.asarray(list(tables.keys()))
+	zone_dtype = tables[list(tables.keys())[0]].dtype[zone_field] if tables else numpy.int64
+	class_dtype = numpy.result_type(*[numpy.asarray(classes[key]) for key in tables]) if tables else numpy.int64
+	class_dtype = numpy.int64 if class_dtype.kind in "iub" else class_dtype
+	dtype = [(zone_field, zone_dtype), (key_field, key_values.dtype), ("CLASS", class_dtype), ("AREA", numpy.float64)]
+	if not zones:
+		return numpy.zeros(0, dtype=dtype)
+	table = numpy.zeros(sum(z.size for z in zones), dtype=dtype)
+	table[zone_field] = numpy.concatenate(zones)
+	table[key_field] = numpy.concatenate(keys)
+	table["CLASS"] = numpy.concatenate(class_values)
+	table["AREA"] = numpy.concatenate(areas)
+	table = table[numpy.lexsort((table["CLASS"], table[key_field], table[zone_field]))]
+	return table
+
+
+def zonal_tables(coverage, layers, zone_field="Value", block_size=2048):
+	"""Zonal statistics or tabulated area of several rasters through the same coverage.
+
+	layers -- list of (name, values, nodata, statistics_type) with values on the coverage grid (array or window
+	          reader). statistics_type is one of STATISTICS, or "AREA" to tabulate the area of each class.
+	Returns an OrderedDict of name -> table.
+	"""
+	tables = OrderedDict()
+	for name, values, nodata, statistics_type in layers:
+		if statistics_type.upper() == "AREA":
+			tables[name] = tabulate_area(coverage, values, nodata, zone_field, block_size=block_size)
+		else:
+			tables[name] = zonal_statistics(coverage, values, nodata, statistics_type, True, zone_field, block_size)
+	return tables
+
+
+def wide_table(tables, zone_field="Value"):
+	"""Joins tables on the zone field into one table with the fields renamed to <table name>_<field>.
+
+	Zones missing from a table get nan for its fields.
+	"""
+	ids = numpy.unique(numpy.concatenate([table[zone_field] for table in tables.values()]))
+	dtype = [(zone_field, ids.dtype)]
+	for name, table in tables.items():
+		dtype += [("%s_%s" % (name, field), numpy.float64) for field in table.dtype.names if field != zone_field]
+
+	wide = numpy.zeros(ids.size, dtype=dtype)
+	wide[zone_field] = ids
+	for field, field_type in dtype[1:]:
+		wide[field] = numpy.nan
+	for name, table in tables.items():
+		rows = numpy.searchsorted(ids, table[zone_field])
+		for field in table.dtype.names:
+			if field != zone_field:
+				wide["%s_%s" % (name, field)][rows] = table[field]
+	return wide
+
+
+def isin(values, test_values):
+	"""numpy.isin of a 1d array (numpy.in1d before numpy 1.13)"""
+	if hasattr(numpy, "isin"):
+		return numpy.isin(values, test_values)
+	return numpy.in1d(values, test_values)
+
+
+def upsert_table(table, rows, remove_ids, zone_field="Value", fill=numpy.nan):
+	"""Replaces the rows of the zones in remove_ids by the new rows (the zones recomputed after a change).
+
+	Fields only in one of the two tables get fill (nan, or 0 for tabulated area) for the rows of the other table.
+	Returns a new table sorted by the zone field.
+	"""
+	keep = ~isin(table[zone_field], numpy.asarray(remove_ids, dtype=table.dtype[zone_field]))
+	dtype = []
+	for field in table.dtype.names + tuple(f for f in rows.dtype.names if f not in table.dtype.names):
+		if field in table.dtype.names and field in rows.dtype.names:
+			dtype.append((field, numpy.promote_types(table.dtype[field], rows.dtype[field])))
+		else:
+			dtype.append((field, (table if field in table.dtype.names else rows).dtype[field]))
+
+	result = numpy.zeros(int(keep.sum()) + rows.size, dtype=dtype)
+	for field, field_type in dtype:
+		if result.dtype[field].kind == "f":
+			result[field] = fill
+		if field in table.dtype.names:
+			result[field][:keep.sum()] = table[field][keep]
+		if field in rows.dtype.names:
+			result[field][keep.sum():] = rows[field]
+	return result[numpy.argsort(result[zone_field], kind="mergesort")]
+
+
+class RasterioReader(object):
+	"""Window reader of a raster band with rasterio (outside of ArcGIS)"""
+
+	def __init__(self, path, band=1):
+		import rasterio  # only needed when running without arcpy
+
+		self.src = rasterio.open(path)
+		self.band = band
+		t = self.src.transform
+		crs = self.src.crs.to_wkt() if self.src.crs else None
+		self.grid = RasterGrid(t.c, t.f, t.a, -t.e, self.src.height, self.src.width, crs=crs)
+		self.nodata = self.src.nodata
+
+	def __call__(self, row0, row1, col0, col1):
+		from rasterio.windows import Window
+		return self.src.read(self.band, window=Window(col0, row0, col1 - col0, row1 - row0))
+
+	def close(self):
+		self.src.close()
+
+
+def read_raster(path, band=1):
+	"""Reads a whole raster band with rasterio (outside of ArcGIS). Returns (values, grid, nodata)"""
+	reader = RasterioReader(path, band)
+	try:
+		return reader(0, reader.grid.nrows, 0, reader.grid.ncols), reader.grid, reader.nodata
+	finally:
+		reader.close()
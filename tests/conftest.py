@@ -0,0 +1,25 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: conftest.py
+# Purpose: setup of the engine tests (python -m pytest from the repository folder). The tbx modules import each
+#          other by name, so the tbx folder and the scripts of the supplemental tools are put on the path like the
+#          toolboxes do.
+# ---------------------------------------------------------------------------------------------------
+
+import os
+import sys
+
+import pytest
+
+TBX = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tbx")
+SCRIPTS = os.path.join(TBX, "SpatialAnalystSupplementalTools", "Scripts")
+for folder in (SCRIPTS, TBX):
+	if folder not in sys.path:
+		sys.path.insert(0, folder)
+
+
+@pytest.fixture
+def gdal():
+	pytest.importorskip("fiona")
+	pytest.importorskip("rasterio")
+	import io_backend
+	return io_backend.get_backend("gdal")
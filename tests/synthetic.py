@@ -0,0 +1,52 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: synthetic.py
+# Purpose: small synthetic rasters and feature classes for the engine tests and brute force references
+# ---------------------------------------------------------------------------------------------------
+
+import numpy
+import pytest
+
+# projected spatial reference of the synthetic datasets (California Albers, meters)
+CRS = "EPSG:3310"
+
+
+def inside_rings(x, y, rings):
+	"""brute force even odd rule of the points against every edge of the rings"""
+	inside = numpy.zeros(numpy.shape(x), dtype=bool)
+	for ring in rings:
+		ring = numpy.asarray(ring, dtype=numpy.float64)
+		for (ax, ay), (bx, by) in zip(ring, numpy.roll(ring, -1, axis=0)):
+			if ay == by:
+				continue
+			crosses = (ay > y) != (by > y)
+			inside ^= crosses & (x < ax + (y - ay) * (bx - ax) / (by - ay))
+	return inside
+
+
+def write_raster(path, values, xmin, ymax, cell_size, nodata=None):
+	"""single band GeoTIFF of a 2d array"""
+	rasterio = pytest.importorskip("rasterio")
+	from rasterio.transform import from_origin
+
+	with rasterio.open(path, "w", driver="GTiff", width=values.shape[1], height=values.shape[0], count=1,
+	                   dtype=values.dtype, crs=CRS, transform=from_origin(xmin, ymax, cell_size, cell_size),
+	                   nodata=nodata) as dst:
+		dst.write(values, 1)
+	return path
+
+
+def write_features(path, geometry_type, geometries, properties=None):
+	"""shapefile of geojson like geometries with the properties (dict of field -> list of values, None for nulls).
+	A geometry_type of "None" with a .dbf path writes a table"""
+	fiona = pytest.importorskip("fiona")
+	from fiona.crs import CRS as FionaCRS
+
+	properties = properties or {}
+	types = dict((field, "str" if any(isinstance(v, str) for v in values) else
+	              "int" if all(isinstance(v, int) for v in values) else "float")
+	             for field, values in properties.items())
+	schema = {"geometry": geometry_type, "properties": types}
+	with fiona.open(path, "w", driver="ESRI Shapefile", crs=FionaCRS.from_string(CRS), schema=schema) as dst:
+		for i, geometry in enumerate(geometries):
+			dst.write({"geometry": geometry, "properties": dict((f, v[i]) for f, v in properties.items())})
+	return path
@@ -0,0 +1,37 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_bufferoverlaps.py
+# Purpose: the overlap graph of equal radius buffers from their centers against brute force pair distances
+# ---------------------------------------------------------------------------------------------------
+
+import numpy
+
+import bufferoverlaps
+
+
+def brute_force_pairs(x, y, distance):
+	i, j = numpy.nonzero(numpy.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :]) < distance)
+	keep = i < j
+	return set(zip(i[keep].tolist(), j[keep].tolist()))
+
+
+def test_pairs_within_matches_brute_force():
+	random = numpy.random.RandomState(2)
+	# clustered and spread out points, with duplicates
+	x = numpy.concatenate((random.uniform(0, 20000, 500), random.normal(5000, 300, 300), [7000.0] * 3))
+	y = numpy.concatenate((random.uniform(-3000, 9000, 500), random.normal(100, 300, 300), [-50.0] * 3))
+	for distance in (50.0, 800.0, 5000.0):
+		i, j = bufferoverlaps.pairs_within(x, y, distance)
+		pairs = list(zip(i.tolist(), j.tolist()))
+		assert len(pairs) == len(set(pairs))
+		assert set(pairs) == brute_force_pairs(x, y, distance)
+
+
+def test_circle_overlaps():
+	fids = numpy.array([10, 20, 30, 40])
+	x = numpy.array([0.0, 150.0, 350.0, 0.0])
+	y = numpy.array([0.0, 0.0, 0.0, 199.0])
+	src, nbr = bufferoverlaps.circle_overlaps(fids, x, y, 100.0)
+	# 20 and 30 only touch, both directions of every pair like PolygonNeighbors BOTH_SIDES
+	assert sorted(zip(src.tolist(), nbr.tolist())) == [(10, 20), (10, 40), (20, 10), (40, 10)]
+	src, nbr = bufferoverlaps.circle_overlaps(fids[:1], x[:1], y[:1], 100.0)
+	assert src.size == nbr.size == 0
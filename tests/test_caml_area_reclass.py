@@ -0,0 +1,105 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_caml_area_reclass.py
+# Purpose: the in memory reclass of tabulated area tables against the field calculations of the old reclass
+#          (main_fields), with classes that are in no group and groups without any class of the table
+# ---------------------------------------------------------------------------------------------------
+
+import os
+
+import numpy
+import pytest
+
+import caml_area_reclass
+
+nan = numpy.nan
+
+# VALUE_9 is in no group, group 4 has no class of the table, VALUE_212910 is only in the second scheme
+AREA = numpy.array([
+	(1, 100.0, 0.0, 25.0, nan, 5.0),
+	(2, nan, 30.0, 0.0, 10.0, 0.0),
+	(3, 7.5, 2.5, 1.0, 1.0, 1.0),
+], dtype=[("WELLID", "i8"), ("VALUE_1", "f8"), ("VALUE_3", "f8"), ("VALUE_9", "f8"), ("VALUE_212910", "f8"),
+          ("VALUE_12", "f8")])
+SCHEMES = [
+	[("1", ["1", "12"]), ("2", ["3"]), ("4", ["5", "6"])],
+	[("natural", ["212910", "3"]), ("urban", ["1"])],
+]
+
+
+def write_csv(path, groups):
+	with open(path, "w") as f:
+		f.write("FROM,TO\n")
+		for group, classes in groups:
+			for value in classes:
+				f.write("%s,%s\n" % (value, group))
+	return path
+
+
+def field_calculation(area, groups):
+	"""the steps of main_fields row by row: nulls as zeros, a GROUP_<group> field summing the VALUE_<class> fields of
+	the table (zero when there is none), GROUP_AREA the sum of the GROUP_* fields and the VALUE* fields deleted"""
+	rows = []
+	for row in area:
+		row = dict((field, 0.0 if row[field] != row[field] else row[field].item()) for field in area.dtype.names)
+		for group, classes in groups:
+			row["GROUP_" + group] = sum(row["VALUE_" + value] for value in classes if "VALUE_" + value in row)
+		row["GROUP_AREA"] = sum(row[field] for field in row if field.startswith("GROUP_") and field != "GROUP_AREA")
+		rows.append(dict((field, value) for field, value in row.items() if not field.startswith("VALUE")))
+	return rows
+
+
+def test_reclass_arrays_match_field_calculation():
+	results = caml_area_reclass.reclass_arrays(AREA, SCHEMES)
+	for groups, result in zip(SCHEMES, results):
+		assert result.dtype.names == ("WELLID",) + tuple("GROUP_" + g for g, c in groups) + ("GROUP_AREA",)
+		assert [dict(zip(result.dtype.names, row)) for row in result.tolist()] == field_calculation(AREA, groups)
+	assert results[0]["GROUP_4"].tolist() == [0.0, 0.0, 0.0]
+	# the unmapped VALUE_9 is in no group and not in the group area
+	assert results[0]["GROUP_AREA"].tolist() == [105.0, 30.0, 11.0]
+
+
+def test_aggregation_matrix():
+	fields = ["VALUE_1", "VALUE_3", "VALUE_9", "VALUE_212910", "VALUE_12"]
+	matrix = caml_area_reclass.aggregation_matrix(SCHEMES[0], fields)
+	assert matrix.tolist() == [[1, 0, 0], [0, 1, 0], [0, 0, 0], [0, 0, 0], [1, 0, 0]]
+
+
+def test_batch(tmp_path, gdal):
+	folder = str(tmp_path)
+	csvs = [write_csv(os.path.join(folder, name + ".csv"), groups)
+	        for name, groups in zip(("GROUPS", "RECLASS"), SCHEMES)]
+	tables = []
+	for year in (1990, 2005):
+		tables.append(os.path.join(folder, "CAML_%d.csv" % year))
+		area = AREA.copy()
+		area["VALUE_1"] *= year - 1989
+		gdal.write_table(area, tables[-1])
+
+	outputs = caml_area_reclass.batch(tables, csvs, folder, gdal, ".csv")
+	assert [os.path.basename(output) for output in outputs] == [
+		"CAML_1990_GROUPS.csv", "CAML_1990_RECLASS.csv", "CAML_2005_GROUPS.csv", "CAML_2005_RECLASS.csv"]
+	for output, (table, groups) in zip(outputs, [(t, g) for t in tables for g in SCHEMES]):
+		expected = field_calculation(gdal.read_table(table, null_value=nan), groups)
+		result = gdal.read_table(output)
+		assert [dict(zip(result.dtype.names, row)) for row in result.tolist()] == pytest.approx(expected)
+
+	caml_area_reclass.main(tables[0], csvs[1], folder, "ONE.csv", gdal)
+	assert numpy.array_equal(gdal.read_table(os.path.join(folder, "ONE.csv")), gdal.read_table(outputs[1]))
+
+
+def test_main_fields_matches_reclass_array(tmp_path):
+	pytest.importorskip("arcpy")
+	import io_backend
+
+	io = io_backend.get_backend("arcpy")
+	folder = str(tmp_path)
+	table = os.path.join(folder, "CAML_1990.dbf")
+	csv_file = write_csv(os.path.join(folder, "RECLASS.csv"), SCHEMES[0])
+	io.write_table(AREA[["WELLID", "VALUE_1", "VALUE_3", "VALUE_9", "VALUE_12"]], table)
+	caml_area_reclass.main_fields(table, csv_file, folder, "FIELDS.dbf")
+	caml_area_reclass.main(table, csv_file, folder, "ARRAYS.dbf", io)
+
+	fields = io.read_table(os.path.join(folder, "FIELDS.dbf"))
+	arrays = io.read_table(os.path.join(folder, "ARRAYS.dbf"))
+	for field in arrays.dtype.names:
+		numpy.testing.assert_allclose(fields[field], arrays[field], err_msg=field)
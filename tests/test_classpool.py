@@ -0,0 +1,99 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_classpool.py
+# Purpose: the pieces of the color classes run on the pool of processes and merged from their zone_<n>.dbf tables
+#          against the serial run of one table per color class, with the numpy zonal engine doing the work of the
+#          Spatial Analyst tool in each piece
+# ---------------------------------------------------------------------------------------------------
+
+import glob
+import os
+
+import numpy
+import pytest
+
+import bufferoverlaps
+import classpool
+import graphcoloring
+import io_backend
+import zonal_engine
+from synthetic import write_raster
+
+RADIUS = 260.0
+CLASSES = [1, 2, 3, 4]
+
+
+def tabulate_piece(job):
+	"""worker: tabulated area of the circles of one piece written to its zone_<n>.dbf, like run_piece"""
+	ids, x, y, raster, table = job
+	values, grid, nodata = zonal_engine.read_raster(raster)
+	coverage = zonal_engine.rasterize_circles(grid, numpy.asarray(ids), x, y, RADIUS)
+	io_backend.get_backend("gdal").write_table(zonal_engine.tabulate_area(coverage, values, nodata, "WELLID",
+	                                                                      classes=CLASSES), table)
+	return table, ""
+
+
+def merge(folder):
+	"""the zone* tables of the folder in one table sorted by id (ListTables("zone*") and Merge)"""
+	io = io_backend.get_backend("gdal")
+	tables = [io.read_table(table) for table in sorted(glob.glob(os.path.join(folder, "zone*.dbf")))]
+	merged = numpy.concatenate(tables)
+	return merged[numpy.argsort(merged["WELLID"], kind="mergesort")]
+
+
+@pytest.fixture
+def circles(tmp_path, gdal):
+	random = numpy.random.RandomState(3)
+	fids = numpy.arange(1, 121)
+	x, y = random.uniform(300, 4700, fids.size), random.uniform(300, 3700, fids.size)
+	classes = random.choice([0] + CLASSES, (40, 50)).astype(numpy.int16)
+	raster = write_raster(str(tmp_path / "classes.tif"), classes, 0.0, 4000.0, 100.0, 0)
+	return fids, x, y, raster
+
+
+def test_pool_merge_matches_serial_run(tmp_path, circles):
+	fids, x, y, raster = circles
+	src, nbr = bufferoverlaps.circle_overlaps(fids, x, y, RADIUS)
+	classes = graphcoloring.color_classes(fids, src, nbr)[0]
+	position = dict((fid, i) for i, fid in enumerate(fids.tolist()))
+
+	def job(ids, folder, index):
+		rows = [position[fid] for fid in ids]
+		return ids, x[rows], y[rows], raster, os.path.join(folder, "zone_%d.dbf" % index)
+
+	serial, pool = str(tmp_path / "serial"), str(tmp_path / "pool")
+	os.mkdir(serial)
+	os.mkdir(pool)
+	for index, cl in enumerate(classes):
+		tabulate_piece(job(sorted(classes[cl]), serial, index))
+
+	pieces = classpool.split_classes(classes, fids, x, y, 12)  # the large classes are tiled
+	assert len(pieces) > len(classes)
+	assert sorted(fid for piece in pieces for fid in piece) == fids.tolist()
+	overlapping = set(zip(src.tolist(), nbr.tolist()))
+	for piece in pieces:  # the zones of a piece never overlap
+		assert not any((a, b) in overlapping for a in piece for b in piece)
+	jobs = [job(ids, pool, index) for index, ids in enumerate(pieces)]
+	results = classpool.run(jobs, 3, tabulate_piece)
+	assert [table for table, messages in results] == [j[-1] for j in jobs]
+
+	merged, expected = merge(pool), merge(serial)
+	assert merged["WELLID"].tolist() == fids.tolist()
+	assert merged.dtype == expected.dtype
+	for field in expected.dtype.names:
+		assert numpy.array_equal(merged[field], expected[field])
+
+
+def test_worker_executable(monkeypatch, tmp_path):
+	monkeypatch.setattr(classpool.os, "name", "posix")
+	monkeypatch.setattr(classpool.sys, "executable", "/opt/arcgis/bin/ArcGISPro")
+	assert classpool.worker_executable() is None
+
+	monkeypatch.setattr(classpool.os, "name", "nt")
+	monkeypatch.setattr(classpool.sys, "exec_prefix", str(tmp_path))
+	assert classpool.worker_executable() is None
+	(tmp_path / "python.exe").write_text(u"")
+	assert classpool.worker_executable() == os.path.join(str(tmp_path), "python.exe")
+	(tmp_path / "pythonw.exe").write_text(u"")
+	assert classpool.worker_executable() == os.path.join(str(tmp_path), "pythonw.exe")
+	monkeypatch.setattr(classpool.sys, "executable", os.path.join(str(tmp_path), "python.exe"))
+	assert classpool.worker_executable() is None
@@ -0,0 +1,67 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_coverage_cache.py
+# Purpose: round trip of buffer coverages through the on disk cache, eviction and clearing of the cache folder
+# ---------------------------------------------------------------------------------------------------
+
+import os
+
+import numpy
+import pytest
+
+import coverage_cache
+import zonal_engine
+
+
+def circle_coverage(x=500.0):
+	grid = zonal_engine.RasterGrid(0.0, 1000.0, 10.0, 10.0, 100, 100, crs="EPSG:3310")
+	return zonal_engine.rasterize_circles(grid, numpy.array([1, 2]), numpy.array([x, x + 70.0]),
+	                                      numpy.array([400.0, 400.0]), 120.0, supersample=4)
+
+
+def test_round_trip(tmp_path):
+	cache = coverage_cache.CoverageCache(str(tmp_path))
+	coverage = circle_coverage()
+	cache.put("a" * 40, coverage)
+	cached = cache.get("a" * 40)
+	assert cached.grid == coverage.grid and cached.grid.crs == coverage.grid.crs
+	for name in coverage_cache.ARRAYS:
+		assert numpy.array_equal(getattr(cached, name), getattr(coverage, name))
+
+	values = numpy.random.RandomState(0).uniform(size=coverage.grid.shape)
+	assert numpy.array_equal(zonal_engine.zonal_statistics(cached, values), zonal_engine.zonal_statistics(coverage, values))
+	assert cache.get("b" * 40) is None
+
+
+def test_least_recently_used_evicted(tmp_path):
+	cache = coverage_cache.CoverageCache(str(tmp_path))
+	cache.put("old", circle_coverage(300.0))
+	cache.put("new", circle_coverage(500.0))
+	size = cache.entries()[-1][1]
+	os.utime(os.path.join(str(tmp_path), "old"), (1, 1))
+	cache.max_bytes = 2.5 * size
+	cache.put("newest", circle_coverage(600.0))
+	assert sorted(key for key, size, used in cache.entries()) == ["new", "newest"]
+
+
+def test_clear_removes_only_entries(tmp_path):
+	cache = coverage_cache.CoverageCache(str(tmp_path))
+	cache.put("a" * 40, circle_coverage())
+	os.mkdir(os.path.join(str(tmp_path), "tmp_leftover"))
+	os.mkdir(os.path.join(str(tmp_path), "results"))
+	with open(os.path.join(str(tmp_path), "notes.txt"), "w") as f:
+		f.write("keep")
+
+	cache.invalidate("results")  # not an entry
+	cache.invalidate()
+	assert sorted(os.listdir(str(tmp_path))) == ["notes.txt", "results"]
+
+
+def test_clear_refuses_other_folders(tmp_path):
+	os.mkdir(os.path.join(str(tmp_path), "wells"))
+	with open(os.path.join(str(tmp_path), "wells", "points.shp"), "w") as f:
+		f.write("data")
+	cache = coverage_cache.CoverageCache(str(tmp_path))
+	with pytest.raises(ValueError):
+		cache.invalidate()
+	assert os.path.exists(os.path.join(str(tmp_path), "wells", "points.shp"))
+	coverage_cache.CoverageCache(str(tmp_path / "empty")).invalidate()  # an empty cache is fine
@@ -0,0 +1,162 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_cvhm_engine.py
+# Purpose: the KD-tree CVHM texture of the wells against a brute force mean over every centroid within the search
+#          radius, on a synthetic rotated grid of CVHM cell centroids with null values
+# ---------------------------------------------------------------------------------------------------
+
+import math
+
+import numpy
+import pytest
+
+import coverage_cache
+import cvhm_engine
+from synthetic import write_features
+
+ROTATION = 0.3
+DEPTHS = ["PC_D25", "PC_D75", "PC_D125", "PC_D175"]
+RADIUS = 2000.0
+
+
+def centroid_grid(rows=12, cols=15):
+	"""centroids of a grid of CVHM cells rotated along the valley"""
+	row, col = [a.ravel().astype(numpy.float64) for a in numpy.mgrid[0:rows, 0:cols]]
+	u, v = (col + 0.5) * cvhm_engine.CVHM_CELL, (row + 0.5) * cvhm_engine.CVHM_CELL
+	return (-150000.0 + u * math.cos(ROTATION) - v * math.sin(ROTATION),
+	        20000.0 + u * math.sin(ROTATION) + v * math.cos(ROTATION))
+
+
+@pytest.fixture
+def datasets(tmp_path):
+	random = numpy.random.RandomState(3)
+	cx, cy = centroid_grid()
+	values = random.uniform(0, 100, (cx.size, len(DEPTHS)))
+	values[random.uniform(size=values.shape) < 0.1] = numpy.nan
+	values[:20, 2] = numpy.nan  # a corner without PC_D125
+	properties = dict((depth, [None if numpy.isnan(v) else float(v) for v in values[:, i]])
+	                  for i, depth in enumerate(DEPTHS))
+	centroids = write_features(str(tmp_path / "centroids.shp"), "Point",
+	                           [{"type": "Point", "coordinates": (a, b)} for a, b in zip(cx, cy)], properties)
+
+	# wells over the grid and a few far outside of it
+	x = numpy.concatenate((random.uniform(cx.min(), cx.max(), 150), [cx.min() - 20000.0]))
+	y = numpy.concatenate((random.uniform(cy.min(), cy.max(), 150), [cy.min()]))
+	ids = numpy.arange(1, x.size + 1)
+	wells = write_features(str(tmp_path / "wells.shp"), "Point",
+	                       [{"type": "Point", "coordinates": (a, b)} for a, b in zip(x, y)], {"WELLID": ids.tolist()})
+	return {"centroids": centroids, "wells": wells, "cx": cx, "cy": cy, "values": values, "x": x, "y": y, "ids": ids}
+
+
+def brute_force_mean(cx, cy, values, x, y, radius):
+	near = numpy.hypot(cx[None, :] - x[:, None], cy[None, :] - y[:, None]) <= radius
+	means = numpy.full((x.size, values.shape[1]), numpy.nan)
+	for point in range(x.size):
+		for column in range(values.shape[1]):
+			cells = values[near[point], column]
+			cells = cells[~numpy.isnan(cells)]
+			if cells.size:
+				means[point, column] = cells.mean()
+	return means, near.any(axis=1)
+
+
+def test_neighbor_pairs_match_brute_force(monkeypatch):
+	random = numpy.random.RandomState(4)
+	cx, cy = random.uniform(0, 30000, (2, 800))
+	x, y = random.uniform(-2000, 32000, (2, 300))
+	radius = random.uniform(500, 4000, 300)
+	near = numpy.hypot(cx[None, :] - x[:, None], cy[None, :] - y[:, None]) <= radius[:, None]
+	expected = numpy.nonzero(near)
+
+	points, centroids = cvhm_engine.neighbor_pairs(cx, cy, x, y, radius)
+	assert numpy.array_equal(points, expected[0]) and numpy.array_equal(centroids, expected[1])
+	# the square bins without scipy give the same pairs
+	monkeypatch.setattr(cvhm_engine, "cKDTree", None)
+	points, centroids = cvhm_engine.neighbor_pairs(cx, cy, x, y, radius)
+	assert numpy.array_equal(points, expected[0]) and numpy.array_equal(centroids, expected[1])
+
+
+def test_cvhm_texture_matches_brute_force(gdal, datasets):
+	table = cvhm_engine.cvhm_texture(gdal, datasets["wells"], datasets["centroids"], "WELLID", DEPTHS,
+	                                 "%g Meters" % RADIUS)
+	means, found = brute_force_mean(datasets["cx"], datasets["cy"], datasets["values"], datasets["x"], datasets["y"],
+	                                cvhm_engine.search_radius(RADIUS))
+	assert table["WELLID"].tolist() == datasets["ids"][found].tolist()
+	assert not found.all()
+	for column, depth in enumerate(DEPTHS):
+		assert numpy.allclose(table[depth], means[found, column], rtol=1e-12, equal_nan=True)
+	assert numpy.isnan(table["PC_D125"]).any()
+
+
+def test_cell_geometry_and_area_weights(datasets):
+	cx, cy = datasets["cx"], datasets["cy"]
+	size, rotation = cvhm_engine.cell_geometry(cx, cy)
+	assert size == pytest.approx(cvhm_engine.CVHM_CELL)
+	assert rotation == pytest.approx(ROTATION)
+
+	# cell area inside buffers well inside of the grid from points sampled every 10 m in the axes of the grid
+	middle = numpy.array([6 * 15 + 7, 5 * 15 + 4, 4 * 15 + 9])
+	x, y = cx[middle] + [0.0, 333.3, -701.0], cy[middle] + [0.0, 120.0, 650.5]
+	index = cvhm_engine.neighbor_index(cx, cy, x, y, RADIUS, area_weighted=True)
+	offsets = (numpy.arange(161) - 80) / 161.0 * size
+	u, v = [a.ravel() for a in numpy.meshgrid(offsets, offsets)]
+	for point in range(x.size):
+		centroids = index.centroids[index.indptr[point]:index.indptr[point + 1]]
+		weights = index.weights[index.indptr[point]:index.indptr[point + 1]]
+		for centroid, weight in zip(centroids, weights):
+			sx = cx[centroid] + u * math.cos(rotation) - v * math.sin(rotation)
+			sy = cy[centroid] + u * math.sin(rotation) + v * math.cos(rotation)
+			sampled = numpy.mean(numpy.hypot(sx - x[point], sy - y[point]) <= RADIUS) * size * size
+			assert abs(weight - sampled) < 0.02 * size * size
+		assert weights.sum() == pytest.approx(math.pi * RADIUS ** 2, rel=1e-9)
+
+
+def profile_mean(means, top, bottom, step=1.0):
+	"""mean of the layer means (50 ft layers from the surface) sampled every step feet from top to bottom, skipping
+	the layers without a value"""
+	samples = means[((numpy.arange(top, bottom, step) + step / 2) // 50).astype(int)]
+	samples = samples[~numpy.isnan(samples)]
+	return samples.mean() if samples.size else numpy.nan
+
+
+def test_depth_windows_match_profile_samples(gdal, datasets, tmp_path):
+	windows = ["0-200", "0-120", "60-130", "10-40"]
+	layers, found = brute_force_mean(datasets["cx"], datasets["cy"], datasets["values"], datasets["x"],
+	                                 datasets["y"], cvhm_engine.search_radius(RADIUS))
+	cache = coverage_cache.CoverageCache(str(tmp_path / "cache"))
+	for run in range(2):  # computed then from the cache
+		table = cvhm_engine.cvhm_texture(gdal, datasets["wells"], datasets["centroids"], "WELLID",
+		                                 distance="%g Meters" % RADIUS, windows=windows, cache=cache)
+		assert table.dtype.names[1:] == ("PC_0_200", "PC_0_120", "PC_60_130", "PC_10_40")
+		for field, window in zip(table.dtype.names[1:], windows):
+			top, bottom = cvhm_engine.parse_window(window)
+			expected = [profile_mean(means, top, bottom) for means in layers[found]]
+			assert numpy.allclose(table[field], expected, rtol=1e-12, equal_nan=True)
+	assert len(cache.entries()) == 2
+
+	with pytest.raises(ValueError):
+		cvhm_engine.parse_window("400-0")
+
+
+def test_vadose_texture_matches_profile_samples(gdal, datasets, tmp_path):
+	random = numpy.random.RandomState(5)
+	depth = random.uniform(-5, 80, datasets["ids"].size)  # meters, some above the surface or below the layers
+	depth[3] = numpy.nan
+	gw_table = write_features(str(tmp_path / "gwdepth.shp"), "Point",
+	                          [{"type": "Point", "coordinates": (a, b)} for a, b in zip(datasets["x"], datasets["y"])],
+	                          {"WELLID": datasets["ids"].tolist(),
+	                           "MEAN": [None if numpy.isnan(d) else float(d) for d in depth]})
+	table = cvhm_engine.vadose_texture(gdal, datasets["wells"], datasets["centroids"], gw_table, "WELLID",
+	                                   distance="%g Meters" % RADIUS)
+
+	layers, found = brute_force_mean(datasets["cx"], datasets["cy"], datasets["values"], datasets["x"],
+	                                 datasets["y"], cvhm_engine.search_radius(RADIUS))
+	feet = depth[found] / 0.3048
+	assert table["WELLID"].tolist() == datasets["ids"][found].tolist()
+	for row, means, bottom in zip(table, layers[found], feet):
+		if not bottom > 0:
+			assert numpy.isnan(row["PC_VADOSE"]) and numpy.isnan(row["COARSE_FT"])
+			continue
+		bottom = min(bottom, 200.0)
+		expected = profile_mean(means, 0.0, bottom, step=bottom / 20000.0)
+		assert row["PC_VADOSE"] == pytest.approx(expected, rel=1e-3, nan_ok=True)
+		assert row["COARSE_FT"] == pytest.approx(expected / 100.0 * bottom, rel=1e-3, nan_ok=True)
@@ -0,0 +1,94 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_distance_engine.py
+# Purpose: the segment index distance to the nearest line against a brute force loop over every segment of
+#          synthetic multi part flowlines, with the feature, stream order and measure along the line of the nearest
+#          point
+# ---------------------------------------------------------------------------------------------------
+
+import math
+
+import numpy
+import pytest
+
+import distance_engine
+import geometry
+from synthetic import write_features
+
+
+def random_lines(random, features=40):
+	"""random walks of very short and long steps, some features in several parts"""
+	lines = []
+	for feature in range(features):
+		parts = []
+		for part in range(1 + (feature % 3 == 0)):
+			steps = random.choice([5.0, 200.0, 3000.0], random.randint(1, 12), p=[0.2, 0.6, 0.2])
+			angles = random.uniform(0, 2 * math.pi) + numpy.cumsum(random.normal(0, 0.6, steps.size))
+			x = numpy.cumsum(numpy.concatenate(([random.uniform(0, 40000)], steps * numpy.cos(angles))))
+			y = numpy.cumsum(numpy.concatenate(([random.uniform(0, 40000)], steps * numpy.sin(angles))))
+			parts.append(numpy.column_stack((x, y)))
+		lines.append(parts)
+	return lines
+
+
+def brute_force_near(x, y, lines):
+	"""(distance, feature, measure along the feature) of the nearest point of the lines, one segment at a time"""
+	best = (numpy.inf, -1, 0.0)
+	for feature, parts in enumerate(lines):
+		measure = 0.0
+		for part in parts:
+			for (ax, ay), (bx, by) in zip(part[:-1], part[1:]):
+				length = math.hypot(bx - ax, by - ay)
+				t = min(max(((x - ax) * (bx - ax) + (y - ay) * (by - ay)) / (length * length), 0.0), 1.0) \
+					if length > 0 else 0.0
+				distance = math.hypot(x - ax - t * (bx - ax), y - ay - t * (by - ay))
+				if distance < best[0]:
+					best = (distance, feature, measure + t * length)
+				measure += length
+	return best
+
+
+@pytest.fixture
+def lines():
+	return random_lines(numpy.random.RandomState(6))
+
+
+def test_segment_index_matches_brute_force(lines, monkeypatch):
+	random = numpy.random.RandomState(7)
+	x, y = random.uniform(-10000, 50000, (2, 3000))
+	x0, y0, x1, y1, rows, measure = distance_engine.line_segments(lines)
+	expected = distance_engine.brute_force_nearest(x, y, x0, y0, x1, y1, batch_size=100)
+	for spacing in (None, 50.0, 5000.0):
+		index = distance_engine.SegmentIndex(x0, y0, x1, y1, spacing)
+		for k, batch_size in ((1, 1000), (8, distance_engine.BATCH_SIZE)):
+			distance, segment, fraction = index.nearest(x, y, k, batch_size)
+			assert numpy.array_equal(distance, expected[0])
+			# another segment only at the vertex shared with the segment of the brute force
+			tie = segment != expected[1]
+			s = segment[tie]
+			assert numpy.array_equal(geometry.segment_distance(x[tie], y[tie], x0[s], y0[s], x1[s], y1[s]),
+			                         expected[0][tie])
+	monkeypatch.setattr(distance_engine, "cKDTree", None)
+	distance, segment, fraction = distance_engine.SegmentIndex(x0, y0, x1, y1).nearest(x, y)
+	assert numpy.array_equal(distance, expected[0])
+
+
+def test_near_table_matches_brute_force(gdal, lines, tmp_path):
+	random = numpy.random.RandomState(8)
+	orders = random.randint(1, 8, len(lines))
+	geometries = [{"type": "MultiLineString", "coordinates": [part.tolist() for part in parts]} for parts in lines]
+	rivers = write_features(str(tmp_path / "rivers.shp"), "MultiLineString", geometries,
+	                        {"StreamOrde": orders.tolist()})
+	x, y = random.uniform(-5000, 45000, (2, 400))
+	ids = numpy.arange(100, 500)
+	wells = write_features(str(tmp_path / "wells.shp"), "Point",
+	                       [{"type": "Point", "coordinates": (a, b)} for a, b in zip(x, y)], {"WELLID": ids.tolist()})
+
+	table = distance_engine.near_table(gdal, wells, rivers, "WELLID")
+	assert table.dtype.names == ("WELLID", "NEAR_FID", "NEAR_DIST", "StreamOrde", "NEAR_ALONG")
+	assert table["WELLID"].tolist() == ids.tolist()
+	for row, a, b in zip(table, x, y):
+		distance, feature, along = brute_force_near(a, b, lines)
+		assert row["NEAR_DIST"] == pytest.approx(distance, rel=1e-12, abs=1e-9)
+		assert row["NEAR_FID"] == feature
+		assert row["StreamOrde"] == orders[feature]
+		assert row["NEAR_ALONG"] == pytest.approx(along, rel=1e-9, abs=1e-6)
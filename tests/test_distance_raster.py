@@ -0,0 +1,63 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_distance_raster.py
+# Purpose: the river distance sampled from the distance transform raster against the exact distance to the lines:
+#          within a cell diagonal, exact within the refine distance and outside of the raster, and the same from the
+#          cache
+# ---------------------------------------------------------------------------------------------------
+
+import math
+
+import numpy
+import pytest
+
+import coverage_cache
+import distance_engine
+import distance_raster
+from synthetic import write_features
+
+pytest.importorskip("scipy")
+
+CELL = 100.0
+LINES = [
+	[[(0.0, 0.0), (4000.0, 2500.0), (9000.0, 2600.0), (15000.0, 9000.0)]],
+	[[(2000.0, 12000.0), (2050.0, 6000.0)], [(6000.0, 14000.0), (12000.0, 13950.0), (12500.0, 13000.0)]],
+	[[(16000.0, -3000.0), (16030.0, -2990.0), (16040.0, -2500.0), (19000.0, 4000.0)]],
+]
+
+
+@pytest.fixture
+def datasets(tmp_path):
+	random = numpy.random.RandomState(9)
+	rivers = write_features(str(tmp_path / "rivers.shp"), "MultiLineString",
+	                        [{"type": "MultiLineString", "coordinates": parts} for parts in LINES])
+	x, y = random.uniform(-8000, 27000, (2, 2000))
+	x[:5] = [-40000.0, 60000.0, 5000.0, 4000.0, 2025.0]  # outside of the raster and on the lines
+	y[:5] = [0.0, 5000.0, 80000.0, 2500.0, 9000.0]
+	wells = write_features(str(tmp_path / "wells.shp"), "Point",
+	                       [{"type": "Point", "coordinates": (a, b)} for a, b in zip(x, y)],
+	                       {"WELLID": list(range(1, x.size + 1))})
+	lines = [[numpy.array(part) for part in parts] for parts in LINES]
+	exact = distance_engine.LineIndex(numpy.arange(len(lines)), lines).nearest(x, y)[0]
+	return {"rivers": rivers, "wells": wells, "exact": exact}
+
+
+def test_raster_distance_within_a_cell_diagonal(gdal, datasets):
+	table = distance_raster.raster_near_table(gdal, datasets["wells"], datasets["rivers"], "WELLID", CELL)
+	error = table["NEAR_DIST"] - datasets["exact"]
+	assert numpy.abs(error).max() <= math.hypot(CELL, CELL)
+	assert (error != 0).mean() > 0.5
+	# the points outside of the raster get the exact distance
+	assert numpy.array_equal(table["NEAR_DIST"][:3], datasets["exact"][:3])
+
+
+def test_refined_distance_exact_near_the_rivers(gdal, datasets, tmp_path):
+	cache = coverage_cache.CoverageCache(str(tmp_path / "cache"))
+	tables = [distance_raster.raster_near_table(gdal, datasets["wells"], datasets["rivers"], "WELLID", CELL,
+	                                            refine=2000.0, cache=cache) for run in range(2)]
+	near = datasets["exact"] < 2000.0
+	assert near.sum() > 100
+	assert numpy.array_equal(tables[0]["NEAR_DIST"][near], datasets["exact"][near])
+	assert numpy.abs(tables[0]["NEAR_DIST"] - datasets["exact"]).max() <= math.hypot(CELL, CELL)
+	# the second run samples the raster memory mapped from the cache
+	assert len(cache.entries()) == 1
+	assert numpy.array_equal(tables[0], tables[1])
@@ -0,0 +1,133 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_feature_distance.py
+# Purpose: the distance predictors of point, line and polygon layers in one pass against brute force distances
+#          from every well to every feature, with the loads joined from a csv table and in any batch size
+# ---------------------------------------------------------------------------------------------------
+
+import csv
+import math
+
+import numpy
+import pytest
+
+import feature_distance
+from synthetic import inside_rings, write_features
+
+RADIUS = 1500.0
+POWER = 2
+
+
+def square(x0, y0, x1, y1):
+	return [(x0, y0), (x0, y1), (x1, y1), (x1, y0), (x0, y0)]
+
+
+LINES = [
+	[[(0.0, 0.0), (3000.0, 800.0), (6000.0, 700.0)]],
+	[[(1000.0, 5000.0), (1010.0, 2000.0)], [(5000.0, 6000.0), (7000.0, 5900.0), (7100.0, 4000.0)]],
+]
+
+# a square with a hole, two parts and a polygon overlapping the first one
+POLYGONS = [
+	[[square(1000.0, 1000.0, 4000.0, 4000.0), square(2000.0, 2000.0, 3000.0, 3000.0)[::-1]]],
+	[[square(6000.0, 0.0, 6500.0, 500.0)], [square(-1500.0, 4500.0, -500.0, 6000.0)]],
+	[[square(3500.0, 3500.0, 5000.0, 4200.0)]],
+]
+LOADS = [10.0, 0.5, 3.0]
+
+
+def brute_segment_distance(x, y, parts):
+	"""distance from a point to the nearest segment of the parts"""
+	best = numpy.inf
+	for part in parts:
+		for (ax, ay), (bx, by) in zip(part[:-1], part[1:]):
+			length2 = (bx - ax) ** 2 + (by - ay) ** 2
+			t = min(max(((x - ax) * (bx - ax) + (y - ay) * (by - ay)) / length2, 0.0), 1.0)
+			best = min(best, math.hypot(x - ax - t * (bx - ax), y - ay - t * (by - ay)))
+	return best
+
+
+@pytest.fixture
+def datasets(tmp_path):
+	random = numpy.random.RandomState(10)
+	fx, fy = random.uniform(-1000, 8000, (2, 30))
+	facid = numpy.arange(500, 530)
+	dairy = write_features(str(tmp_path / "dairy.shp"), "Point",
+	                       [{"type": "Point", "coordinates": (a, b)} for a, b in zip(fx, fy)], {"FACID": facid.tolist()})
+	# facility 500 in two rows, 501 missing from the load table
+	loads = [(500, 20.0), (500, 5.5)] + [(f, float(random.uniform(1, 1000))) for f in facid[2:]]
+	load_table = str(tmp_path / "loads.csv")
+	with open(load_table, "w") as f:
+		writer = csv.writer(f)
+		writer.writerow(["FACID", "KgN_Y"])
+		writer.writerows(loads)
+	load = dict((f, 0.0) for f in facid)
+	for f, value in loads:
+		load[f] += value
+
+	canals = write_features(str(tmp_path / "canals.shp"), "MultiLineString",
+	                        [{"type": "MultiLineString", "coordinates": parts} for parts in LINES])
+	basins = write_features(str(tmp_path / "basins.shp"), "MultiPolygon",
+	                        [{"type": "MultiPolygon", "coordinates": parts} for parts in POLYGONS], {"LOAD": LOADS})
+	x, y = random.uniform(-3000, 9000, (2, 500))
+	x[:3], y[:3] = fx[:3], fy[:3]  # wells on top of facilities
+	wells = write_features(str(tmp_path / "wells.shp"), "Point",
+	                       [{"type": "Point", "coordinates": (a, b)} for a, b in zip(x, y)],
+	                       {"WELLID": list(range(1, x.size + 1))})
+	layers = [
+		{"name": "CANAL", "type": "line", "path": canals},
+		{"name": "DAIRY", "type": "point", "path": dairy, "id_field": "FACID", "load": load_table, "load_id": "FACID",
+		 "load_field": "KgN_Y"},
+		{"name": "BASIN", "type": "polygon", "path": basins, "load_field": "LOAD"},
+	]
+	return {"wells": wells, "layers": layers, "x": x, "y": y, "fx": fx, "fy": fy,
+	        "load": numpy.array([load[f] for f in facid])}
+
+
+def idw(load, distance):
+	return numpy.sum(load / numpy.maximum(distance, feature_distance.MIN_DISTANCE) ** POWER)
+
+
+@pytest.mark.parametrize("batch_size", [feature_distance.BATCH_SIZE, 37])
+def test_distance_predictors_match_brute_force(gdal, datasets, batch_size):
+	table = feature_distance.distance_predictors(gdal, datasets["wells"], datasets["layers"], "WELLID",
+	                                             "%g Meters" % RADIUS, POWER, batch_size=batch_size)
+	assert table.dtype.names == ("WELLID", "CANAL_DIST", "CANAL_N", "DAIRY_DIST", "DAIRY_N", "DAIRY_IDW",
+	                             "BASIN_DIST", "BASIN_N", "BASIN_IDW", "BASIN_IN")
+	for row, x, y in zip(table, datasets["x"], datasets["y"]):
+		canal = numpy.array([brute_segment_distance(x, y, parts) for parts in LINES])
+		assert row["CANAL_DIST"] == pytest.approx(canal.min(), rel=1e-12)
+		assert row["CANAL_N"] == numpy.sum(canal <= RADIUS)
+
+		dairy = numpy.hypot(datasets["fx"] - x, datasets["fy"] - y)
+		near = dairy <= RADIUS
+		assert row["DAIRY_DIST"] == pytest.approx(dairy.min(), rel=1e-12, abs=1e-9)
+		assert row["DAIRY_N"] == near.sum()
+		assert row["DAIRY_IDW"] == pytest.approx(idw(datasets["load"][near], dairy[near]), rel=1e-12)
+
+		boundary = numpy.array([brute_segment_distance(x, y, [ring for part in parts for ring in part])
+		                        for parts in POLYGONS])
+		inside = numpy.array([any(inside_rings(x, y, part) for part in parts) for parts in POLYGONS])
+		near = inside | (boundary <= RADIUS)
+		assert row["BASIN_DIST"] == pytest.approx(boundary.min(), rel=1e-12)
+		assert row["BASIN_N"] == near.sum()
+		assert row["BASIN_IDW"] == pytest.approx(idw(numpy.array(LOADS)[near],
+		                                             numpy.where(inside, 0.0, boundary)[near]), rel=1e-12)
+		assert row["BASIN_IN"] == inside.any()
+
+
+def test_layers_need_different_names(gdal, datasets):
+	layers = datasets["layers"][:1] * 2
+	with pytest.raises(ValueError):
+		feature_distance.distance_predictors(gdal, datasets["wells"], layers, "WELLID")
+
+
+def test_same_predictors_without_scipy(gdal, datasets, monkeypatch):
+	table = feature_distance.distance_predictors(gdal, datasets["wells"], datasets["layers"], "WELLID",
+	                                             "%g Meters" % RADIUS, POWER)
+	assert table["BASIN_IN"].sum() > 20 and (table["DAIRY_N"] > 1).sum() > 50 and (table["CANAL_N"] == 2).any()
+	monkeypatch.setattr(feature_distance, "cKDTree", None)
+	monkeypatch.setattr(feature_distance.distance_engine, "cKDTree", None)
+	fallback = feature_distance.distance_predictors(gdal, datasets["wells"], datasets["layers"], "WELLID",
+	                                                "%g Meters" % RADIUS, POWER)
+	for name in table.dtype.names:
+		assert numpy.allclose(fallback[name], table[name], rtol=1e-12, atol=1e-9)
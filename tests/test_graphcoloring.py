@@ -0,0 +1,106 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_graphcoloring.py
+# Purpose: the DSATUR and lattice colorings of the overlap graph of zones against a brute force check that no two
+#          overlapping zones share a class
+# ---------------------------------------------------------------------------------------------------
+
+import numpy
+import pytest
+
+import graphcoloring
+
+
+def overlapping_pairs(x, y, radius):
+	"""ids of every pair of circles closer than 2r, in both directions like PolygonNeighbors"""
+	i, j = numpy.nonzero(numpy.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :]) < 2 * radius)
+	keep = i != j
+	return i[keep], j[keep]
+
+
+def assert_valid(classes, fids, src, nbr):
+	color = {}
+	for c, members in classes.items():
+		for fid in members:
+			assert fid not in color
+			color[fid] = c
+	assert sorted(color) == sorted(fids)
+	for a, b in zip(src, nbr):
+		assert color[a] != color[b]
+
+
+def test_dsatur_random_buffers():
+	random = numpy.random.RandomState(1)
+	x, y = random.uniform(0, 5000, (2, 400))
+	fids = random.permutation(numpy.arange(1000, 1400))
+	i, j = overlapping_pairs(x, y, 150.0)
+	classes, method = graphcoloring.color_classes(fids, fids[i], fids[j])
+	assert method == "DSATUR"
+	assert_valid(classes, fids.tolist(), fids[i], fids[j])
+	# deterministic, whatever the order of the pairs
+	order = random.permutation(i.size)
+	assert graphcoloring.color_classes(fids, fids[i][order], fids[j][order]) == (classes, method)
+
+
+def test_dsatur_optimal_on_known_graphs():
+	# an odd cycle needs 3 colors, a complete graph of 5 nodes 5 and a bipartite graph 2
+	cycle = numpy.arange(7)
+	indptr, indices = graphcoloring.adjacency(cycle, cycle, (cycle + 1) % 7)
+	assert graphcoloring.dsatur(7, indptr, indices).max() == 3
+	a, b = numpy.nonzero(~numpy.eye(5, dtype=bool))
+	indptr, indices = graphcoloring.adjacency(numpy.arange(5), a, b)
+	assert sorted(graphcoloring.dsatur(5, indptr, indices)) == [1, 2, 3, 4, 5]
+	left, right = numpy.repeat(numpy.arange(4), 4), numpy.tile(numpy.arange(4, 8), 4)
+	indptr, indices = graphcoloring.adjacency(numpy.arange(8), left, right)
+	assert graphcoloring.dsatur(8, indptr, indices).max() == 2
+
+
+def test_lattice_coloring():
+	col, row = [a.ravel() for a in numpy.mgrid[0:20, 0:30]]
+	spacing = 250.0
+	x, y = 6000.0 + col * spacing, 4000.0 + row * spacing
+	fids = numpy.arange(1, x.size + 1)
+	for radius in (100.0, 240.0, 500.0, 700.0):
+		indices = graphcoloring.lattice_indices(x, y)
+		assert numpy.array_equal(indices[0], col) and numpy.array_equal(indices[1], row)
+		assert indices[2] == spacing
+		i, j = overlapping_pairs(x, y, radius)
+		classes, method = graphcoloring.color_classes(fids, fids[i], fids[j], indices + (radius,))
+		assert_valid(classes, fids.tolist(), fids[i], fids[j])
+		k, optimal = graphcoloring.lattice_size(spacing, radius)
+		if optimal:
+			assert method == "lattice" and len(classes) == k * k
+		else:  # the fewest colors of the lattice and DSATUR
+			assert len(classes) <= k * k
+
+
+def test_equal_radius_and_lattice_detection():
+	r = numpy.array([100.0, 100.0, 100.0])
+	assert graphcoloring.equal_radius(2 * r, 2 * r, numpy.pi * r * r * 0.999) == 100.0
+	assert graphcoloring.equal_radius(2 * r, 2 * r, [numpy.pi * 1e4, numpy.pi * 1e4, 4e4]) is None
+	assert graphcoloring.equal_radius([200.0, 300.0], [200.0, 300.0], numpy.pi * numpy.array([1e4, 2.25e4])) is None
+	assert graphcoloring.lattice_indices([0.0, 100.0, 250.0], [0.0, 0.0, 0.0]) is None
+
+
+def test_lattice_detected_on_noisy_centroids():
+	# centroids of densified buffer circles are off the grid by float noise
+	random = numpy.random.RandomState(2)
+	col, row = [a.ravel() for a in numpy.mgrid[0:40, 0:25]]
+	keep = random.uniform(size=col.size) > 0.2  # grid clipped to a boundary, columns and rows with gaps
+	col, row = col[keep], row[keep]
+	for noise in (1e-7, 1e-3):
+		x = 1.2e6 + col * 250.0 + random.normal(0, noise, col.size)
+		y = 4.1e6 + row * 250.0 + random.normal(0, noise, col.size)
+		indices = graphcoloring.lattice_indices(x, y)
+		assert indices is not None
+		assert numpy.array_equal(indices[0], col - col.min()) and numpy.array_equal(indices[1], row - row.min())
+		assert indices[2] == pytest.approx(250.0, abs=0.01)
+
+		fids = numpy.arange(col.size)
+		i, j = overlapping_pairs(x, y, 240.0)
+		classes, method = graphcoloring.color_classes(fids, fids[i], fids[j], indices + (240.0,))
+		assert method == "lattice" and len(classes) == 4
+		assert_valid(classes, fids.tolist(), fids[i], fids[j])
+
+	# a point off the grid by more than the tolerance
+	x[5] += 20.0
+	assert graphcoloring.lattice_indices(x, y) is None
@@ -0,0 +1,106 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_io_backend.py
+# Purpose: round trips of parquet and arrow tables, the dbf field name check and the circles tables
+# ---------------------------------------------------------------------------------------------------
+
+import os
+
+import numpy
+import pytest
+
+import io_backend
+from synthetic import CRS
+
+nan = numpy.nan
+
+
+def typed_table():
+	return numpy.array([(1, 7, 0.5, "a", True), (2, -3, nan, "bc", False), (2 ** 40, 0, -1.5, "", True)],
+	                   dtype=[("WELLID", "i8"), ("VALUE", "i4"), ("MEAN", "f8"), ("NAME", "U2"), ("FLAG", "?")])
+
+
+@pytest.mark.parametrize("extension", [".parquet", ".arrow", ".feather"])
+def test_columnar_round_trip(tmp_path, extension):
+	pytest.importorskip("pyarrow")
+	table = str(tmp_path / ("table" + extension))
+	array = typed_table()
+	io_backend.write_columnar(array, table)
+	assert io_backend.columnar_fields(table) == list(array.dtype.names)
+
+	read = io_backend.read_columnar(table)
+	assert read.dtype == array.dtype
+	for field in array.dtype.names:
+		numpy.testing.assert_array_equal(read[field], array[field], err_msg=field)  # nan equal to nan
+	read = io_backend.read_columnar(table, ["MEAN", "WELLID"])
+	assert read.dtype.names == ("MEAN", "WELLID")
+	assert numpy.isnan(read["MEAN"][1])
+
+
+@pytest.mark.parametrize("extension", [".parquet", ".arrow"])
+def test_columnar_nulls(tmp_path, extension):
+	pyarrow = pytest.importorskip("pyarrow")
+	import pyarrow.parquet
+
+	table = str(tmp_path / ("nulls" + extension))
+	arrow_table = pyarrow.table({"ID": pyarrow.array([1, None, 3], pyarrow.int64()),
+	                             "NAME": pyarrow.array(["x", None, "z"])})
+	if extension == ".parquet":
+		pyarrow.parquet.write_table(arrow_table, table)
+	else:
+		with pyarrow.OSFile(table, "wb") as sink:
+			with pyarrow.ipc.new_file(sink, arrow_table.schema) as writer:
+				writer.write_table(arrow_table)
+
+	read = io_backend.read_columnar(table)
+	assert read["ID"].dtype == numpy.int64 and read["ID"].tolist() == [1, 0, 3]
+	assert read["NAME"].tolist() == ["x", "", "z"]
+	read = io_backend.read_columnar(table, null_value=nan)
+	assert read["ID"].dtype == numpy.float64
+	numpy.testing.assert_array_equal(read["ID"], [1.0, nan, 3.0])
+
+
+def test_dbf_fields_checked():
+	array = numpy.zeros(1, dtype=[("WELLID", "i8"), ("VALUE_212910", "f8"), ("VALUE_212911", "f8"), ("VALUE_3", "f8")])
+	with pytest.raises(ValueError, match="VALUE_212910, VALUE_212911"):
+		io_backend.check_dbf_fields(array, "area.dbf")
+	io_backend.check_dbf_fields(array, "area.parquet")
+	io_backend.check_dbf_fields(array[["WELLID", "VALUE_212910", "VALUE_3"]], "area.dbf")
+
+
+def test_dbf_round_trip(tmp_path, gdal):
+	table = str(tmp_path / "table.dbf")
+	array = typed_table()[["WELLID", "VALUE", "MEAN", "NAME"]]
+	gdal.write_table(array, table)
+	assert io_backend.dbf_fields(table) == gdal.table_fields(table) == list(array.dtype.names)
+	read = gdal.read_table(table, null_value=nan)
+	assert read["WELLID"].tolist() == array["WELLID"].tolist()
+	assert read["NAME"].tolist() == array["NAME"].tolist()
+	numpy.testing.assert_array_equal(read["MEAN"], array["MEAN"])
+
+	with pytest.raises(ValueError, match="the same in a dbf"):
+		gdal.write_table(numpy.zeros(1, dtype=[("VALUE_212910", "f8"), ("VALUE_212911", "f8")]), table)
+
+
+@pytest.mark.parametrize("extension", [".dbf", ".csv", ".parquet"])
+def test_circles(tmp_path, gdal, extension):
+	if extension == ".parquet":
+		pytest.importorskip("pyarrow")
+	table = str(tmp_path / ("circles" + extension))
+	ids, x, y = numpy.array([3, 1, 2]), numpy.array([100.0, 250.5, 400.0]), numpy.array([-50.0, 0.0, 75.25])
+	io_backend.write_circles(gdal, table, "WELLID", ids, x, y, 300.0, gdal.fiona.crs.CRS.from_string(CRS).to_wkt())
+	assert gdal.table_fields(table) == ["WELLID"] + io_backend.CIRCLE_FIELDS
+
+	read_ids, read_x, read_y, radius = io_backend.read_circles(gdal, table, "WELLID")
+	assert read_ids.tolist() == ids.tolist()
+	numpy.testing.assert_allclose(read_x, x)
+	numpy.testing.assert_allclose(read_y, y)
+	assert radius.tolist() == [300.0] * 3
+	assert io_backend.read_circles(gdal, table, "GRIDID") is None
+
+	# centers projected to another spatial reference and back
+	wgs84 = gdal.fiona.crs.CRS.from_epsg(4326).to_wkt()
+	lon, lat = io_backend.read_circles(gdal, table, "WELLID", wgs84)[1:3]
+	assert numpy.all(numpy.abs(lon) > 100) and numpy.all(lat > 30)
+	back_x, back_y = gdal.project_points(lon, lat, wgs84, open(os.path.splitext(table)[0] + ".prj").read())
+	numpy.testing.assert_allclose(back_x, x, atol=1e-4)
+	numpy.testing.assert_allclose(back_y, y, atol=1e-4)
@@ -0,0 +1,135 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_join_engine.py
+# Purpose: join of small synthetic result tables against a hand built table of predictors, the id index and the dbf
+#          reader
+# ---------------------------------------------------------------------------------------------------
+
+import json
+import os
+from collections import OrderedDict
+
+import numpy
+import pytest
+
+import io_backend
+import join_engine
+from synthetic import write_features
+
+nan = numpy.nan
+
+
+def write_table(folder, name, properties):
+	"""dbf table of (field, values) pairs"""
+	return write_features(os.path.join(folder, name + ".dbf"), "None", [None] * len(properties[0][1]),
+	                      OrderedDict(properties))
+
+
+def spec(tables):
+	return OrderedDict([("id_field", "WELLID"), ("target", {"table": "points", "fields": ["WELL_NA"]}),
+	                    ("tables", tables)])
+
+
+@pytest.fixture
+def folder(tmp_path, gdal):
+	folder = str(tmp_path)
+	write_table(folder, "points", [("WELLID", [1, 2, 3, 4, 5, 6]), ("WELL_NA", ["a", "b", "c", "d", "e", "f"])])
+	# well 9 is not a point, wells 4 and 6 are missing
+	write_table(folder, "RIVER_DISTANCE", [("WELLID", [5, 3, 9, 1, 2]), ("NEAR_DIST", [50.0, 30.0, 90.0, 10.0, 20.0])])
+	# float ids with a null id, like a table of the R scripts saved by excel
+	write_table(folder, "CAML_2005_RECLASS", [("WELLID", [4.0, 1.0, None, 2.0]), ("GROUP_1", [1.0, 2.0, 3.0, 4.0]),
+	                                          ("GROUP_2", [3.0, 6.0, 5.0, None]), ("GROUP_AREA", [4.0, 8.0, 8.0, 8.0])])
+	gdal.write_table(numpy.array([(6, 0.6), (2, 0.2)], dtype=[("WELLID", "i8"), ("MEAN", "f8")]),
+	                 os.path.join(folder, "NDEP.csv"))
+	return folder
+
+
+TABLES = [
+	{"table": "RIVER_DISTANCE", "fields": {"NEAR_DIST": "RIVER_DISTANCE_m"}},
+	{"table": "CAML_2005_RECLASS", "divide_by": "GROUP_AREA",
+	 "fields": OrderedDict([("GROUP_1", "CAML2005_natural"), ("GROUP_2", "CAML2005_urban")])},
+	{"table": "NDEP", "fields": {"MEAN": "NDEP_mean"}},
+]
+
+
+def test_join_matches_hand_built_table(folder, gdal):
+	spec_file = os.path.join(folder, "spec.json")
+	with open(spec_file, "w") as f:
+		json.dump(spec(TABLES), f)
+	joined = join_engine.main(spec_file, folder, os.path.join(folder, "joined.csv"), backend=gdal)
+
+	# the fields of the points, then the renamed fields of every table in the order of the spec (join_dbfs.R)
+	expected = numpy.array([
+		(1, "a", 10.0, 0.25, 0.75, nan),
+		(2, "b", 20.0, 0.5, nan, 0.2),
+		(3, "c", 30.0, nan, nan, nan),
+		(4, "d", nan, 0.25, 0.75, nan),
+		(5, "e", 50.0, nan, nan, nan),
+		(6, "f", nan, nan, nan, 0.6),
+	], dtype=[("WELLID", "i8"), ("WELL_NA", "U1"), ("RIVER_DISTANCE_m", "f8"), ("CAML2005_natural", "f8"),
+	          ("CAML2005_urban", "f8"), ("NDEP_mean", "f8")])
+	assert joined.dtype.names == expected.dtype.names
+	for field in expected.dtype.names:
+		if expected.dtype[field].kind == "f":
+			numpy.testing.assert_array_equal(joined[field], expected[field], err_msg=field)
+		else:
+			assert joined[field].tolist() == expected[field].tolist()
+
+	written = gdal.read_table(os.path.join(folder, "joined.csv"), null_value=nan)
+	assert written.dtype.names == expected.dtype.names
+	numpy.testing.assert_allclose(written["CAML2005_natural"], expected["CAML2005_natural"])
+
+
+def test_duplicate_names_and_ids_rejected(folder, gdal):
+	resolve = lambda name: join_engine.find_table(folder, name)
+	tables = TABLES + [{"table": "NDEP", "fields": {"MEAN": "RIVER_DISTANCE_m"}}]
+	with pytest.raises(ValueError, match="RIVER_DISTANCE_m"):
+		join_engine.join_tables(spec(tables), resolve, gdal)
+
+	write_table(folder, "TWICE", [("WELLID", [1, 2, 1]), ("MEAN", [1.0, 2.0, 3.0])])
+	with pytest.raises(ValueError, match="more than one row"):
+		join_engine.join_tables(spec([{"table": "TWICE", "fields": {"MEAN": "twice"}}]), resolve, gdal)
+
+	write_table(folder, "PARTS", [("WELLID", [1.0, 2.5]), ("MEAN", [1.0, 2.0])])
+	with pytest.raises(ValueError, match="whole numbers"):
+		join_engine.join_tables(spec([{"table": "PARTS", "fields": {"MEAN": "parts"}}]), resolve, gdal)
+
+
+@pytest.mark.parametrize("scale", [1, 10 ** 9])  # lookup array and sorted ids
+def test_id_index(scale):
+	target = numpy.array([7, 3, 5, 1]) * scale
+	index = join_engine.IdIndex(target)
+	assert (index.lookup is None) == (scale > 1)
+	ids = numpy.array([1, 2, 3, 7, 8]) * scale
+	rows, table_rows = index.match(ids)
+	assert sorted(zip(rows.tolist(), table_rows.tolist())) == [(0, 3), (1, 2), (3, 0)]
+
+	# float ids: nan matches nothing and the rows are rows of the float ids
+	rows, table_rows = index.match(numpy.array([nan, 7.0, nan, 3.0]) * scale)
+	assert sorted(zip(rows.tolist(), table_rows.tolist())) == [(0, 1), (1, 3)]
+	with pytest.raises(ValueError, match="whole numbers"):
+		index.match(numpy.array([3.0 * scale, 12.7]))
+
+	rows, table_rows = join_engine.IdIndex(target.astype(str)).match(ids.astype(str))
+	assert sorted(zip(rows.tolist(), table_rows.tolist())) == [(0, 3), (1, 2), (3, 0)]
+
+
+def test_read_dbf(folder, gdal):
+	fiona = pytest.importorskip("fiona")
+	table = os.path.join(folder, "NULLS.dbf")
+	write_table(folder, "NULLS", [("ID", [1, 2, 3]), ("COUNT", [4.0, None, 6.0]), ("NAME", ["x", None, "zé"]),
+	                              ("VALUE", [0.5, -1.25, None])])
+	with fiona.open(table) as src:
+		rows = [feature["properties"] for feature in src]
+
+	array = io_backend.read_dbf(table, null_value=-1)
+	assert array.dtype.names == ("ID", "COUNT", "NAME", "VALUE")
+	assert array["ID"].dtype == numpy.int64
+	assert array["NAME"].tolist() == [row["NAME"] or "" for row in rows]
+	for field in ("COUNT", "VALUE"):
+		assert array[field].tolist() == [-1 if row[field] is None else row[field] for row in rows]
+
+	array = io_backend.read_dbf(table, ["VALUE", "ID"], null_value=nan)
+	assert array.dtype.names == ("VALUE", "ID")
+	numpy.testing.assert_array_equal(array["VALUE"], [0.5, -1.25, nan])
+	with pytest.raises(ValueError, match="MISSING"):
+		io_backend.read_dbf(table, ["MISSING"])
@@ -0,0 +1,176 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_pipeline.py
+# Purpose: the headless pipeline on a small synthetic build: the order of the steps, skipping the steps whose inputs
+#          did not change, the forced rerun and the incremental runs for changed points
+# ---------------------------------------------------------------------------------------------------
+
+import json
+import os
+
+import numpy
+import pytest
+
+import config
+import io_backend
+import pipeline
+import zonal_engine
+from synthetic import write_features, write_raster
+
+
+def write_spec(folder, steps):
+	path = os.path.join(str(folder), "pipeline.json")
+	with open(path, "w") as f:
+		json.dump({"workspace": "results", "id_field": "WELLID", "steps": steps}, f)
+	return path
+
+
+@pytest.fixture
+def build(gdal, tmp_path, monkeypatch):
+	monkeypatch.setattr(config, "coverage_cache", str(tmp_path / "cache"))
+	monkeypatch.setattr(config, "buffer_dist", "300 Meters")
+	random = numpy.random.RandomState(11)
+	write_raster(str(tmp_path / "ndep.tif"), random.uniform(0, 10, (60, 60)).astype(numpy.float32), 0.0, 6000.0, 100.0,
+	             -1.0)
+	write_raster(str(tmp_path / "landuse.tif"), random.choice([1, 2, 3], (60, 60)).astype(numpy.int16), 0.0, 6000.0,
+	             100.0, 0)
+	x, y = random.uniform(500, 5500, (2, 25))
+	write_points(str(tmp_path / "points.shp"), range(1, 26), x, y)
+	write_features(str(tmp_path / "rivers.shp"), "LineString",
+	               [{"type": "LineString", "coordinates": [(0.0, 1000.0), (3000.0, 2500.0), (6000.0, 2000.0)]}],
+	               {"StreamOrde": [3]})
+	steps = {
+		"features": {"tool": "join", "tables": ["@zonal", "@caml"]},
+		"zonal": {"tool": "zonal", "buffers": "@buffers", "layers": [["NDEP", "ndep.tif", "MEAN"]]},
+		"caml": {"tool": "caml", "buffers": "@buffers", "rasters": {"2005": "landuse.tif"}},
+		"buffers": {"tool": "buffer", "points": "points.shp"},
+	}
+	return write_spec(tmp_path, steps)
+
+
+def write_points(path, ids, x, y):
+	write_features(path, "Point", [{"type": "Point", "coordinates": p} for p in zip(x, y)], {"WELLID": list(ids)})
+
+
+def ran(capsys):
+	"""names of the steps run (not skipped) from the log"""
+	lines = capsys.readouterr().out.splitlines()
+	return sorted(set(line.split("[")[1].split("]")[0] for line in lines if "Done in" in line))
+
+
+def test_order_and_errors(tmp_path):
+	spec = write_spec(tmp_path, {
+		"join": {"tool": "join", "tables": ["@b", "@c"]},
+		"c": {"tool": "zonal", "buffers": "@a", "layers": []},
+		"b": {"tool": "caml", "buffers": "@a", "rasters": {}},
+		"a": {"tool": "buffer", "points": "points.shp"},
+	})
+	order = pipeline.Pipeline(spec, "gdal").order
+	assert order.index("a") < order.index("b") < order.index("join") and order.index("c") < order.index("join")
+
+	for steps in ({"a": {"tool": "zonal", "buffers": "@b"}, "b": {"tool": "zonal", "buffers": "@a"}},
+	              {"a": {"tool": "zonal", "buffers": "@missing"}},
+	              {"a": {"tool": "fishnet"}}):
+		with pytest.raises(ValueError):
+			pipeline.Pipeline(write_spec(tmp_path, steps), "gdal")
+
+
+def test_unchanged_steps_skipped(build, capsys, tmp_path):
+	outputs = pipeline.Pipeline(build, "gdal").run(workers=2)
+	assert ran(capsys) == ["buffers", "caml", "features", "zonal"]
+	features = outputs["features"][0]
+	first = open(features).read()
+
+	pipeline.Pipeline(build, "gdal").run()
+	assert ran(capsys) == []
+
+	# a new raster only reruns the steps that depend on it
+	write_raster(str(tmp_path / "ndep.tif"), numpy.full((60, 60), 2.5, dtype=numpy.float32), 0.0, 6000.0, 100.0, -1.0)
+	pipeline.Pipeline(build, "gdal").run()
+	assert ran(capsys) == ["features", "zonal"]
+	table = pipeline.io_backend.get_backend("gdal").read_table(features)
+	assert numpy.allclose(table["zonal_NDEP_MEAN"], 2.5)
+	assert open(features).read() != first
+
+	# and a config setting the buffers depend on reruns all of them
+	config.buffer_dist = "400 Meters"
+	pipeline.Pipeline(build, "gdal").run()
+	assert ran(capsys) == ["buffers", "caml", "features", "zonal"]
+
+
+def test_forced_rerun(build, capsys):
+	outputs = pipeline.Pipeline(build, "gdal").run()
+	capsys.readouterr()
+	table = pipeline.io_backend.get_backend("gdal").read_table(outputs["features"][0])
+	forced = pipeline.Pipeline(build, "gdal").run(force=True)
+	assert ran(capsys) == ["buffers", "caml", "features", "zonal"]
+	assert forced == outputs
+	assert numpy.array_equal(pipeline.io_backend.get_backend("gdal").read_table(forced["features"][0]), table)
+
+
+def test_changed_points():
+	previous = pipeline.point_snapshot(numpy.array([1, 2, 3, 4, 5]), [0.0, 1.0, 2.0, 3.0, 4.0], [0.0] * 5, 10.0)
+	ids = numpy.array([6, 5, 3, 2, 1])
+	current = pipeline.point_snapshot(ids, [9.0, 4.0, 2.5, 1.0, 0.0], [0.0] * 5, [10.0, 10.0, 10.0, 12.0, 10.0])
+	changed, deleted = pipeline.changed_points(previous, current)
+	assert sorted(changed) == [2, 3, 6]  # new, moved and a larger buffer
+	assert deleted == [4]
+	assert pipeline.changed_points(previous[:0], current) == (ids.tolist(), [])
+	assert pipeline.changed_points(previous, previous) == ([], [])
+
+
+def test_upsert_table():
+	old = numpy.zeros(4, dtype=[("WELLID", numpy.int32), ("MEAN", numpy.float32), ("OLD", numpy.float64)])
+	old["WELLID"], old["MEAN"], old["OLD"] = [4, 1, 2, 3], [4.0, 1.0, 2.0, 3.0], [40.0, 10.0, 20.0, 30.0]
+	rows = numpy.zeros(2, dtype=[("WELLID", numpy.int64), ("MEAN", numpy.float64), ("NEW", numpy.float64)])
+	rows["WELLID"], rows["MEAN"], rows["NEW"] = [5, 2], [5.5, 2.25], [0.5, 0.25]
+	table = zonal_engine.upsert_table(old, rows, [2, 3], "WELLID")
+	assert table.dtype.names == ("WELLID", "MEAN", "OLD", "NEW")
+	assert table.dtype["WELLID"] == numpy.int64 and table.dtype["MEAN"] == numpy.float64
+	assert table["WELLID"].tolist() == [1, 2, 4, 5]
+	assert table["MEAN"].tolist() == [1.0, 2.25, 4.0, 5.5]
+	assert numpy.array_equal(table["OLD"], [10.0, numpy.nan, 40.0, numpy.nan], equal_nan=True)
+	assert numpy.array_equal(table["NEW"], [numpy.nan, 0.25, numpy.nan, 0.5], equal_nan=True)
+	assert zonal_engine.upsert_table(old, rows, [2, 3], "WELLID", fill=0)["NEW"].tolist() == [0.0, 0.25, 0.0, 0.5]
+
+
+def read_sorted(path):
+	table = io_backend.get_backend("gdal").read_table(path, null_value=numpy.nan)
+	return table[numpy.argsort(table["WELLID"], kind="mergesort")]
+
+
+def test_incremental_runs_match_full_runs(build, capsys, tmp_path):
+	with open(build) as f:
+		spec = json.load(f)
+	spec["steps"]["river"] = {"tool": "river", "points": "points.shp", "rivers": "rivers.shp"}
+	spec["steps"]["features"]["tables"].append("@river")
+	for workspace in ("results", "full"):
+		with open(str(tmp_path / (workspace + ".json")), "w") as f:
+			json.dump(dict(spec, workspace=workspace), f)
+	incremental = str(tmp_path / "results.json")
+	pipeline.Pipeline(incremental, "gdal", incremental=True).run()
+	capsys.readouterr()
+
+	# one point moved, one deleted and one new, then only one more deleted
+	ids, x, y = io_backend.get_backend("gdal").read_points(str(tmp_path / "points.shp"), "WELLID")
+	x[2] += 150.0
+	keep = ids != 5
+	ids, x, y = numpy.append(ids[keep], 26), numpy.append(x[keep], 3000.0), numpy.append(y[keep], 2000.0)
+	for change in range(2):
+		write_points(str(tmp_path / "points.shp"), ids.tolist(), x, y)
+		outputs = pipeline.Pipeline(incremental, "gdal", incremental=True).run()
+		log = capsys.readouterr().out
+		if change == 0:
+			assert "Buffering 2 changed points" in log
+			assert log.count("Updating 2 changed and 1 deleted points") == 3  # caml, zonal and river
+		else:
+			assert log.count("Updating 0 changed and 1 deleted points") == 3
+		full = pipeline.Pipeline(str(tmp_path / "full.json"), "gdal").run(force=True)
+		capsys.readouterr()
+		for name in ("caml", "zonal", "river", "features"):
+			for table, expected in zip(outputs[name], full[name]):
+				table, expected = read_sorted(table), read_sorted(expected)
+				assert table.dtype.names == expected.dtype.names
+				assert table["WELLID"].tolist() == sorted(ids.tolist())
+				for field in table.dtype.names:
+					assert numpy.allclose(table[field], expected[field], rtol=1e-12, equal_nan=True), field
+		ids, x, y = ids[1:], x[1:], y[1:]
@@ -0,0 +1,98 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_predictor_grid.py
+# Purpose: the predictor grid points against brute force point in polygon and distance to the basin boundary, and
+#          the points and circles written by main
+# ---------------------------------------------------------------------------------------------------
+
+import os
+
+import numpy
+import pytest
+
+import geometry
+import io_backend
+import predictor_grid
+from synthetic import CRS, inside_rings, write_features
+
+SPACING = 250.0
+DISTANCE = 600.0
+
+
+def star(cx, cy, radius, points=9):
+	angles = numpy.linspace(2 * numpy.pi, 0, 2 * points, endpoint=False)
+	radii = numpy.tile([radius, radius * 0.45], points)
+	ring = numpy.column_stack((cx + radii * numpy.cos(angles), cy + radii * numpy.sin(angles)))
+	return numpy.vstack((ring, ring[:1])).tolist()
+
+
+# a basin with a hole and a vertical and a zero length edge, and a star shaped basin next to it
+POLYGONS = [
+	[[(1000.0, 1000.0), (1000.0, 4000.0), (1000.0, 4000.0), (4300.0, 4730.0), (5150.0, 1210.0), (1000.0, 1000.0)],
+	 [(2000.0, 2000.0), (3500.0, 2100.0), (2600.0, 3300.0), (2000.0, 2000.0)]],
+	[star(6800.0, 3000.0, 1700.0)],
+]
+
+
+def brute_force(xs, ys, distance):
+	"""grid points inside a polygon or within distance of an edge, every point against every edge"""
+	x, y = numpy.meshgrid(xs, ys)
+	keep = numpy.zeros(x.shape, dtype=bool)
+	for polygon in POLYGONS:
+		keep |= inside_rings(x, y, polygon)
+	x0, y0, x1, y1 = geometry.ring_edges([ring for polygon in POLYGONS for ring in polygon])
+	nearest = geometry.segment_distance(x[..., None], y[..., None], x0, y0, x1, y1).min(axis=-1)
+	return keep, nearest
+
+
+@pytest.mark.parametrize("block_size", [65536, 3])
+def test_near_rings_matches_brute_force(block_size):
+	xs, ys = predictor_grid.lattice(0.0, 0.0, 10000.0, 6000.0, 97.0)
+	rings = [ring for polygon in POLYGONS for ring in polygon]
+	near = predictor_grid.near_rings(xs, ys, rings, DISTANCE, block_size)
+	nearest = brute_force(xs, ys, DISTANCE)[1]
+	assert near.any() and not near.all()
+	ties = numpy.abs(nearest - DISTANCE) < 1e-6
+	assert numpy.array_equal(near[~ties], nearest[~ties] <= DISTANCE)
+
+
+@pytest.mark.parametrize("distance", [0.0, DISTANCE])
+def test_grid_points_match_brute_force(distance):
+	ids, x, y = predictor_grid.grid_points(POLYGONS, SPACING, distance)
+	points = numpy.vstack([ring for polygon in POLYGONS for ring in polygon])
+	xs, ys = predictor_grid.lattice(points[:, 0].min() - distance, points[:, 1].min() - distance,
+	                                points[:, 0].max() + distance, points[:, 1].max() + distance, SPACING)
+	inside, nearest = brute_force(xs, ys, distance)
+	keep = inside | (nearest <= distance) if distance else inside
+	rows, cols = numpy.nonzero(keep)
+
+	# numbered along the rows from the lower left corner, like the fishnet
+	assert ids.tolist() == list(range(1, rows.size + 1))
+	assert numpy.array_equal(x, xs[cols]) and numpy.array_equal(y, ys[rows])
+	assert numpy.all(numpy.diff(y) >= 0) and numpy.all(numpy.diff(x)[numpy.diff(y) == 0] > 0)
+	# the points are fishnet cell centers
+	assert numpy.allclose((x - points[:, 0].min() + distance) / SPACING % 1, 0.5)
+	if not distance:
+		assert not inside_rings(x, y, POLYGONS[0][1:]).any()  # the hole is left out
+
+
+def test_main_writes_points_and_circles(tmp_path, gdal):
+	geometries = [{"type": "Polygon", "coordinates": polygon} for polygon in POLYGONS]
+	basin = write_features(str(tmp_path / "basin.shp"), "Polygon", geometries, {"BASIN": [1, 2]})
+	output, circles = str(tmp_path / "grid_points.shp"), str(tmp_path / "grid_circles.csv")
+	ids, x, y = predictor_grid.main(basin, output, SPACING, "600 Meters", circles, "300 Meters", backend=gdal)
+	expected = predictor_grid.grid_points(POLYGONS, SPACING, DISTANCE)
+	assert numpy.array_equal(ids, expected[0])
+	assert numpy.allclose(x, expected[1]) and numpy.allclose(y, expected[2])
+
+	read_ids, read_x, read_y = gdal.read_points(output, "GRIDID")
+	assert read_ids.tolist() == ids.tolist()
+	assert numpy.allclose(read_x, x) and numpy.allclose(read_y, y)
+	assert gdal.spatial_reference(output) == gdal.spatial_reference(basin)
+
+	circle_ids, circle_x, circle_y, radius = io_backend.read_circles(gdal, circles, "GRIDID")
+	assert circle_ids.tolist() == ids.tolist()
+	assert numpy.allclose(circle_x, x) and numpy.allclose(circle_y, y)
+	assert radius.tolist() == [300.0] * ids.size
+	assert os.path.exists(str(tmp_path / "grid_circles.prj"))
+	assert gdal.fiona.crs.CRS.from_wkt(open(str(tmp_path / "grid_circles.prj")).read()) == \
+	       gdal.fiona.crs.CRS.from_string(CRS)
@@ -0,0 +1,259 @@
+# ---------------------------------------------------------------------------------------------------
+# Name: test_zonal_engine.py
+# Purpose: the numpy zonal engine against brute force per cell statistics on synthetic GeoTIFFs and overlapping
+#          zone polygons written with rasterio and fiona
+# ---------------------------------------------------------------------------------------------------
+
+from collections import OrderedDict
+
+import numpy
+import pytest
+
+import geometry
+import zonal_engine
+from synthetic import inside_rings, write_features, write_raster
+
+CELL = 100.0
+NROWS, NCOLS = 40, 50
+XMIN, YMAX = 0.0, 4000.0
+NODATA = -9999.0
+
+
+def square(x0, y0, x1, y1):
+	return [(x0, y0), (x0, y1), (x1, y1), (x1, y0), (x0, y0)]
+
+
+# overlapping zones: a triangle, a square with a hole, a star and a rectangle partly outside of the grid
+POLYGONS = [
+	[[(250.0, 330.0), (2710.0, 780.0), (1160.0, 3320.0), (250.0, 330.0)]],
+	[square(1030.0, 1010.0, 3470.0, 3390.0), square(1890.0, 1770.0, 2650.0, 2590.0)[::-1]],
+	[[(3000.0 + r * numpy.cos(a), 2000.0 + r * numpy.sin(a)) for a, r in
+	  zip(numpy.linspace(2 * numpy.pi, 0, 16, endpoint=False), [1300.0, 520.0] * 8)]],
+	[square(4400.0, -300.0, 5600.0, 1250.0)],
+]
+ZONE_IDS = numpy.array([11, 12, 13, 14])
+
+
+@pytest.fixture
+def datasets(tmp_path):
+	random = numpy.random.RandomState(0)
+	values = random.uniform(-5, 50, (NROWS, NCOLS)).astype(numpy.float32)
+	nodata = random.uniform(size=values.shape) < 0.05
+	nodata[:, 10:] = False  # only the triangle covers nodata cells
+	values[nodata] = NODATA
+	classes = random.choice([0, 1, 2, 5, 7], (NROWS, NCOLS)).astype(numpy.int16)
+	geometries = [{"type": "Polygon", "coordinates": rings} for rings in POLYGONS]
+	return {
+		"values": write_raster(str(tmp_path / "values.tif"), values, XMIN, YMAX, CELL, NODATA),
+		"classes": write_raster(str(tmp_path / "classes.tif"), classes, XMIN, YMAX, CELL, 0),
+		"zones": write_features(str(tmp_path / "zones.shp"), "Polygon", geometries, {"WELLID": ZONE_IDS.tolist()}),
+	}
+
+
+def cell_centers():
+	rows, cols = numpy.mgrid[0:NROWS, 0:NCOLS]
+	return XMIN + (cols + 0.5) * CELL, YMAX - (rows + 0.5) * CELL
+
+
+def read_coverage(gdal, datasets):
+	reader, grid, nodata = gdal.read_raster(datasets["values"])
+	ids, polygons = gdal.read_polygons(datasets["zones"], "WELLID")
+	return zonal_engine.rasterize_polygons(grid, ids, polygons)
+
+
+@pytest.mark.parametrize("block_size", [2048, 7])
+def test_zonal_statistics_matches_brute_force(gdal, datasets, block_size):
+	coverage = read_coverage(gdal, datasets)
+	reader, grid, nodata = gdal.read_raster(datasets["values"])
+	table = zonal_engine.zonal_statistics(coverage, reader, nodata, "ALL", zone_field="WELLID", block_size=block_size)
+
+	values = zonal_engine.read_raster(datasets["values"])[0].astype(numpy.float64)
+	x, y = cell_centers()
+	assert table["WELLID"].tolist() == ZONE_IDS.tolist()
+	for row, rings in zip(table, POLYGONS):
+		cells = values[inside_rings(x, y, rings) & (values != NODATA)]
+		assert row["COUNT"] == cells.size
+		assert row["AREA"] == cells.size * CELL * CELL
+		assert row["MIN"] == pytest.approx(cells.min())
+		assert row["MAX"] == pytest.approx(cells.max())
+		assert row["MEAN"] == pytest.approx(cells.mean(), rel=1e-12)
+		assert row["STD"] == pytest.approx(cells.std(), rel=1e-10)
+		assert row["SUM"] == pytest.approx(cells.sum(), rel=1e-12)
+
+
+def test_zones_with_nodata_left_out(gdal, datasets):
+	coverage = read_coverage(gdal, datasets)
+	values, grid, nodata = zonal_engine.read_raster(datasets["values"])
+	table = zonal_engine.zonal_statistics(coverage, values, nodata, "MEAN", ignore_nodata=False, zone_field="WELLID")
+	x, y = cell_centers()
+	clean = [zone for zone, rings in zip(ZONE_IDS, POLYGONS) if not (values[inside_rings(x, y, rings)] == NODATA).any()]
+	assert table["WELLID"].tolist() == clean == [12, 13, 14]
+
+
+@pytest.mark.parametrize("block_size", [2048, 7])
+def test_tabulate_area_matches_brute_force(gdal, datasets, block_size):
+	coverage = read_coverage(gdal, datasets)
+	reader, grid, nodata = gdal.read_raster(datasets["classes"])
+	table = zonal_engine.tabulate_area(coverage, reader, nodata, "WELLID", block_size=block_size)
+
+	classes = zonal_engine.read_raster(datasets["classes"])[0]
+	x, y = cell_centers()
+	assert table.dtype.names == ("WELLID", "VALUE_1", "VALUE_2", "VALUE_5", "VALUE_7")
+	for row, rings in zip(table, POLYGONS):
+		inside = inside_rings(x, y, rings)
+		for value in (1, 2, 5, 7):
+			assert row["VALUE_%d" % value] == numpy.sum(inside & (classes == value)) * CELL * CELL
+
+
+def fine_fractions(grid, cx, cy, radius, samples=200):
+	"""fraction of every cell inside the circle from samples x samples points per cell"""
+	offsets = (numpy.arange(samples) + 0.5) / samples
+	fractions = numpy.zeros(grid.shape)
+	row0, row1, col0, col1 = grid.window(cx - radius, cy - radius, cx + radius, cy + radius)
+	for row in range(row0, row1):
+		for col in range(col0, col1):
+			x = grid.xmin + (col + offsets[None, :]) * grid.cell_width
+			y = grid.ymax - (row + offsets[:, None]) * grid.cell_height
+			fractions[row, col] = numpy.mean(numpy.hypot(x - cx, y - cy) <= radius)
+	return fractions
+
+
+def test_exact_circle_coverage(gdal, datasets):
+	reader, grid, nodata = gdal.read_raster(datasets["classes"])
+	x = numpy.array([1234.5, 1290.0, 4980.0])
+	y = numpy.array([2111.1, 2150.0, 170.0])  # the last circle is cut by the grid edge
+	radius = 430.0
+	coverage = zonal_engine.rasterize_circles(grid, ZONE_IDS[:3], x, y, radius, supersample=4)
+
+	weights = numpy.zeros((3,) + grid.shape)
+	weights.reshape(3, -1)[coverage.zones, coverage.entry_cells()] = coverage.weights
+	assert weights[0].sum() * grid.cell_area == pytest.approx(numpy.pi * radius ** 2, rel=1e-12)
+	for zone in range(3):
+		assert numpy.abs(weights[zone] - fine_fractions(grid, x[zone], y[zone], radius)).max() < 0.01
+
+	# the buffer polygons of the same points are recognized as circles and rasterized the same way
+	rings = geometry.circle_rings(x, y, radius, segments=720)
+	geometries = [{"type": "Polygon", "coordinates": [ring.tolist() + [ring[0].tolist()]]} for ring in rings]
+	buffers = write_features(str(datasets["zones"]).replace("zones", "buffers"), "Polygon", geometries,
+	                         {"WELLID": ZONE_IDS[:3].tolist()})
+	ids, polygons = gdal.read_polygons(buffers, "WELLID")
+	buffered = zonal_engine.rasterize_buffers(grid, ids, polygons, supersample=4)
+	assert numpy.array_equal(buffered.cells, coverage.cells)
+	assert numpy.allclose(buffered.weights, coverage.weights, atol=1e-3)
+
+	# tabulated area is the weight of every cell of each class times the cell area
+	classes = zonal_engine.read_raster(datasets["classes"])[0]
+	table = zonal_engine.tabulate_area(coverage, reader, nodata, "WELLID", block_size=5)
+	for zone, row in enumerate(table):
+		for value in (1, 2, 5, 7):
+			expected = weights[zone][classes == value].sum() * grid.cell_area
+			assert row["VALUE_%d" % value] == pytest.approx(expected, rel=1e-12)
+
+
+def test_tabulate_area_unsorted_classes(gdal, datasets):
+	coverage = read_coverage(gdal, datasets)
+	classes, grid, nodata = zonal_engine.read_raster(datasets["classes"])
+	table = zonal_engine.tabulate_area(coverage, classes, nodata, "WELLID", classes=[7, 2, 5, 2])
+	expected = zonal_engine.tabulate_area(coverage, classes, nodata, "WELLID")
+	assert table.dtype.names == ("WELLID", "VALUE_2", "VALUE_5", "VALUE_7")
+	for field in table.dtype.names:
+		assert numpy.array_equal(table[field], expected[field])
+
+
+def class_layers(datasets, count=3):
+	"""co-registered class rasters of count years, each year changes some of the cells and has its own nodata"""
+	classes = zonal_engine.read_raster(datasets["classes"])[0]
+	random = numpy.random.RandomState(1)
+	layers = [classes]
+	for year in range(1, count):
+		changed = layers[-1].copy()
+		change = random.uniform(size=classes.shape) < 0.3
+		changed[change] = random.choice([1, 2, 5, 7, 9], change.sum())
+		changed[random.uniform(size=classes.shape) < 0.02] = 0
+		layers.append(changed)
+	return layers
+
+
+@pytest.mark.parametrize("block_size,max_rows", [(2048, 5000000), (7, 10)])
+def test_transitions_match_brute_force(gdal, datasets, monkeypatch, block_size, max_rows):
+	accumulator = zonal_engine.TransitionAccumulator
+	monkeypatch.setattr(zonal_engine, "TransitionAccumulator", lambda: accumulator(max_rows))  # compacted parts
+	coverage = read_coverage(gdal, datasets)
+	layers = class_layers(datasets)
+	tables = zonal_engine.transition_tables(coverage, [(1990 + 15 * i, values, 0) for i, values in enumerate(layers)],
+	                                        "WELLID", block_size)
+	assert list(tables) == [(1990, 2005), (2005, 2020)]
+
+	x, y = cell_centers()
+	for (from_values, to_values), table in zip(zip(layers[:-1], layers[1:]), tables.values()):
+		assert table.dtype.names == ("WELLID", "FROM_CLASS", "TO_CLASS", "AREA")
+		expected = {}
+		for zone, rings in zip(ZONE_IDS, POLYGONS):
+			cells = inside_rings(x, y, rings) & (from_values != 0) & (to_values != 0)
+			for a, b in zip(from_values[cells].tolist(), to_values[cells].tolist()):
+				expected[zone, a, b] = expected.get((zone, a, b), 0) + CELL * CELL
+		assert dict(((z, a, b), area) for z, a, b, area in table.tolist()) == expected
+		assert len(set(zip(table["WELLID"].tolist(), table["FROM_CLASS"].tolist(), table["TO_CLASS"].tolist()))) == \
+		       table.size
+
+
+@pytest.mark.parametrize("block_size", [2048, 7])
+def test_tabulate_area_stack_matches_tabulate_area(gdal, datasets, block_size):
+	coverage = read_coverage(gdal, datasets)
+	years = class_layers(datasets)
+	# a year with negative and fractional classes (nodata -1)
+	layers = [(1990, years[0], 0), (2005, years[1], 0), (2020, years[2].astype(numpy.float64) * 0.5 - 1, -1)]
+	tables, classes = zonal_engine.tabulate_area_stack(coverage, layers, "WELLID", block_size, return_classes=True)
+	assert list(tables) == list(classes) == [1990, 2005, 2020]
+	assert classes[2020].tolist() == [-0.5, 0.0, 1.5, 2.5, 3.5]
+	for year, values, nodata in layers:
+		expected = zonal_engine.tabulate_area(coverage, values, nodata, "WELLID")
+		assert tables[year].dtype == expected.dtype
+		for field in expected.dtype.names:
+			assert numpy.array_equal(tables[year][field], expected[field])
+
+	long = zonal_engine.long_table(tables, classes, "WELLID", "YEAR")
+	assert long.dtype.names == ("WELLID", "YEAR", "CLASS", "AREA") and long["CLASS"].dtype == numpy.float64
+	rows = dict(((zone, year, value), area) for zone, year, value, area in long.tolist())
+	for year, table in tables.items():
+		for field, value in zip(table.dtype.names[1:], classes[year]):
+			for zone, area in zip(table["WELLID"].tolist(), table[field].tolist()):
+				assert rows.pop((zone, year, value), 0.0) == area
+	assert not rows
+	assert numpy.all(numpy.diff(numpy.lexsort((long["CLASS"], long["YEAR"], long["WELLID"]))) == 1)
+
+	integer = zonal_engine.long_table(OrderedDict(list(tables.items())[:2]), classes, "WELLID", "YEAR")
+	assert integer["CLASS"].dtype == numpy.int64 and set(integer["CLASS"].tolist()) == {1, 2, 5, 7, 9}
+
+
+def test_zonal_tables_and_wide_table(gdal, datasets):
+	coverage = read_coverage(gdal, datasets)
+	values, grid, nodata = zonal_engine.read_raster(datasets["values"])
+	classes, grid, class_nodata = zonal_engine.read_raster(datasets["classes"])
+	layers = [("NDEP", values, nodata, "MEAN"), ("LANDUSE", classes, class_nodata, "area"),
+	          ("ALL", values, nodata, "ALL")]
+	tables = zonal_engine.zonal_tables(coverage, layers, "WELLID", block_size=7)
+	assert list(tables) == ["NDEP", "LANDUSE", "ALL"]
+	expected = [zonal_engine.zonal_statistics(coverage, values, nodata, "MEAN", zone_field="WELLID"),
+	            zonal_engine.tabulate_area(coverage, classes, class_nodata, "WELLID"),
+	            zonal_engine.zonal_statistics(coverage, values, nodata, "ALL", zone_field="WELLID")]
+	for table, table_expected in zip(tables.values(), expected):
+		assert table.dtype == table_expected.dtype
+		for field in table.dtype.names:
+			numpy.testing.assert_allclose(table[field], table_expected[field], rtol=1e-12)
+
+	# zones missing from a table are nan, the fields are <name>_<field> in the order of the tables
+	tables["NDEP"] = tables["NDEP"][tables["NDEP"]["WELLID"] != 12]
+	tables["LANDUSE"] = tables["LANDUSE"][::-1]
+	wide = zonal_engine.wide_table(tables, "WELLID")
+	assert wide["WELLID"].tolist() == ZONE_IDS.tolist()
+	assert wide.dtype.names == ("WELLID",) + tuple("%s_%s" % (name, field) for name, table in tables.items()
+	                                               for field in table.dtype.names[1:])
+	for name, table in tables.items():
+		rows = numpy.searchsorted(ZONE_IDS, table["WELLID"])
+		for field in table.dtype.names[1:]:
+			column = wide["%s_%s" % (name, field)]
+			assert column.dtype == numpy.float64
+			assert numpy.array_equal(column[rows], table[field].astype(numpy.float64))
+			assert numpy.isnan(numpy.delete(column, rows)).all()
+	assert numpy.isnan(wide["NDEP_MEAN"][1]) and not numpy.isnan(wide["ALL_MEAN"][1])